@@ -1,14 +1,23 @@
 import json
-import serial
+import math
 import threading
+import time
 from time import sleep
-from config import SERIAL_PORT, SERIAL_BAUD, SERIAL_TIMEOUT_SEC, TIME_PER_METER_SEC, SERIAL_PORT_CONTROL, SERIAL_BAUD_CONTROL
+from config import (SERIAL_PORT, SERIAL_BAUD, GPS_DECODERS, GPS_MAX_HDOP, AVOID_WAIT_SEC, AVOID_PASS_M,
+                    AVOID_MAX_LEG_M, AVOID_TIMEOUT_SEC, GPS_FIX_MAX_AGE_SEC)
+from gps_parser import StreamParser
+from settings_store import settings
+from local_planner import vfh_planner
+from serial_io import serial_core
 
 class SerialData:
     """Bộ nhớ chia sẻ để lưu dữ liệu GPS mới nhất từ ESP32"""
     def __init__(self):
-        self.latest = {"lat": 21.0278, "lon": 105.8342, "yaw": 0.0}
+        self.latest = {"lat": 21.0278, "lon": 105.8342, "yaw": 0.0, "speed": 0.0,
+                       "fix_quality": None, "hdop": None, "gps_time": None, "timestamp": None,
+                       "fix_timestamp": None, "speed_timestamp": None}
         self.lock = threading.Lock()
+        self.parser_stats = {}
         # Thêm biến điều khiển route
         self.route_running = False
         self.route_paused = False
@@ -20,14 +29,31 @@ class SerialData:
         # Thêm biến LIDAR obstacle detection
         self.lidar_obstacle_detected = False
         self.lidar_min_distance = float('inf')
+        self.lidar_ttc = None
+        self.lidar_zone = "static"
+        # Lệnh chuyển động dự định của route ('T', 'L', 'R' hoặc None khi không chạy route)
+        self.motion_command = None
 
     def update(self, data: dict):
         with self.lock:
+            now = time.time()
             self.latest.update(data)
+            self.latest["timestamp"] = now
+            # Chỉ message mang tọa độ mới tính là có fix (yaw-only, RMC void, HDOP lớn thì không)
+            if data.get("lat") is not None and data.get("lon") is not None:
+                self.latest["fix_timestamp"] = now
+            if data.get("speed") is not None:
+                self.latest["speed_timestamp"] = now
 
     def snapshot(self):
         with self.lock:
             return dict(self.latest)
+
+    @staticmethod
+    def has_fix(snap, max_age=GPS_FIX_MAX_AGE_SEC):
+        """Snapshot có vị trí GPS thật và còn mới (lat/lon mặc định lúc khởi động không tính)"""
+        fix_time = snap.get("fix_timestamp")
+        return fix_time is not None and time.time() - fix_time <= max_age
     
     def set_route_state(self, running=None, paused=None, stopped=None):
         with self.lock:
@@ -57,220 +83,169 @@ class SerialData:
             self.current_action = action
             self.distance_remaining = distance_remaining
     
-    def set_lidar_obstacle(self, detected, min_distance=float('inf')):
+    def set_lidar_obstacle(self, detected, min_distance=float('inf'), ttc=None, zone="static"):
         """Cập nhật trạng thái phát hiện vật cản từ LIDAR"""
         with self.lock:
             self.lidar_obstacle_detected = detected
             self.lidar_min_distance = min_distance
+            self.lidar_ttc = ttc
+            self.lidar_zone = zone
+    
+    def set_motion(self, command):
+        """Lệnh chuyển động dự định ('T', 'L', 'R' hoặc None)"""
+        with self.lock:
+            self.motion_command = command
+    
+    def get_motion(self):
+        with self.lock:
+            return self.motion_command
     
     def get_lidar_obstacle(self):
         """Lấy trạng thái phát hiện vật cản"""
         with self.lock:
             return {
                 "detected": self.lidar_obstacle_detected,
-                "min_distance": self.lidar_min_distance
+                "min_distance": self.lidar_min_distance,
+                "ttc": self.lidar_ttc,
+                "zone": self.lidar_zone
             }
 
-def start_serial_thread(shared_data: SerialData):
-    """Luồng đọc dữ liệu GPS và góc quay từ ESP32"""
+def start_gps_reader(shared_data: SerialData, track, port=SERIAL_PORT, baudrate=SERIAL_BAUD):
+    """
+    Đọc dữ liệu GPS và góc quay (ESP32 CSV, NMEA hoặc UBX) trên serial core:
+    không có thread riêng, callback chạy trong event loop mỗi khi cổng có dữ liệu.
+    track: TrackHistory của rover. Trả về SerialPort.
+    """
+    parser = StreamParser(GPS_DECODERS)
+
+    def on_data(chunk):
+        # In ra giá trị thô nhận được để debug
+        # print(f"[Serial] Raw: {chunk!r}")
+        for data in parser.feed(chunk):
+            # Bỏ tọa độ có HDOP quá lớn (fix kém), vẫn giữ yaw/tốc độ
+            hdop = data.get("hdop")
+            if hdop is not None and hdop > GPS_MAX_HDOP:
+                data.pop("lat", None)
+                data.pop("lon", None)
+            shared_data.update(data)
+            # Lưu vào lịch sử đường đi khi có tọa độ mới
+            if data.get("lat") is not None and data.get("lon") is not None:
+                snap = shared_data.snapshot()
+                track.append(snap["timestamp"], snap["lat"], snap["lon"],
+                             snap.get("yaw", 0.0), snap.get("speed", 0.0))
+        shared_data.parser_stats = parser.stats()
+
+    return serial_core.open_port(port, baudrate, on_data)
+
+def _yaw_delta(start_yaw, current_yaw):
+    """Góc đã quay từ start_yaw (độ, dương = trái), xử lý vòng qua 0/360"""
+    return (current_yaw - start_yaw + 180.0) % 360.0 - 180.0
+
+def _wait_clear(ser, shared_data, deadline):
+    """Gửi 'S' cho đến khi hết vật cản. Trả về 'ok', 'stopped' hoặc 'timeout'"""
+    while shared_data.get_lidar_obstacle()["detected"]:
+        ser.write(b'S')
+        if shared_data.get_route_state()["stopped"]:
+            return "stopped"
+        if time.time() > deadline:
+            return "timeout"
+        sleep(0.1)
+    return "ok"
+
+def _hold_if_paused(ser, shared_data):
+    while shared_data.get_route_state()["paused"]:
+        ser.write(b'S')
+        sleep(0.1)
+
+def _turn_by(ser, shared_data, delta_deg, deadline):
+    """Quay tại chỗ delta_deg (dương = trái) theo yaw. Trả về 'ok', 'stopped' hoặc 'timeout'"""
+    cmd = b'L' if delta_deg > 0 else b'R'
+    sign = 1.0 if delta_deg > 0 else -1.0
+    shared_data.set_motion(cmd.decode())
+    start_yaw = shared_data.snapshot().get("yaw", 0.0)
     while True:
-        try:
-            with serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=SERIAL_TIMEOUT_SEC) as ser:
-                while True:
-                    line = ser.readline().decode(errors="ignore").strip()
-                    if not line:
-                        continue
-                    # In ra giá trị thô nhận được để debug
-                    # print(f"[Serial] Raw: {line}")
-                    try:
-                        # Dữ liệu dạng: yaw,lat,lon,speed
-                        parts = line.split(",")
-                        if len(parts) >= 3:
-                            yaw = float(parts[0])
-                            lat = float(parts[1])
-                            lon = float(parts[2])
-                            # Nếu lat/lon đều 0 thì bỏ qua (giữ tọa độ cũ)
-                            if lat == 0.0 and lon == 0.0:
-                                data = {"yaw": yaw}  # chỉ cập nhật yaw
-                            else:
-                                data = {"lat": lat, "lon": lon, "yaw": yaw}
-                            shared_data.update(data)
-                    except (ValueError, IndexError) as e:
-                        print(f"[Serial] Parsing error: {e} -> '{line}'")
-        except Exception as e:
-            print(f"[Serial] Error: {e}. Reconnecting in 2s...")
-            sleep(2)
-def execute_route_commands(shared_data: SerialData, dis_list, dir_list, dir_value_list):
+        _hold_if_paused(ser, shared_data)
+        if shared_data.get_route_state()["stopped"]:
+            return "stopped"
+        status = _wait_clear(ser, shared_data, deadline)
+        if status != "ok":
+            return status
+        turned = sign * _yaw_delta(start_yaw, shared_data.snapshot().get("yaw", 0.0))
+        if turned >= abs(delta_deg):
+            return "ok"
+        if time.time() > deadline:
+            return "timeout"
+        ser.write(cmd)
+        sleep(0.05)
+
+def _drive(ser, shared_data, meters, deadline):
+    """Đi thẳng meters mét (theo TIME_PER_METER_SEC). Trả về 'ok', 'stopped' hoặc 'timeout'"""
+    shared_data.set_motion('T')
+    total_time = settings.current["TIME_PER_METER_SEC"] * meters
+    elapsed = 0
+    interval = 0.1
+    while elapsed < total_time:
+        _hold_if_paused(ser, shared_data)
+        if shared_data.get_route_state()["stopped"]:
+            return "stopped"
+        status = _wait_clear(ser, shared_data, deadline)
+        if status != "ok":
+            return status
+        if time.time() > deadline:
+            return "timeout"
+        ser.write(b'T')
+        sleep(interval)
+        elapsed += interval
+    return "ok"
+
+def avoid_obstacle(ser, shared_data, lidar, report):
     """
-    Thực thi tuần tự các lệnh điều khiển xe dựa trên các mảng dis, dir, dir_value.
-    dis_list: [quãng đường di chuyển]
-    dir_list: [hướng rẽ: -1 trái, 1 phải, 0 đi thẳng/dừng]
-    dir_value_list: [góc quay (độ)]
+    Vòng tránh vật cản phía trước rồi nhập lại đoạn đường:
+    chờ ngắn (vật có thể tự rời đi) -> chọn hướng bằng VFH trên vòng quét mới nhất ->
+    tạt ra (quay h, đi), đi song song vượt vật, tạt vào (quay -h, đi), quay về hướng cũ.
+    lidar: LidarDevice của rover; report(text): cập nhật tiến trình lên giao diện.
+    Trả về (kết quả, quãng đường đã tiến theo hướng đoạn đường - mét), kết quả là
+    'cleared', 'bypassed', 'stopped', 'no_path' hoặc 'timeout'
     """
-    try:
-        print("[Serial] === Route execution started ===")
-        shared_data.set_route_state(running=True, paused=False, stopped=False)
-        shared_data.update_route_progress(0, len(dis_list), "Bắt đầu hành trình...")
-        
-        with serial.Serial(SERIAL_PORT_CONTROL, SERIAL_BAUD_CONTROL, timeout=SERIAL_TIMEOUT_SEC) as ser:
-            for i in range(len(dis_list)):
-                # Kiểm tra nếu bị dừng
-                if shared_data.get_route_state()["stopped"]:
-                    print("[Serial] Route stopped by user")
-                    ser.write(b'S')  # Gửi lệnh dừng
-                    shared_data.update_route_progress(i, len(dis_list), "Đã dừng")
-                    break
-                
-                distance = float(dis_list[i])
-                direction = int(dir_list[i])
-                angle = float(dir_value_list[i])
+    deadline = time.time() + AVOID_TIMEOUT_SEC
+    status = _wait_clear(ser, shared_data, min(deadline, time.time() + AVOID_WAIT_SEC))
+    if status == "ok":
+        return "cleared", 0.0
+    if status == "stopped":
+        return "stopped", 0.0
 
-                print(f"[Serial] Step {i+1}/{len(dis_list)}: dis={distance:.2f}, dir={direction}, angle={angle:.2f}")
+    frame = lidar.scan_assembler.get_latest(max_age=settings.current["LIDAR_DOT_LIFETIME"])
+    plan = vfh_planner.plan(*frame.points()) if frame is not None else None
+    if plan is None:
+        print("[Serial] No free heading for bypass")
+        return "no_path", 0.0
+    heading = plan["heading"]
+    cos_h = math.cos(math.radians(heading))
+    leg = min(max(plan["obstacle_range"], 0.5) / max(cos_h, 0.1), AVOID_MAX_LEG_M)
+    side = "trái" if heading > 0 else "phải"
+    print(f"[Serial] Bypass: heading={heading:.0f}°, leg={leg:.2f}m, plan={vfh_planner.last_plan_ms:.2f}ms")
 
-                # Bước 1: Đi tiến - gửi 'T' liên tục
-                shared_data.update_route_progress(i+1, len(dis_list), f"Đi thẳng", distance)
-                ser.write(b'T')
-                print(f"[Serial] Send: T (forward {distance:.2f}m)")
-                total_time = TIME_PER_METER_SEC * distance
-                elapsed = 0
-                interval = 0.1  # gửi lệnh mỗi 0.1s
-                
-                while elapsed < total_time:
-                    # Kiểm tra pause
-                    while shared_data.get_route_state()["paused"]:
-                        ser.write(b'S')  # Dừng xe
-                        shared_data.update_route_progress(i+1, len(dis_list), "Đang tạm dừng...", distance * (1 - elapsed/total_time))
-                        sleep(0.1)
-                    
-                    # Kiểm tra LIDAR obstacle (vật cản < 400mm phía trước)
-                    lidar_status = shared_data.get_lidar_obstacle()
-                    if lidar_status["detected"]:
-                        print(f"[Serial] ⚠️ LIDAR OBSTACLE DETECTED! Distance: {lidar_status['min_distance']:.0f}mm - STOPPING")
-                        shared_data.update_route_progress(i+1, len(dis_list), 
-                            f"⚠️ Phát hiện vật cản {lidar_status['min_distance']:.0f}mm - Tạm dừng", 
-                            distance * (1 - elapsed/total_time))
-                        
-                        # Chờ cho đến khi vật cản được di chuyển - GỬI 'S' LIÊN TỤC
-                        while lidar_status["detected"]:
-                            ser.write(b'S')  # Gửi lệnh dừng liên tục
-                            if shared_data.get_route_state()["stopped"]:
-                                print("[Serial] Route stopped during LIDAR obstacle wait")
-                                return
-                            sleep(0.1)
-                            lidar_status = shared_data.get_lidar_obstacle()
-                        
-                        print(f"[Serial] LIDAR obstacle cleared - Resuming movement")
-                        shared_data.update_route_progress(i+1, len(dis_list), "Tiếp tục di chuyển", distance * (1 - elapsed/total_time))
-                    
-                    # Kiểm tra stop
-                    if shared_data.get_route_state()["stopped"]:
-                        ser.write(b'S')
-                        shared_data.update_route_progress(i+1, len(dis_list), "Đã dừng")
-                        print("[Serial] Route stopped during movement")
-                        return
-                    
-                    ser.write(b'T')
-                    remaining_distance = distance * (1 - elapsed/total_time)
-                    shared_data.update_route_progress(i+1, len(dis_list), f"Đi thẳng", remaining_distance)
-                    sleep(interval)
-                    elapsed += interval
-                
-                shared_data.update_route_progress(i+1, len(dis_list), f"Đã đi xong {distance:.2f}m", 0)
-                
-                # Bước 2: Kiểm tra xem có cần quay không
-                if direction != 0:
-                    # Kiểm tra stop trước khi quay
-                    if shared_data.get_route_state()["stopped"]:
-                        ser.write(b'S')
-                        shared_data.update_route_progress(i+1, len(dis_list), "Đã dừng")
-                        return
-                    
-                    turn_direction = "trái" if direction == -1 else "phải"
-                    shared_data.update_route_progress(i+1, len(dis_list), f"Quay {turn_direction} {angle:.2f}°")
-                    
-                    # Quay trái/phải - gửi 'L' hoặc 'R' liên tục
-                    cmd = b'L' if direction == -1 else b'R'
-                    print(f"[Serial] Send: {cmd.decode()} (turn {angle:.2f}°)")
-                    
-                    # Đọc giá trị yaw hiện tại
-                    start_yaw = shared_data.snapshot().get("yaw", 0.0)
-                    target_yaw = start_yaw + angle if direction == -1 else start_yaw - angle
-                    
-                    # Xử lý góc quay tròn
-                    if target_yaw < 0:
-                        target_yaw += 360
-                    elif target_yaw >= 360:
-                        target_yaw -= 360
-                    
-                    print(f"[Serial] Start yaw: {start_yaw:.2f}°, Target yaw: {target_yaw:.2f}°, Need to turn: {angle:.2f}°")
-                    
-                    while True:
-                        # Kiểm tra pause
-                        while shared_data.get_route_state()["paused"]:
-                            ser.write(b'S')
-                            shared_data.update_route_progress(i+1, len(dis_list), "Đang tạm dừng...")
-                            sleep(0.1)
-                        
-                        # Kiểm tra LIDAR obstacle (vật cản < 400mm trong -20° đến 20°)
-                        lidar_status = shared_data.get_lidar_obstacle()
-                        if lidar_status["detected"]:
-                            print(f"[Serial] ⚠️ LIDAR OBSTACLE DETECTED during turn! Distance: {lidar_status['min_distance']:.0f}mm - STOPPING")
-                            shared_data.update_route_progress(i+1, len(dis_list), 
-                                f"⚠️ Phát hiện vật cản {lidar_status['min_distance']:.0f}mm - Tạm dừng", 
-                                0)
-                            
-                            # Chờ cho đến khi vật cản được di chuyển - GỬI 'S' LIÊN TỤC
-                            while lidar_status["detected"]:
-                                ser.write(b'S')  # Gửi lệnh dừng liên tục
-                                if shared_data.get_route_state()["stopped"]:
-                                    print("[Serial] Route stopped during LIDAR obstacle wait (turn)")
-                                    return
-                                sleep(0.1)
-                                lidar_status = shared_data.get_lidar_obstacle()
-                            
-                            print(f"[Serial] LIDAR obstacle cleared - Resuming turn")
-                            shared_data.update_route_progress(i+1, len(dis_list), f"Tiếp tục quay {turn_direction}", 0)
-                        
-                        # Kiểm tra stop
-                        if shared_data.get_route_state()["stopped"]:
-                            ser.write(b'S')
-                            shared_data.update_route_progress(i+1, len(dis_list), "Đã dừng")
-                            return
-                        
-                        current_yaw = shared_data.snapshot().get("yaw", 0.0)
-                        
-                        # Tính góc đã quay được
-                        if direction == -1:  # Quay trái (yaw tăng)
-                            diff = current_yaw - start_yaw
-                        else:  # Quay phải (yaw giảm)
-                            diff = start_yaw - current_yaw
-                        
-                        # Đảm bảo diff >= 0 (bỏ qua nhiễu âm)
-                        if diff < 0:
-                            diff = 0
-                        
-                        remaining_angle = angle - diff
-                        shared_data.update_route_progress(i+1, len(dis_list), f"Quay {turn_direction} (còn {remaining_angle:.1f}°)")
-                        
-                        print(f"[Serial] Start: {start_yaw:.2f}°, Current: {current_yaw:.2f}°, Target: {target_yaw:.2f}°, Turned: {diff:.2f}°/{angle:.2f}°")
-                        
-                        if diff >= angle:
-                            print(f"[Serial] Done turn {angle:.2f}° (yaw={current_yaw:.2f})")
-                            shared_data.update_route_progress(i+1, len(dis_list), f"Đã quay xong {angle:.2f}°")
-                            break
-                        
-                        ser.write(cmd)  # gửi lệnh quay liên tục
-                        sleep(0.05)
-                else:
-                    print(f"[Serial] No turn needed (final destination or straight path)")
-            
-            # Kết thúc hành trình
-            ser.write(b'S')  # Dừng xe
-            shared_data.set_route_state(running=False)
-            shared_data.update_route_progress(len(dis_list), len(dis_list), "Hoàn thành hành trình!")
-            print("[Serial] === Route execution finished ===")
-            
-    except Exception as e:
-        print(f"[Serial] Route execution error: {e}")
-        shared_data.set_route_state(running=False, stopped=True)
-        shared_data.update_route_progress(0, 0, f"Lỗi: {str(e)}")
+    # (hành động, giá trị, quãng đường tiến theo hướng cũ)
+    maneuver = [
+        ("turn", heading, 0.0),
+        ("drive", leg, leg * cos_h),
+        ("turn", -heading, 0.0),
+        ("drive", AVOID_PASS_M, AVOID_PASS_M),
+        ("turn", -heading, 0.0),
+        ("drive", leg, leg * cos_h),
+        ("turn", heading, 0.0),
+    ]
+    progress = 0.0
+    for action, value, advance in maneuver:
+        if action == "turn":
+            report(f"Vòng tránh vật cản bên {side}: quay {value:+.0f}°")
+            status = _turn_by(ser, shared_data, value, deadline)
+        else:
+            report(f"Vòng tránh vật cản bên {side}: đi {value:.2f}m")
+            status = _drive(ser, shared_data, value, deadline)
+        if status != "ok":
+            ser.write(b'S')
+            print(f"[Serial] Bypass interrupted: {status}")
+            return status, progress
+        progress += advance
+    return "bypassed", progress
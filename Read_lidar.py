@@ -4,7 +4,12 @@ import threading
 import math
 import re
 import time
-from config import LIDAR_MAX_POINTS, LIDAR_DOT_LIFETIME
+from config import LIDAR_MAX_POINTS, LIDAR_DOT_LIFETIME, LIDAR_MIN_RANGE_MM, LIDAR_FILTER_ENABLED, TRACKING_ENABLED
+from settings_store import settings
+from lidar_scan import ScanAssembler
+from lidar_filter import ScanFilter
+from lidar_tracking import ObjectTracker
+from serial_io import serial_core
 
 class LidarData:
     """Class lưu trữ dữ liệu LIDAR"""
@@ -48,6 +53,30 @@ class LidarData:
             
             return valid_points
     
+    def get_points_since(self, since):
+        """Các điểm mới có timestamp > since: (góc độ, khoảng cách mm, timestamp mới nhất)"""
+        with self.lock:
+            # timestamps tăng dần -> tìm từ cuối
+            i = len(self.timestamps)
+            while i > 0 and self.timestamps[i - 1] > since:
+                i -= 1
+            angles = [math.degrees(a) for a in self.angles[i:]]
+            distances = self.distances[i:]
+            last = self.timestamps[-1] if self.timestamps else since
+            return angles, distances, last
+    
+    def apply_settings(self, old, new):
+        """Callback từ settings store: cập nhật max_points/dot_lifetime"""
+        with self.lock:
+            self.max_points = new["LIDAR_MAX_POINTS"]
+            self.dot_lifetime = new["LIDAR_DOT_LIFETIME"]
+            # Cắt bớt nếu max_points giảm
+            excess = len(self.angles) - self.max_points
+            if excess > 0:
+                del self.angles[:excess]
+                del self.distances[:excess]
+                del self.timestamps[:excess]
+    
     def clear_all(self):
         """Xóa tất cả dữ liệu"""
         with self.lock:
@@ -55,68 +84,76 @@ class LidarData:
             self.distances.clear()
             self.timestamps.clear()
 
-# Global instance
-lidar_data = LidarData()
-ser = None
-connected = False
 num_pattern = re.compile(r"^\s*[\d\.]+\s+[\d\.]+\s*$")
 
-def read_lidar_serial(port, baudrate):
-    """Hàm đọc dữ liệu từ LIDAR qua Serial"""
-    global ser, connected
-    
-    try:
-        ser = serial.Serial(port, baudrate, timeout=0.1)
-        connected = True
-        print(f"[LIDAR] Connected to {port} @ {baudrate}")
-        
-        while connected:
+class LidarDevice:
+    """
+    1 cảm biến LIDAR: cổng serial, thread đọc và toàn bộ dữ liệu của riêng nó
+    (điểm thô, scan assembler, bộ lọc, tracker). Mỗi device có lock riêng nên nhiều
+    LIDAR chạy song song không tranh chấp lock của nhau. Việc đọc cổng do serial core
+    (event loop chung) đảm nhận, tự kết nối lại khi rút/cắm cáp.
+    """
+    def __init__(self, device_id, port, baudrate):
+        self.id = device_id
+        self.port = port
+        self.baudrate = baudrate
+        self.lidar_data = LidarData()
+        settings.subscribe(self.lidar_data.apply_settings)
+        self.scan_assembler = ScanAssembler()
+        if LIDAR_FILTER_ENABLED:
+            self.scan_assembler.frame_filter = ScanFilter()
+        self.tracker = ObjectTracker()
+        if TRACKING_ENABLED:
+            self.scan_assembler.add_listener(self.tracker.update)
+        self.serial_port = None  # SerialPort trên serial core khi đang chạy
+        self.buffer = b""
+
+    @property
+    def connected(self):
+        return self.serial_port is not None and self.serial_port.connected
+
+    def _on_data(self, chunk):
+        """Ghép byte thành dòng "khoảng_cách góc" (chạy trong event loop của serial core)"""
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for raw in lines:
+            line = raw.decode(errors="ignore").strip()
+            # Kiểm tra pattern: "khoảng_cách góc"
+            if not line or not num_pattern.match(line):
+                continue
             try:
-                line = ser.readline().decode(errors="ignore").strip()
-                if not line:
-                    continue
-                
-                # Kiểm tra pattern: "khoảng_cách góc"
-                if not num_pattern.match(line):
-                    continue
-                
-                parts = line.split()
-                if len(parts) == 2:
-                    dist, ang = parts
-                    dist, ang = float(dist), float(ang)
-                    if dist > 0:
-                        lidar_data.add_point(ang, dist)
-                        # print(f"[LIDAR] angle={ang}°, distance={dist}mm")
-                        
-            except Exception as e:
-                print(f"[LIDAR] Read error: {e}")
-                
-    except Exception as e:
-        print(f"[LIDAR] Connection error: {e}")
-        connected = False
-    finally:
-        if ser:
-            ser.close()
-        connected = False
-        print("[LIDAR] Serial connection closed")
+                dist, ang = line.split()
+                dist, ang = float(dist), float(ang)
+            except ValueError:
+                # Token hỏng (vd "1.2.3") chỉ bỏ dòng này, không mất các điểm còn lại của chunk
+                continue
+            # Bỏ điểm quá gần (nhiễu / phản xạ thân xe)
+            if dist >= LIDAR_MIN_RANGE_MM:
+                self.lidar_data.add_point(ang, dist)
+                self.scan_assembler.add_point(ang, dist)
+                # print(f"[LIDAR] angle={ang}°, distance={dist}mm")
 
-def start_lidar_thread(port="COM3", baudrate=115200):
-    """Bắt đầu luồng đọc LIDAR"""
-    global connected
-    if not connected:
-        t = threading.Thread(target=read_lidar_serial, args=(port, baudrate), daemon=True)
-        t.start()
-        print(f"[LIDAR] Thread started on {port}")
+    def start(self):
+        """Bắt đầu đọc LIDAR trên serial core (False nếu đang chạy)"""
+        if self.serial_port is not None:
+            return False
+        self.buffer = b""
+        self.serial_port = serial_core.open_port(self.port, self.baudrate, self._on_data)
+        print(f"[LIDAR:{self.id}] Reading {self.port} @ {self.baudrate}")
         return True
-    return False
 
-def stop_lidar():
-    """Dừng đọc LIDAR"""
-    global connected, ser
-    connected = False
-    if ser:
-        ser.close()
-    print("[LIDAR] Stopped")
+    def stop(self):
+        """Dừng đọc LIDAR"""
+        if self.serial_port is not None:
+            serial_core.close_port(self.port)
+            self.serial_port = None
+        print(f"[LIDAR:{self.id}] Stopped")
+
+    def clear(self):
+        """Xóa điểm, vòng quét và track hiện có"""
+        self.lidar_data.clear_all()
+        self.scan_assembler.reset()
+        self.tracker.reset()
 
 def get_available_ports():
     """Lấy danh sách cổng COM khả dụng"""
@@ -131,15 +168,16 @@ if __name__ == "__main__":
     port = input("Enter COM port (e.g., COM3): ").strip()
     baudrate = int(input("Enter baudrate (default 115200): ").strip() or "115200")
     
-    start_lidar_thread(port, baudrate)
+    device = LidarDevice("test", port, baudrate)
+    device.start()
     
     try:
         while True:
             time.sleep(2)
-            points = lidar_data.get_current_points()
+            points = device.lidar_data.get_current_points()
             print(f"[DEBUG] Current points: {len(points)}")
             if points:
                 print(f"[DEBUG] Sample point: {points[0]}")
     except KeyboardInterrupt:
         print("\nStopping...")
-        stop_lidar()
+        device.stop()
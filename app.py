@@ -1,16 +1,21 @@
-from flask import Flask, render_template_string, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, g
+import asyncio
 import threading
 import time
-import json
-import os
-import serial
-from Read_Serial import SerialData, start_serial_thread, execute_route_commands
-from config import (FLASK_HOST, FLASK_PORT, GOOGLE_MAPS_API_KEY, LIDAR_PORT, LIDAR_BAUDRATE,
-                    LIDAR_OBSTACLE_DISTANCE, LIDAR_DETECTION_ANGLE_MIN, LIDAR_DETECTION_ANGLE_MAX,
-                    SERIAL_PORT_CONTROL, SERIAL_BAUD_CONTROL)
-import detect_stream
-import Read_lidar
+import numpy as np
+from Read_Serial import start_gps_reader
+from config import FLASK_HOST, FLASK_PORT, GOOGLE_MAPS_API_KEY, DEFAULT_ROVER, ROUTE_AUTO_RESUME
 import config
+from profiler import profiler
+from subsystems import registry
+from settings_store import settings, SETTINGS_SCHEMA
+from lidar_filter import Debouncer
+from obstacle_eval import ObstacleEvaluator
+from rover import rovers
+from missions import mission_store, parse_route
+from serial_io import serial_core
+from detector import backend_selector
+import cv2
 
 # Tạo Flask app
 app = Flask(__name__)
@@ -18,79 +23,101 @@ app = Flask(__name__)
 # =====================================================
 # Runtime Settings - Có thể thay đổi mà không cần restart
 # =====================================================
-runtime_settings = {
-    "TIME_PER_METER_SEC": config.TIME_PER_METER_SEC,
-    "LIDAR_MAX_POINTS": config.LIDAR_MAX_POINTS,
-    "LIDAR_DOT_LIFETIME": config.LIDAR_DOT_LIFETIME,
-    "LIDAR_OBSTACLE_DISTANCE": config.LIDAR_OBSTACLE_DISTANCE,
-    "LIDAR_DETECTION_ANGLE_MIN": config.LIDAR_DETECTION_ANGLE_MIN,
-    "LIDAR_DETECTION_ANGLE_MAX": config.LIDAR_DETECTION_ANGLE_MAX
-}
-settings_lock = threading.Lock()
-
-# Load settings từ file JSON nếu tồn tại
-def load_settings_from_json():
-    """Load settings từ settings.json"""
-    global runtime_settings
-    try:
-        if os.path.exists("settings.json"):
-            with open("settings.json", "r", encoding="utf-8") as f:
-                loaded = json.load(f)
-                with settings_lock:
-                    runtime_settings.update(loaded)
-                print(f"[Settings] Loaded from settings.json: {runtime_settings}")
-        else:
-            print("[Settings] No settings.json found, using config.py defaults")
-    except Exception as e:
-        print(f"[Settings] Error loading settings.json: {e}")
-
-def save_settings_to_json():
-    """Lưu settings vào settings.json"""
-    try:
-        with settings_lock:
-            with open("settings.json", "w", encoding="utf-8") as f:
-                json.dump(runtime_settings, f, indent=4)
-        print(f"[Settings] Saved to settings.json: {runtime_settings}")
-        return True
-    except Exception as e:
-        print(f"[Settings] Error saving settings.json: {e}")
-        return False
-
-def get_setting(key):
-    """Lấy giá trị setting (thread-safe)"""
-    with settings_lock:
-        return runtime_settings.get(key)
-
-def update_setting(key, value):
-    """Cập nhật setting (thread-safe)"""
-    with settings_lock:
-        runtime_settings[key] = value
-
 # Load settings khi khởi động
-load_settings_from_json()
+settings.load()
+
+def zone_min_distance(frame, angle_min, angle_max, obstacle_dist):
+    """Khoảng cách gần nhất trong vùng [angle_min, angle_max] của 1 scan frame (vector hóa)"""
+    angles, distances = frame.points()
+    # Góc tương đối so với angle_min, xử lý cả vùng qua 0° (ví dụ: -20° đến 20°)
+    in_zone = (angles - angle_min) % 360 <= (angle_max - angle_min)
+    zone = distances[in_zone]
+    if len(zone) == 0:
+        return float('inf'), False
+    min_distance = float(zone.min())
+    return min_distance, min_distance < obstacle_dist
+
+def points_min_distance(points, angle_min, angle_max, obstacle_dist):
+    """Khoảng cách gần nhất trong vùng được cấu hình từ danh sách điểm thô"""
+    min_distance = float('inf')
+    has_obstacle = False
+    
+    for point in points:
+        angle = point["angle"]
+        distance = point["distance"]
+        
+        # Kiểm tra góc trong vùng phát hiện (xử lý cả góc âm)
+        is_in_zone = False
+        
+        if angle_min < 0 and angle_max > 0:
+            # Trường hợp góc qua 0° (ví dụ: -20° đến 20°)
+            # Chấp nhận góc trong khoảng [-20, 20] hoặc [340, 360] và [0, 20]
+            if (angle >= angle_min and angle <= angle_max) or \
+               (angle >= (360 + angle_min) and angle <= 360) or \
+               (angle >= 0 and angle <= angle_max):
+                is_in_zone = True
+        else:
+            # Trường hợp bình thường (ví dụ: 30° đến 60°)
+            if angle >= angle_min and angle <= angle_max:
+                is_in_zone = True
+        
+        # Chỉ xét các điểm trong vùng được cấu hình
+        if is_in_zone:
+            if distance < min_distance:
+                min_distance = distance
+            if distance < obstacle_dist:
+                has_obstacle = True
+    
+    return min_distance, has_obstacle
 
-# Tạo đối tượng lưu dữ liệu GPS
-shared_data = SerialData()
+def estimate_speed(shared_data, command):
+    """
+    Ước lượng tốc độ tiến (m/s) khi đang đi thẳng: giá trị lớn hơn giữa tốc độ danh định
+    1/TIME_PER_METER_SEC và tốc độ GPS (nếu message có tốc độ còn mới, GPS_SPEED_MAX_AGE_SEC).
+    Không dùng riêng tốc độ GPS: xe vừa dừng vì vật cản có tốc độ ~0 -> quãng phanh co lại,
+    vật cản "hết" ngay và xe chạy-dừng liên tục.
+    """
+    if command != "T":
+        return 0.0
+    nominal = 1.0 / max(settings.current["TIME_PER_METER_SEC"], 0.01)
+    snap = shared_data.snapshot()
+    speed_time = snap.get("speed_timestamp")
+    if speed_time is None or time.time() - speed_time > config.GPS_SPEED_MAX_AGE_SEC:
+        return nominal
+    return max(nominal, snap["speed"])
 
-# Bắt đầu luồng đọc Serial nền
-t = threading.Thread(target=start_serial_thread, args=(shared_data,), daemon=True)
-t.start()
+async def wait_event(event, timeout):
+    """Chờ event hoặc hết timeout (giây), rồi xóa event"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
 
-# Background thread để tự động kiểm tra LIDAR và cập nhật obstacle status
-def lidar_monitor_thread(shared_data):
-    """Thread liên tục kiểm tra LIDAR data và cập nhật obstacle status"""
-    print("[LIDAR Monitor] Background thread started")
+# Coroutine (trên serial core) tự động kiểm tra LIDAR và cập nhật obstacle status
+async def lidar_monitor(rover):
+    """
+    Đánh giá vật cản của 1 rover mỗi khi có vòng quét mới (thay vì poll 100ms);
+    LIDAR không ra scan frame thì kiểm tra điểm thô mỗi 100ms.
+    """
+    shared_data = rover.shared_data
+    lidar = rover.lidar
+    print(f"[LIDAR Monitor] Started ({rover.id})")
+    loop = asyncio.get_running_loop()
+    new_frame = asyncio.Event()
+    lidar.scan_assembler.add_listener(lambda frame: loop.call_soon_threadsafe(new_frame.set))
     last_config_print = 0  # Để in config mỗi 10 giây
+    # Chống dội: 1 vòng quét nhiễu không đủ để dừng xe
+    debouncer = Debouncer(config.LIDAR_OBSTACLE_ON_SEC, config.LIDAR_OBSTACLE_OFF_SEC)
+    evaluator = ObstacleEvaluator()
     
     while True:
         try:
-            # Lấy dữ liệu LIDAR hiện tại
-            points = Read_lidar.lidar_data.get_current_points()
-            
-            # Đọc config động từ runtime_settings
-            angle_min = get_setting("LIDAR_DETECTION_ANGLE_MIN")
-            angle_max = get_setting("LIDAR_DETECTION_ANGLE_MAX")
-            obstacle_dist = get_setting("LIDAR_OBSTACLE_DISTANCE")
+            # Đọc config động: 1 snapshot nhất quán cho cả vòng lặp
+            snap = settings.current
+            angle_min = snap["LIDAR_DETECTION_ANGLE_MIN"]
+            angle_max = snap["LIDAR_DETECTION_ANGLE_MAX"]
+            obstacle_dist = snap["LIDAR_OBSTACLE_DISTANCE"]
             
             # In config mỗi 10 giây để debug
             current_time = time.time()
@@ -98,142 +125,283 @@ def lidar_monitor_thread(shared_data):
                 print(f"[LIDAR Monitor] Current config: Distance={obstacle_dist}mm, Angle=[{angle_min}° to {angle_max}°]")
                 last_config_print = current_time
             
-            # Tính khoảng cách gần nhất trong vùng được cấu hình
-            min_distance = float('inf')
-            has_obstacle = False
-            
-            for point in points:
-                angle = point["angle"]
-                distance = point["distance"]
-                
-                # Kiểm tra góc trong vùng phát hiện (xử lý cả góc âm)
-                is_in_zone = False
-                
-                if angle_min < 0 and angle_max > 0:
-                    # Trường hợp góc qua 0° (ví dụ: -20° đến 20°)
-                    # Chấp nhận góc trong khoảng [-20, 20] hoặc [340, 360] và [0, 20]
-                    if (angle >= angle_min and angle <= angle_max) or \
-                       (angle >= (360 + angle_min) and angle <= 360) or \
-                       (angle >= 0 and angle <= angle_max):
-                        is_in_zone = True
+            # Ưu tiên vòng quét đầy đủ (scan frame) nếu còn mới
+            frame = lidar.scan_assembler.get_latest(max_age=snap["LIDAR_DOT_LIFETIME"])
+            command = shared_data.get_motion()
+            ttc = None
+            zone = "static"
+            if config.OBSTACLE_EVAL_MODE == "dynamic" and command is not None:
+                # Theo hướng đi + tốc độ: chỉ dừng khi vật nằm trên đường xe sẽ quét qua
+                speed = estimate_speed(shared_data, command)
+                # Mức an toàn tối thiểu: luôn đánh giá điểm của vòng quét hiện tại (track mới xuất hiện
+                # hoặc vừa lỡ 1 vòng chưa được xác nhận nên không có trong get_tracks)
+                if frame is not None:
+                    angles, distances = frame.points()
                 else:
-                    # Trường hợp bình thường (ví dụ: 30° đến 60°)
-                    if angle >= angle_min and angle <= angle_max:
-                        is_in_zone = True
-                
-                # Chỉ xét các điểm trong vùng được cấu hình
-                if is_in_zone:
-                    if distance < min_distance:
-                        min_distance = distance
-                    if distance < obstacle_dist:
-                        has_obstacle = True
+                    points = lidar.lidar_data.get_current_points()
+                    angles = [p["angle"] for p in points]
+                    distances = [p["distance"] for p in points]
+                result = evaluator.evaluate(angles, distances, command, speed)
+                tracks = lidar.tracker.get_tracks(max_age=config.TRACK_MAX_AGE_SEC) if config.TRACKING_ENABLED else None
+                if tracks:
+                    # Track vật thể có vận tốc tương đối -> chỉ dùng để tinh chỉnh TTC (vật đang di chuyển)
+                    tracked = evaluator.evaluate_tracks(tracks, command, speed)
+                    result = {
+                        "detected": result["detected"] or tracked["detected"],
+                        "min_distance": min(result["min_distance"], tracked["min_distance"]),
+                        "ttc": min((t for t in (result["ttc"], tracked["ttc"]) if t is not None), default=None),
+                        "zone": result["zone"]
+                    }
+                min_distance, has_obstacle = result["min_distance"], result["detected"]
+                ttc, zone = result["ttc"], result["zone"]
+            elif frame is not None:
+                min_distance, has_obstacle = zone_min_distance(frame, angle_min, angle_max, obstacle_dist)
+            else:
+                points = lidar.lidar_data.get_current_points()
+                min_distance, has_obstacle = points_min_distance(points, angle_min, angle_max, obstacle_dist)
             
-            # Cập nhật vào shared_data
+            # Cập nhật vào shared_data (sau khi chống dội)
+            has_obstacle = debouncer.update(has_obstacle)
             if has_obstacle:
-                shared_data.set_lidar_obstacle(True, min_distance)
-                print(f"[LIDAR Monitor] ⚠️ OBSTACLE: {min_distance:.0f}mm < {obstacle_dist}mm in zone [{angle_min}° to {angle_max}°]")
+                shared_data.set_lidar_obstacle(True, min_distance, ttc, zone)
+                if zone == "static":
+                    print(f"[LIDAR Monitor] ⚠️ OBSTACLE: {min_distance:.0f}mm < {obstacle_dist}mm in zone [{angle_min}° to {angle_max}°]")
+                else:
+                    ttc_text = f"{ttc:.1f}s" if ttc is not None else "-"
+                    print(f"[LIDAR Monitor] ⚠️ OBSTACLE in {zone} ({command}): {min_distance:.0f}mm, TTC={ttc_text}")
             else:
-                shared_data.set_lidar_obstacle(False, min_distance if min_distance != float('inf') else 9999)
+                shared_data.set_lidar_obstacle(False, min_distance if min_distance != float('inf') else 9999, ttc, zone)
             
-            time.sleep(0.1)  # Kiểm tra mỗi 100ms
+            # Chờ vòng quét tiếp theo; timeout ngắn khi chỉ có điểm thô
+            await wait_event(new_frame, 0.5 if frame is not None else 0.1)
             
         except Exception as e:
             print(f"[LIDAR Monitor] Error: {e}")
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
 
-# Khởi động LIDAR monitor thread
-lidar_monitor = threading.Thread(target=lidar_monitor_thread, args=(shared_data,), daemon=True)
-lidar_monitor.start()
-
-def lidar_emergency_monitor_thread(shared_data):
+async def lidar_emergency_monitor(rover):
     """
-    Thread liên tục gửi tín hiệu về Arduino:
+    Liên tục gửi tín hiệu về Arduino qua cổng điều khiển (dùng chung handle với route executor):
     - 'S' nếu phát hiện vật cản < ngưỡng
     - 'N' nếu không có vật cản (normal)
     Arduino sẽ tự quyết định xử lý như thế nào.
     """
-    print("[LIDAR Emergency Monitor] Starting continuous monitoring...")
+    shared_data = rover.shared_data
+    print(f"[LIDAR Emergency Monitor] Starting continuous monitoring ({rover.id})...")
+    port = serial_core.open_port(rover.control_port, rover.control_baud)
+    last_state = None  # Track để chỉ log khi thay đổi
     
-    try:
-        with serial.Serial(SERIAL_PORT_CONTROL, SERIAL_BAUD_CONTROL, timeout=1) as ser:
-            print(f"[LIDAR Emergency Monitor] Connected to {SERIAL_PORT_CONTROL}")
-            last_state = None  # Track để chỉ log khi thay đổi
+    while True:
+        try:
+            lidar_status = shared_data.get_lidar_obstacle()
             
-            while True:
-                try:
-                    lidar_status = shared_data.get_lidar_obstacle()
-                    
-                    if lidar_status["detected"]:
-                        # Có vật cản → gửi 'S'
-                        ser.write(b'S')
-                        if last_state != 'S':
-                            print(f"[LIDAR Emergency Monitor] 🚨 OBSTACLE DETECTED at {lidar_status['min_distance']:.0f}mm → Sending 'S'")
-                            last_state = 'S'
-                    else:
-                        # Không có vật cản → gửi 'N'
-                        ser.write(b'N')
-                        if last_state != 'N':
-                            print(f"[LIDAR Emergency Monitor] ✅ Path clear → Sending 'N'")
-                            last_state = 'N'
-                    
-                    time.sleep(0.1)  # Gửi mỗi 100ms
-                    
-                except Exception as e:
-                    print(f"[LIDAR Emergency Monitor] Error in loop: {e}")
-                    time.sleep(0.5)
-                    
-    except Exception as e:
-        print(f"[LIDAR Emergency Monitor] Failed to open serial port: {e}")
-
-# Khởi động LIDAR emergency monitor thread
-emergency_monitor = threading.Thread(target=lidar_emergency_monitor_thread, args=(shared_data,), daemon=True)
-emergency_monitor.start()
-print("[LIDAR Emergency Monitor] Thread started - Continuous S/N monitoring ENABLED")
+            if lidar_status["detected"]:
+                # Có vật cản → gửi 'S'
+                port.write(b'S')
+                if last_state != 'S':
+                    print(f"[LIDAR Emergency Monitor] 🚨 OBSTACLE DETECTED at {lidar_status['min_distance']:.0f}mm → Sending 'S'")
+                    last_state = 'S'
+            else:
+                # Không có vật cản → gửi 'N'
+                port.write(b'N')
+                if last_state != 'N':
+                    print(f"[LIDAR Emergency Monitor] ✅ Path clear → Sending 'N'")
+                    last_state = 'N'
+            
+            await asyncio.sleep(0.1)  # Gửi mỗi 100ms
+            
+        except Exception as e:
+            print(f"[LIDAR Emergency Monitor] Error in loop: {e}")
+            await asyncio.sleep(0.5)
+
+def mission_scheduler_thread(rover):
+    """Thread chạy hàng đợi mission của rover"""
+    print(f"[Missions] Scheduler started ({rover.id})")
+    rover.missions.run()
+
+def occupancy_mapper_thread(rover):
+    """Thread gộp các điểm LIDAR mới vào occupancy grid của rover theo pose GPS + yaw"""
+    print(f"[Map] Occupancy mapper started ({rover.id})")
+    last_t = time.time()
+    last_seq = 0
+    while True:
+        try:
+            time.sleep(config.MAP_UPDATE_INTERVAL_SEC)
+            # Dùng vòng quét đầy đủ nếu LIDAR quay 360°, nếu không thì điểm thô mới
+            frame = rover.lidar.scan_assembler.get_latest()
+            if frame is not None:
+                if frame.seq == last_seq:
+                    continue
+                last_seq = frame.seq
+                angles, distances = frame.points()
+            else:
+                angles, distances, last_t = rover.lidar.lidar_data.get_points_since(last_t)
+            if len(angles) == 0:
+                continue
+            snap = rover.shared_data.snapshot()
+            if not rover.shared_data.has_fix(snap):
+                # Theo thời điểm có tọa độ cuối (fix_timestamp), không theo message bất kỳ:
+                # dòng chỉ có yaw / fix không hợp lệ vẫn để pose ở vị trí mặc định hoặc cũ,
+                # ghép scan vào pose sai sẽ làm bẩn bản đồ
+                continue
+            pose = rover.grid.pose_from_gps(snap["lat"], snap["lon"], snap.get("yaw", 0.0))
+            rover.grid.integrate_scan(pose, angles, distances)
+        except Exception as e:
+            print(f"[Map] Error: {e}")
+            time.sleep(0.5)
 
-# Đọc file HTML từ map.html
-with open("map.html", "r", encoding="utf-8") as f:
-    html_template = f.read()
+# =====================================================
+# Background threads - chỉ khởi động 1 lần cho cả process
+# =====================================================
+background_started = False
+background_lock = threading.Lock()
 
-# Đọc file HTML từ detect_web.html
-with open("detect_web.html", "r", encoding="utf-8") as f:
-    detect_html_template = f.read()
+def start_background_threads():
+    """
+    Khởi động serial core (1 event loop cho mọi cổng serial), rồi với mỗi rover: đọc GPS,
+    đọc LIDAR, coroutine monitor/emergency và thread occupancy mapper - đúng 1 lần.
+    Gọi từ entry point (__main__ hoặc wsgi.py), không chạy lúc import, để server
+    WSGI không sinh ra thread trùng lặp.
+    """
+    global background_started
+    with background_lock:
+        if background_started:
+            return False
+        background_started = True
+        
+        if config.SIM_ENABLED:
+            from simulator import simulator
+            simulator.start()
+            # Route đi đúng quãng đường theo tốc độ mô phỏng (không lưu vào settings.json)
+            settings.update({"TIME_PER_METER_SEC": simulator.time_per_meter()})
+        serial_core.start()
+        coroutines = {
+            "lidar_monitor": lidar_monitor,                   # LIDAR monitor
+            "emergency_monitor": lidar_emergency_monitor,     # LIDAR emergency monitor
+        }
+        threads = {"mission_scheduler": mission_scheduler_thread}
+        if config.MAP_ENABLED:
+            threads["occupancy_mapper"] = occupancy_mapper_thread     # Occupancy grid mapping
+        
+        for rover in rovers.values():
+            # Đọc Serial GPS
+            start_gps_reader(rover.shared_data, rover.track, rover.gps_port, rover.gps_baud)
+            rover.start_tasks(serial_core, coroutines)
+            rover.start_threads(threads)
+            print(f"[LIDAR Emergency Monitor] Started ({rover.id}) - Continuous S/N monitoring ENABLED")
+            # Tự động khởi động LIDAR khi server start
+            print(f"[LIDAR] Auto-starting LIDAR ({rover.id}) on server startup...")
+            rover.lidar.start()
+            # Hành trình dở từ lần chạy trước (chỉ tự chạy tiếp khi được cấu hình)
+            if ROUTE_AUTO_RESUME and rover.route.recover():
+                print(f"[Route] Auto-resumed interrupted route ({rover.id})")
+        
+        if config.PROFILER_ENABLED:
+            profiler.start()
+        return True
 
-# Đọc file HTML từ lidar_web.html
-with open("lidar_web.html", "r", encoding="utf-8") as f:
-    lidar_html_template = f.read()
+# =====================================================
+# HTML templates - đọc + compile 1 lần ở request đầu tiên (không đọc lúc import)
+# =====================================================
+TEMPLATE_FILES = {
+    "map": "map.html",
+    "detect": "detect_web.html",
+    "lidar": "lidar_web.html",
+    "config": "config_web.html"
+}
 
-# Đọc file HTML từ config_web.html
-with open("config_web.html", "r", encoding="utf-8") as f:
-    config_html_template = f.read()
+def _load_templates():
+    """Compile các trang HTML 1 lần; nội dung không đổi nên render sẵn luôn"""
+    pages = {}
+    for name, path in TEMPLATE_FILES.items():
+        with open(path, "r", encoding="utf-8") as f:
+            template = app.jinja_env.from_string(f.read())
+        pages[name] = template.render(GOOGLE_MAPS_API_KEY=GOOGLE_MAPS_API_KEY)
+    return pages
+
+templates = registry.register("templates", _load_templates)
+
+def render_page(name):
+    pages = templates.get()
+    if not templates.is_ready():
+        # Thiếu file / lỗi cú pháp template -> báo lỗi thay vì 500 (lần sau thử load lại)
+        return Response(f"Templates unavailable: {templates.error}", status=503)
+    return Response(pages[name], mimetype="text/html")
+
+@app.before_request
+def name_worker_thread():
+    # Đặt tên thread Flask theo endpoint để profiler phân bổ CPU theo từng route
+    threading.current_thread().name = f"flask_worker:{request.endpoint}"
+
+@app.before_request
+def resolve_rover():
+    """Rover của request theo tham số ?rover=<id> (query hoặc form), mặc định DEFAULT_ROVER"""
+    rover_id = request.values.get("rover", DEFAULT_ROVER)
+    g.rover = rovers.get(rover_id)
+    if g.rover is None:
+        return Response(f"Unknown rover: {rover_id}", status=404)
 
 @app.route("/")
 def index():
-    # render_template_string để chèn API key động vào file ngoài
-    return render_template_string(html_template, GOOGLE_MAPS_API_KEY=GOOGLE_MAPS_API_KEY)
+    # Trang map (API key đã được chèn khi compile template)
+    return render_page("map")
 
 @app.route("/config")
 def config_page():
     # Trang cấu hình
-    return render_template_string(config_html_template)
+    return render_page("config")
 
 @app.route("/detection")
 def detection_page():
     # Trang detection
-    return render_template_string(detect_html_template)
+    return render_page("detect")
 
 @app.route("/lidar")
 def lidar_page():
     # Trang LIDAR - Tự động bắt đầu LIDAR
     # Nếu chưa chạy thì khởi động
-    if not Read_lidar.connected:
-        Read_lidar.start_lidar_thread(LIDAR_PORT, LIDAR_BAUDRATE)
-    return render_template_string(lidar_html_template)
+    if not g.rover.lidar.connected:
+        g.rover.lidar.start()
+    return render_page("lidar")
 
 @app.route("/getGpsData")
 def get_gps_data():
-    snap = shared_data.snapshot()
+    snap = g.rover.shared_data.snapshot()
     return f"{snap.get('lat', 0.0)},{snap.get('lon', 0.0)}"
 
+@app.route("/getGpsStatus")
+def get_gps_status():
+    """Fix đầy đủ (fix quality, HDOP, tốc độ, thời gian) + thống kê parser"""
+    snap = g.rover.shared_data.snapshot()
+    snap["age"] = round(time.time() - snap["timestamp"], 3) if snap.get("timestamp") else None
+    snap["parser"] = g.rover.shared_data.parser_stats
+    return jsonify(snap)
+
+@app.route("/track")
+def get_track():
+    """
+    Lịch sử đường đi giữa 2 thời điểm (unix time, giây), giảm mẫu còn `points` điểm.
+    Tham số: start (mặc định 1 giờ trước), end (mặc định hiện tại),
+    points (mặc định 1000), method = lttb | dp
+    """
+    now = time.time()
+    try:
+        t_end = float(request.args.get("end", now))
+        t_start = float(request.args.get("start", t_end - 3600))
+        max_points = max(2, min(20000, int(request.args.get("points", 1000))))
+    except ValueError as e:
+        return Response(f"Invalid parameter: {e}", status=400)
+    method = request.args.get("method", "lttb")
+    
+    data, total = g.rover.track.query(t_start, t_end, max_points, method)
+    return jsonify({
+        "t": np.round(data["t"], 2).tolist(),
+        "lat": data["lat"].tolist(),
+        "lon": data["lon"].tolist(),
+        "total": total,
+        "returned": len(data["t"])
+    })
+
 @app.route("/postData", methods=["POST"])
 def post_data():
     dis = request.form.get("dis", "")
@@ -246,7 +414,7 @@ def post_data():
 
 @app.route("/getYaw")
 def get_yaw():
-    yaw = shared_data.snapshot().get("yaw", 0.0)
+    yaw = g.rover.shared_data.snapshot().get("yaw", 0.0)
     return f"{yaw:.2f}"
 
 # Route bắt đầu thực thi lệnh điều khiển
@@ -262,107 +430,201 @@ def start_route():
     print(f"[START ROUTE] dis={dis_list}")
     print(f"[START ROUTE] dir={dir_list}")
     print(f"[START ROUTE] dir_value={dir_value_list}")
-    threading.Thread(target=execute_route_commands, args=(shared_data, dis_list, dir_list, dir_value_list), daemon=True).start()
+    # Mỗi rover chỉ có 1 route executor chạy tại 1 thời điểm
+    if not g.rover.route.start(dis_list, dir_list, dir_value_list):
+        return Response("Route already running", status=409)
     return Response("Route started", mimetype="text/plain")
 
+@app.route("/recoverRoute", methods=["POST"])
+def recover_route():
+    """Chạy tiếp hành trình dở (theo journal) sau khi server khởi động lại hoặc lỗi"""
+    route = g.rover.route
+    if route.is_running():
+        return Response("Route already running", status=409)
+    if not route.recover():
+        return Response("No interrupted route", status=404)
+    print("[RECOVER ROUTE] Route resumed from journal")
+    return Response("Route recovered", mimetype="text/plain")
+
+@app.route("/discardRoute", methods=["POST"])
+def discard_route():
+    """Bỏ hành trình dở trong journal"""
+    if not g.rover.route.discard():
+        return Response("No interrupted route", status=404)
+    return Response("Route discarded", mimetype="text/plain")
+
 @app.route("/pauseRoute", methods=["POST"])
 def pause_route():
     """Tạm dừng route"""
-    shared_data.set_route_state(paused=True)
+    g.rover.shared_data.set_route_state(paused=True)
     print("[PAUSE ROUTE] Route paused")
     return Response("Route paused", mimetype="text/plain")
 
 @app.route("/resumeRoute", methods=["POST"])
 def resume_route():
     """Tiếp tục route sau khi tạm dừng"""
-    shared_data.set_route_state(paused=False)
+    g.rover.shared_data.set_route_state(paused=False)
     print("[RESUME ROUTE] Route resumed")
     return Response("Route resumed", mimetype="text/plain")
 
 @app.route("/stopRoute", methods=["POST"])
 def stop_route():
     """Dừng hẳn route"""
-    shared_data.set_route_state(stopped=True, running=False, paused=False)
+    g.rover.shared_data.set_route_state(stopped=True, running=False, paused=False)
     print("[STOP ROUTE] Route stopped")
     return Response("Route stopped", mimetype="text/plain")
 
 @app.route("/getRouteStatus")
 def get_route_status():
     """Lấy trạng thái route hiện tại"""
-    status = shared_data.get_route_state()
+    status = g.rover.shared_data.get_route_state()
+    status.update(g.rover.route.status())
     return jsonify(status)
 
 # ===================== DETECTION ROUTES =====================
 @app.route("/video_feed")
 def video_feed():
-    """Video streaming route"""
-    if not detect_stream.init_camera():
+    """Video streaming route (ảnh thô; overlay=1: box vẽ sẵn trên server cho client không có JS)"""
+    camera = g.rover.camera
+    if not camera.init_camera():
         return Response("Camera not available", status=503)
-    return Response(detect_stream.generate_frames(),
+    overlay = request.args.get("overlay", "0") in ("1", "true")
+    # quality: auto (theo tốc độ client) hoặc mức cố định 0 (nét nhất) .. len(STREAM_LEVELS) - 1
+    quality = request.args.get("quality", "auto")
+    level = None if quality == "auto" else request.args.get("quality", type=int)
+    return Response(camera.generate_frames(overlay, level),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route("/video_feed_h264")
+def video_feed_h264():
+    """Video H.264 (fragmented MP4, phát bằng thẻ <video>) - bitrate thấp hơn MJPEG nhiều lần"""
+    camera = g.rover.camera
+    if not camera.init_camera():
+        return Response("Camera not available", status=503)
+    chunks = camera.generate_h264()
+    if chunks is None:
+        return Response("No H.264 encoder available (install ffmpeg or gstreamer)", status=503)
+    return Response(chunks, mimetype="video/mp4")
+
 @app.route("/start_detection", methods=["POST"])
 def start_detection():
-    """Enable object detection"""
-    detect_stream.set_detection_enabled(True)
+    """Enable object detection (model được load nền ở lần đầu tiên). Tham số mode: full | tiled | roi"""
+    mode = request.values.get("mode")
+    if mode:
+        try:
+            g.rover.camera.set_detection_mode(mode)
+        except ValueError as e:
+            return Response(str(e), status=400)
+    g.rover.camera.set_detection_enabled(True)
+    if not g.rover.camera.model.is_ready():
+        return Response("Detection started - loading model", mimetype="text/plain")
     return Response("Detection started", mimetype="text/plain")
 
 @app.route("/stop_detection", methods=["POST"])
 def stop_detection():
     """Disable object detection"""
-    detect_stream.set_detection_enabled(False)
+    g.rover.camera.set_detection_enabled(False)
     return Response("Detection stopped", mimetype="text/plain")
 
 @app.route("/detection_stats")
 def detection_stats():
     """Get detection statistics"""
-    stats = detect_stream.get_stats()
+    stats = g.rover.camera.get_stats()
     return jsonify(stats)
 
+@app.route("/detections")
+def detections():
+    """
+    Kết quả detection mới nhất (box, class, độ tin cậy, frame_id) để trình duyệt vẽ overlay.
+    since=<seq>: trả 204 nếu chưa có kết quả mới hơn (header X-Result-Age-Ms: tuổi kết quả cũ)
+    """
+    result = g.rover.camera.get_result()
+    if result is None:
+        return Response(status=204)
+    since = request.args.get("since", type=int)
+    if since is not None and result["seq"] <= since:
+        return Response(status=204, headers={"X-Result-Age-Ms": str(result["age_ms"])})
+    return jsonify(result)
+
+@app.route("/detection_backends")
+def detection_backends():
+    """Backend inference đang dùng và kết quả benchmark chọn backend (khi INFERENCE_BACKEND = "auto")"""
+    return jsonify(backend_selector.status())
+
 @app.route("/camera_start", methods=["POST"])
 def camera_start():
     """Start camera"""
-    if detect_stream.init_camera():
+    if g.rover.camera.init_camera():
         return Response("Camera started", mimetype="text/plain")
     return Response("Camera failed to start", status=500)
 
 @app.route("/camera_stop", methods=["POST"])
 def camera_stop():
     """Stop camera"""
-    detect_stream.release_camera()
-    detect_stream.set_detection_enabled(False)
+    g.rover.camera.release_camera()
+    g.rover.camera.set_detection_enabled(False)
     return Response("Camera stopped", mimetype="text/plain")
 
 # ===================== LIDAR ROUTES =====================
 @app.route("/startLidar", methods=["POST"])
 def start_lidar():
     """Bắt đầu đọc LIDAR"""
-    # Sử dụng config từ file config.py
-    success = Read_lidar.start_lidar_thread(LIDAR_PORT, LIDAR_BAUDRATE)
-    if success:
-        return Response(f"LIDAR started on {LIDAR_PORT} @ {LIDAR_BAUDRATE}", mimetype="text/plain")
+    # Cổng lấy theo cấu hình rover trong config.py
+    lidar = g.rover.lidar
+    if lidar.start():
+        return Response(f"LIDAR started on {lidar.port} @ {lidar.baudrate}", mimetype="text/plain")
     else:
         return Response("LIDAR already running", mimetype="text/plain")
 
 @app.route("/stopLidar", methods=["POST"])
 def stop_lidar():
     """Dừng đọc LIDAR"""
-    Read_lidar.stop_lidar()
+    g.rover.lidar.stop()
     return Response("LIDAR stopped", mimetype="text/plain")
 
 @app.route("/getLidarData")
 def get_lidar_data():
     """Lấy dữ liệu LIDAR hiện tại"""
-    points = Read_lidar.lidar_data.get_current_points()
+    lidar = g.rover.lidar
+    points = lidar.lidar_data.get_current_points()
+    tracks = lidar.tracker.get_tracks(max_age=config.TRACK_MAX_AGE_SEC)
     return jsonify({
         'points': points,
-        'connected': Read_lidar.connected
+        'objects': [t.to_dict() for t in tracks] if tracks is not None else [],
+        'connected': lidar.connected
+    })
+
+@app.route("/getLidarFrame")
+def get_lidar_frame():
+    """Vòng quét 360° mới nhất dạng mảng bin (gọn hơn danh sách điểm)"""
+    lidar = g.rover.lidar
+    frame = lidar.scan_assembler.get_latest()
+    if frame is None:
+        return jsonify({'frame': None, 'connected': lidar.connected})
+    return jsonify({'frame': frame.to_dict(), 'connected': lidar.connected})
+
+@app.route("/getLidarObjects")
+def get_lidar_objects():
+    """Danh sách vật thể đang theo dõi (tọa độ robot, mét: x tới trước, y sang trái)"""
+    lidar = g.rover.lidar
+    tracks = lidar.tracker.get_tracks(confirmed_only=request.args.get("all") != "1",
+                                      max_age=config.TRACK_MAX_AGE_SEC)
+    return jsonify({
+        'objects': [t.to_dict() for t in tracks] if tracks is not None else [],
+        'stats': lidar.tracker.stats(),
+        'connected': lidar.connected
     })
 
+@app.route("/getLidarFilterStats")
+def get_lidar_filter_stats():
+    """Thống kê tầng lọc nhiễu LIDAR (số điểm bị loại, thời gian xử lý mỗi vòng)"""
+    scan_filter = g.rover.lidar.scan_assembler.frame_filter
+    return jsonify(scan_filter.stats() if scan_filter is not None else {"enabled": False})
+
 @app.route("/clearLidarData", methods=["POST"])
 def clear_lidar_data():
     """Xóa tất cả dữ liệu LIDAR"""
-    Read_lidar.lidar_data.clear_all()
+    g.rover.lidar.clear()
     return Response("LIDAR data cleared", mimetype="text/plain")
 
 @app.route("/updateLidarObstacle", methods=["POST"])
@@ -375,22 +637,53 @@ def update_lidar_obstacle():
     if detected:
         print(f"[LIDAR] ⚠️ OBSTACLE DETECTED: {min_distance:.0f}mm")
     
-    # Cập nhật vào shared_data để execute_route_commands có thể check
-    shared_data.set_lidar_obstacle(detected, min_distance)
+    # Cập nhật vào shared_data để route executor có thể check
+    g.rover.shared_data.set_lidar_obstacle(detected, min_distance)
     
     return Response(f"LIDAR obstacle updated: {detected}, {min_distance}mm", mimetype="text/plain")
 
 @app.route("/getLidarObstacleStatus")
 def get_lidar_obstacle_status():
     """Lấy trạng thái vật cản hiện tại (để debug)"""
-    status = shared_data.get_lidar_obstacle()
+    status = g.rover.shared_data.get_lidar_obstacle()
     return jsonify(status)
 
+@app.route("/getOccupancyGrid")
+def get_occupancy_grid():
+    """Ảnh PNG bản đồ chiếm chỗ quanh robot (tham số radius: mét)"""
+    try:
+        radius = max(1.0, min(100.0, float(request.args.get("radius", 20))))
+    except ValueError:
+        return Response("Invalid radius", status=400)
+    image = g.rover.grid.render(radius)
+    ok, buffer = cv2.imencode(".png", image)
+    if not ok:
+        return Response("Encode error", status=500)
+    return Response(buffer.tobytes(), mimetype="image/png")
+
+@app.route("/getOccupancyGridStats")
+def get_occupancy_grid_stats():
+    """Số tile, bộ nhớ, thời gian cập nhật mỗi scan"""
+    return jsonify(g.rover.grid.stats())
+
+@app.route("/clearOccupancyGrid", methods=["POST"])
+def clear_occupancy_grid():
+    g.rover.grid.clear()
+    return Response("Occupancy grid cleared", mimetype="text/plain")
+
 @app.route("/getConfig")
 def get_config():
-    """Lấy các giá trị cấu hình hiện tại từ runtime_settings"""
-    with settings_lock:
-        return jsonify(runtime_settings)
+    """Lấy các giá trị cấu hình hiện tại"""
+    snap = settings.current
+    result = snap.to_dict()
+    result["version"] = snap.version
+    return jsonify(result)
+
+def _config_from_request(data):
+    """Lấy các key settings có trong request JSON (bỏ qua key khác)"""
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return {key: data[key] for key in SETTINGS_SCHEMA if key in data}
 
 @app.route("/saveConfigRuntime", methods=["POST"])
 def save_config_runtime():
@@ -399,20 +692,17 @@ def save_config_runtime():
         data = request.get_json()
         print(f"[Settings] 💾 Saving to RUNTIME (temporary): {data}")
         
-        # Cập nhật runtime_settings
-        update_setting("TIME_PER_METER_SEC", float(data.get("TIME_PER_METER_SEC", 1.0)))
-        update_setting("LIDAR_MAX_POINTS", int(data.get("LIDAR_MAX_POINTS", 1500)))
-        update_setting("LIDAR_DOT_LIFETIME", float(data.get("LIDAR_DOT_LIFETIME", 1.0)))
-        update_setting("LIDAR_OBSTACLE_DISTANCE", int(data.get("LIDAR_OBSTACLE_DISTANCE", 400)))
-        update_setting("LIDAR_DETECTION_ANGLE_MIN", int(data.get("LIDAR_DETECTION_ANGLE_MIN", -20)))
-        update_setting("LIDAR_DETECTION_ANGLE_MAX", int(data.get("LIDAR_DETECTION_ANGLE_MAX", 20)))
+        snap = settings.update(_config_from_request(data))
         
-        print(f"[Settings] ✅ Runtime settings updated:")
-        print(f"  - LIDAR_OBSTACLE_DISTANCE: {get_setting('LIDAR_OBSTACLE_DISTANCE')}mm")
-        print(f"  - LIDAR_DETECTION_ANGLE: [{get_setting('LIDAR_DETECTION_ANGLE_MIN')}° to {get_setting('LIDAR_DETECTION_ANGLE_MAX')}°]")
+        print(f"[Settings] ✅ Runtime settings updated (version {snap.version}):")
+        print(f"  - LIDAR_OBSTACLE_DISTANCE: {snap['LIDAR_OBSTACLE_DISTANCE']}mm")
+        print(f"  - LIDAR_DETECTION_ANGLE: [{snap['LIDAR_DETECTION_ANGLE_MIN']}° to {snap['LIDAR_DETECTION_ANGLE_MAX']}°]")
         
         return jsonify({"success": True, "message": "Cấu hình đã được lưu vào bộ nhớ (tạm thời)"})
     
+    except ValueError as e:
+        print(f"[Settings] ❌ Invalid settings: {e}")
+        return jsonify({"success": False, "message": str(e)})
     except Exception as e:
         print(f"[Settings] ❌ Error saving to runtime: {e}")
         import traceback
@@ -426,21 +716,15 @@ def save_config_permanent():
         data = request.get_json()
         print(f"[Settings] 💿 Saving to settings.json (permanent): {data}")
         
-        # Cập nhật runtime_settings
-        update_setting("TIME_PER_METER_SEC", float(data.get("TIME_PER_METER_SEC", 1.0)))
-        update_setting("LIDAR_MAX_POINTS", int(data.get("LIDAR_MAX_POINTS", 1500)))
-        update_setting("LIDAR_DOT_LIFETIME", float(data.get("LIDAR_DOT_LIFETIME", 1.0)))
-        update_setting("LIDAR_OBSTACLE_DISTANCE", int(data.get("LIDAR_OBSTACLE_DISTANCE", 400)))
-        update_setting("LIDAR_DETECTION_ANGLE_MIN", int(data.get("LIDAR_DETECTION_ANGLE_MIN", -20)))
-        update_setting("LIDAR_DETECTION_ANGLE_MAX", int(data.get("LIDAR_DETECTION_ANGLE_MAX", 20)))
+        settings.update(_config_from_request(data))
         
-        # Lưu vào file JSON
-        if save_settings_to_json():
-            print(f"[Settings] ✅ Settings saved to settings.json permanently")
-            return jsonify({"success": True, "message": "Cấu hình đã được lưu vĩnh viễn vào settings.json"})
-        else:
-            return jsonify({"success": False, "message": "Lỗi khi ghi file settings.json"})
+        # Ghi nguyên tử rồi mới báo thành công (lỗi ghi đĩa -> success False)
+        settings.save()
+        return jsonify({"success": True, "message": "Cấu hình đã được lưu vĩnh viễn vào settings.json"})
     
+    except ValueError as e:
+        print(f"[Settings] ❌ Invalid settings: {e}")
+        return jsonify({"success": False, "message": str(e)})
     except Exception as e:
         print(f"[Settings] ❌ Error saving permanent: {e}")
         import traceback
@@ -453,22 +737,8 @@ def reset_config():
     try:
         print("[Settings] 🔄 Resetting to default values from config.py")
         
-        # Load lại giá trị mặc định từ config.py
-        default_settings = {
-            "TIME_PER_METER_SEC": config.TIME_PER_METER_SEC,
-            "LIDAR_MAX_POINTS": config.LIDAR_MAX_POINTS,
-            "LIDAR_DOT_LIFETIME": config.LIDAR_DOT_LIFETIME,
-            "LIDAR_OBSTACLE_DISTANCE": config.LIDAR_OBSTACLE_DISTANCE,
-            "LIDAR_DETECTION_ANGLE_MIN": config.LIDAR_DETECTION_ANGLE_MIN,
-            "LIDAR_DETECTION_ANGLE_MAX": config.LIDAR_DETECTION_ANGLE_MAX
-        }
-        
-        # Cập nhật runtime_settings
-        with settings_lock:
-            runtime_settings.update(default_settings)
-        
-        # Lưu vào settings.json
-        save_settings_to_json()
+        settings.reset()
+        settings.save()
         
         print("[Settings] ✅ Reset to default values successfully")
         return jsonify({"success": True, "message": "Đã reset về cấu hình mặc định từ config.py"})
@@ -477,9 +747,170 @@ def reset_config():
         print(f"[Settings] ❌ Error resetting: {e}")
         return jsonify({"success": False, "message": str(e)})
 
-if __name__ == "__main__":
-    # Tự động khởi động LIDAR khi server start
-    print("[LIDAR] Auto-starting LIDAR on server startup...")
-    Read_lidar.start_lidar_thread(LIDAR_PORT, LIDAR_BAUDRATE)
+# ===================== MISSION ROUTES =====================
+@app.route("/missions", methods=["GET"])
+def list_missions():
+    """Danh sách mission của rover (mới nhất trước). Tham số: status, limit, offset"""
+    try:
+        limit = max(1, min(1000, int(request.args.get("limit", 100))))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError as e:
+        return Response(f"Invalid parameter: {e}", status=400)
+    return jsonify({
+        "scheduler": g.rover.missions.status(),
+        "missions": mission_store.list(g.rover.id, request.args.get("status"), limit, offset)
+    })
+
+@app.route("/missions", methods=["POST"])
+def add_missions():
+    """
+    Thêm mission vào hàng đợi: form (name, priority, dis, dir, dir_value như /startRoute)
+    hoặc JSON là 1 object / list các object cùng các trường đó (thêm hàng loạt)
+    """
+    body = request.get_json(silent=True)
+    items = body if isinstance(body, list) else [body if body is not None else request.form]
+    try:
+        missions = []
+        for n, item in enumerate(items):
+            route = parse_route(item.get("dis", ""), item.get("dir", ""), item.get("dir_value", ""))
+            missions.append((item.get("name") or f"Mission {n + 1}", route, int(item.get("priority", 0))))
+    except (ValueError, TypeError, AttributeError) as e:
+        return Response(f"Invalid mission: {e}", status=400)
+    first_id = mission_store.add_many(g.rover.id, missions)
+    g.rover.missions.notify()
+    print(f"[MISSIONS] Queued {len(missions)} mission(s) on {g.rover.id}")
+    return jsonify({"queued": len(missions), "first_id": first_id})
+
+@app.route("/missions/<int:mission_id>")
+def get_mission(mission_id):
+    mission = mission_store.get(mission_id)
+    if mission is None or mission["rover"] != g.rover.id:
+        return Response("Mission not found", status=404)
+    return jsonify(mission)
+
+@app.route("/missions/<int:mission_id>/cancel", methods=["POST"])
+def cancel_mission(mission_id):
+    """Hủy mission đang chờ (mission đang chạy thì dùng /stopRoute)"""
+    mission = mission_store.get(mission_id)
+    if mission is None or mission["rover"] != g.rover.id:
+        return Response("Mission not found", status=404)
+    if not mission_store.cancel(mission_id):
+        return Response("Mission not pending", status=409)
+    return Response("Mission cancelled", mimetype="text/plain")
+
+@app.route("/missions/start", methods=["POST"])
+def start_missions():
+    """Bắt đầu / tiếp tục chạy hàng đợi"""
+    g.rover.missions.start()
+    return Response("Mission scheduler started", mimetype="text/plain")
+
+@app.route("/missions/pause", methods=["POST"])
+def pause_missions():
+    """Không lấy mission mới (mission đang chạy vẫn chạy xong)"""
+    g.rover.missions.pause()
+    return Response("Mission scheduler paused", mimetype="text/plain")
+
+@app.route("/missions/home", methods=["POST"])
+def set_mission_home():
+    """Đặt vị trí trạm sạc (lat, lon; mặc định vị trí GPS hiện tại)"""
+    snap = g.rover.shared_data.snapshot()
+    if ("lat" not in request.values or "lon" not in request.values) and not g.rover.shared_data.has_fix(snap):
+        return Response("No GPS fix - pass lat and lon explicitly", status=409)
+    try:
+        lat = float(request.values.get("lat", snap["lat"]))
+        lon = float(request.values.get("lon", snap["lon"]))
+    except ValueError as e:
+        return Response(f"Invalid parameter: {e}", status=400)
+    g.rover.missions.set_home(lat, lon)
+    return jsonify({"home": [lat, lon]})
+
+@app.route("/missions/stats")
+def mission_stats():
+    """Thống kê tổng: số mission, thời gian, vật cản, số lượt phát hiện trên mỗi mét"""
+    return jsonify(mission_store.summary(g.rover.id))
+
+@app.route("/rovers")
+def list_rovers():
+    """Danh sách rover do server quản lý (cổng thiết bị, trạng thái thread, route)"""
+    return jsonify({rover_id: rover.status() for rover_id, rover in rovers.items()})
+
+@app.route("/serial")
+def serial_status():
+    """Trạng thái serial core: các cổng, số lần kết nối lại, byte vào/ra"""
+    return jsonify(serial_core.stats())
+
+@app.route("/simulator")
+def simulator_status():
+    """Trạng thái mô phỏng: thời gian mô phỏng, vị trí, số lần va chạm của từng rover ảo"""
+    if not config.SIM_ENABLED:
+        return Response("Simulator disabled", status=404)
+    from simulator import simulator
+    return jsonify(simulator.stats())
+
+@app.route("/subsystems")
+def subsystems_status():
+    """Trạng thái khởi tạo của các subsystem lazy"""
+    return jsonify(registry.status())
+
+# ===================== PROFILER ROUTES =====================
+@app.route("/profiler/start", methods=["POST"])
+def profiler_start():
+    """Bật sampling profiler"""
+    if request.form.get("reset", "false").lower() == "true":
+        profiler.reset()
+    if profiler.start():
+        return Response("Profiler started", mimetype="text/plain")
+    return Response("Profiler already running", mimetype="text/plain")
+
+@app.route("/profiler/stop", methods=["POST"])
+def profiler_stop():
+    """Tắt sampling profiler (giữ lại kết quả)"""
+    profiler.stop()
+    return Response("Profiler stopped", mimetype="text/plain")
+
+@app.route("/profiler/stats")
+def profiler_stats():
+    """Số mẫu, chi phí lấy mẫu và phân bổ theo thread"""
+    return jsonify(profiler.stats())
+
+@app.route("/profiler/folded")
+def profiler_folded():
+    """Tải folded stacks (dùng với flamegraph.pl hoặc speedscope)"""
+    return Response(profiler.folded(), mimetype="text/plain",
+                    headers={"Content-Disposition": "attachment; filename=profile.folded"})
+
+def run_server(mode=None):
+    """
+    Chạy web server theo chế độ cấu hình:
+    - "dev": Werkzeug dev server (threaded)
+    - "waitress": WSGI server production, thread pool cố định (SERVER_THREADS)
+    Cả hai đều chạy 1 process, nên thread phần cứng chỉ có 1 bản.
+    """
+    mode = mode or config.SERVER_MODE
+    start_background_threads()
+    # Compile template trong nền để request đầu tiên không phải chờ
+    registry.start_async("templates")
+    
+    if mode == "waitress":
+        try:
+            from waitress import serve
+        except ImportError:
+            print("[Server] waitress not installed (pip install waitress) - falling back to dev server")
+        else:
+            print(f"[Server] waitress on {FLASK_HOST}:{FLASK_PORT} ({config.SERVER_THREADS} threads)")
+            serve(app, host=FLASK_HOST, port=FLASK_PORT, threads=config.SERVER_THREADS,
+                  channel_timeout=config.SERVER_CHANNEL_TIMEOUT,
+                  outbuf_high_watermark=config.SERVER_OUTBUF_HIGH_WATERMARK)
+            return
+    elif mode != "dev":
+        print(f"[Server] Unknown SERVER_MODE '{mode}' - using dev server")
     
-    app.run(host=FLASK_HOST, port=FLASK_PORT, debug=False)
+    app.run(host=FLASK_HOST, port=FLASK_PORT, debug=False, threaded=True, use_reloader=False)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="GPS/LIDAR/Detection rover server")
+    parser.add_argument("--server", choices=["dev", "waitress"], default=None,
+                        help="Chế độ server (mặc định: config.SERVER_MODE)")
+    args = parser.parse_args()
+    run_server(args.server)
@@ -0,0 +1,304 @@
+"""
+Detection offline trên video / thư mục ảnh đã ghi (chấm lại dữ liệu cũ bằng model mới).
+
+- Reader pool: nhiều thread decode trước (prefetch) các nguồn vào hàng đợi có giới hạn
+- Inference: nhiều worker song song, mỗi worker 1 backend riêng chia đều số lõi CPU
+- Ghi detection ra CSV hoặc Parquet; gắn toạ độ GPS nội suy từ thư mục track (gps_track)
+  khi có log telemetry
+- Báo thông lượng (frame/giây)
+
+Chạy: python batch_detect.py video.mp4 anh/ -o detections.csv [--telemetry track] [--workers 2]
+"""
+import argparse
+import csv
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detector import CLASS_NAMES, DETECT_MODES, INFERENCE_BACKEND, load_detector
+from gps_track import TrackHistory
+
+VIDEO_EXTS = (".mp4", ".avi", ".mkv", ".mov", ".h264", ".webm")
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+OUTPUT_COLUMNS = ("source", "frame", "t", "lat", "lon", "class_id", "class_name", "score",
+                  "x1", "y1", "x2", "y2")
+GPS_MAX_GAP_SEC = 2.0   # Frame cách fix GPS gần nhất quá lâu thì không gắn toạ độ
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def list_sources(paths, batch=64):
+    """Chia đầu vào thành các job cho reader: ("video", đường dẫn) hoặc ("images", [đường dẫn])"""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            images = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTS))
+            for i in range(0, len(images), batch):
+                jobs.append(("images", images[i:i + batch]))
+        elif path.lower().endswith(IMAGE_EXTS):
+            jobs.append(("images", [path]))
+        elif path.lower().endswith(VIDEO_EXTS):
+            jobs.append(("video", path))
+        else:
+            print(f"[Batch] Skipping unknown input: {path}")
+    return jobs
+
+
+class FrameReader:
+    """
+    Pool thread decode: mỗi job (1 video hoặc 1 nhóm ảnh) do 1 thread đọc, frame được đẩy vào
+    hàng đợi giới hạn nên decode chạy trước inference nhưng không chiếm hết RAM.
+    Phần tử: (nguồn, số frame, thời điểm epoch, frame BGR)
+    """
+    def __init__(self, jobs, out_queue, readers=2, stride=1, video_start=None):
+        self.jobs = jobs
+        self.queue = out_queue
+        self.readers = readers
+        self.stride = max(1, stride)
+        self.video_start = video_start
+        self.frames = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def _read_video(self, path):
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            print(f"[Batch] Cannot open video: {path}")
+            with self.lock:
+                self.errors += 1
+            return
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        count = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+        start = self.video_start
+        if start is None:
+            # mtime ~ lúc ghi xong video -> trừ thời lượng để ra lúc bắt đầu
+            duration = count / fps if fps > 0 else 0.0
+            start = os.path.getmtime(path) - duration
+        index = 0
+        try:
+            while True:
+                if index % self.stride:
+                    # Bỏ qua frame không cần: grab() không decode ảnh
+                    if not cap.grab():
+                        break
+                    index += 1
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                t = start + (index / fps if fps > 0 else cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+                self.queue.put((path, index, t, frame))
+                with self.lock:
+                    self.frames += 1
+                index += 1
+        finally:
+            cap.release()
+
+    def _read_images(self, paths):
+        for path in paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                with self.lock:
+                    self.errors += 1
+                continue
+            self.queue.put((path, 0, os.path.getmtime(path), frame))
+            with self.lock:
+                self.frames += 1
+
+    def _read(self, job):
+        kind, arg = job
+        if kind == "video":
+            self._read_video(arg)
+        else:
+            self._read_images(arg)
+
+    def run(self, sentinels):
+        """Đọc hết các job rồi đẩy sentinels giá trị None để báo hết dữ liệu cho worker"""
+        with ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="batch_reader") as pool:
+            for future in [pool.submit(self._read, job) for job in self.jobs]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"[Batch] Reader error: {e}")
+                    with self.lock:
+                        self.errors += 1
+        for _ in range(sentinels):
+            self.queue.put(None)
+
+
+def inference_worker(detector, mode, in_queue, out_queue):
+    """Lấy frame từ hàng đợi, chạy detection (mỗi worker 1 Detector riêng), đẩy (nguồn, frame, t, detections) sang writer"""
+    try:
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            source, index, t, frame = item
+            try:
+                detections, _, _ = detector.run(frame, mode)
+            except Exception as e:
+                print(f"[Batch] Inference error on {source}#{index}: {e}")
+                continue
+            out_queue.put((source, index, t, detections))
+    finally:
+        out_queue.put(None)
+
+
+class GpsTagger:
+    """Nội suy lat/lon theo thời điểm frame từ thư mục track (TrackHistory trên đĩa)"""
+    def __init__(self, directory, max_gap=GPS_MAX_GAP_SEC):
+        data, _ = TrackHistory(capacity=1, directory=directory).query(0.0, np.inf, max_points=np.inf)
+        order = np.argsort(data["t"], kind="stable")
+        self.t = data["t"][order]
+        self.lat = data["lat"][order]
+        self.lon = data["lon"][order]
+        self.max_gap = max_gap
+        print(f"[Batch] Telemetry: {len(self.t)} GPS fixes from {directory}")
+
+    def tag(self, t):
+        """(lat, lon) tại thời điểm t, None nếu không có fix đủ gần"""
+        if len(self.t) == 0:
+            return None, None
+        i = int(np.searchsorted(self.t, t))
+        nearest = min(abs(self.t[j] - t) for j in (i - 1, i) if 0 <= j < len(self.t))
+        if nearest > self.max_gap:
+            return None, None
+        return float(np.interp(t, self.t, self.lat)), float(np.interp(t, self.t, self.lon))
+
+
+class DetectionWriter:
+    """Ghi detection: CSV ghi dần từng dòng; Parquet gom theo cột rồi ghi 1 lần lúc đóng"""
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self.rows = 0
+        if self.parquet:
+            self.pyarrow = import_pyarrow()
+            if self.pyarrow is None:
+                raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+            self.columns = {name: [] for name in OUTPUT_COLUMNS}
+        else:
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(OUTPUT_COLUMNS)
+
+    def write(self, row):
+        self.rows += 1
+        if self.parquet:
+            for name, value in zip(OUTPUT_COLUMNS, row):
+                self.columns[name].append(value)
+        else:
+            self.writer.writerow(row)
+
+    def close(self):
+        if self.parquet:
+            table = self.pyarrow.table(self.columns)
+            self.pyarrow.parquet.write_table(table, self.path)
+        else:
+            self.file.close()
+
+
+def run_batch(inputs, output, workers=None, readers=2, mode="full", backend=INFERENCE_BACKEND,
+              telemetry=None, stride=1, video_start=None):
+    """Chạy toàn bộ pipeline, trả về thống kê (số frame, số detection, frame/giây)"""
+    if mode not in DETECT_MODES:
+        raise ValueError(f"Unknown detection mode: {mode}")
+    jobs = list_sources(inputs)
+    if not jobs:
+        raise RuntimeError("No video or image inputs found")
+    cores = os.cpu_count() or 1
+    workers = workers or max(1, cores // 2)
+    # Chia lõi cho các worker: tổng số thread inference ~ số lõi
+    threads = max(1, cores // workers)
+    print(f"[Batch] {len(jobs)} jobs, {readers} readers, {workers} workers x {threads} threads, mode={mode}")
+
+    detectors = [load_detector(backend, threads) for _ in range(workers)]
+    tagger = GpsTagger(telemetry) if telemetry else None
+    writer = DetectionWriter(output)
+    frame_queue = queue.Queue(maxsize=workers * 4)
+    result_queue = queue.Queue(maxsize=workers * 16)
+    reader = FrameReader(jobs, frame_queue, readers, stride, video_start)
+
+    start = time.time()
+    reader_thread = threading.Thread(target=reader.run, args=(workers,), name="batch_reader", daemon=True)
+    reader_thread.start()
+    worker_threads = [threading.Thread(target=inference_worker, args=(d, mode, frame_queue, result_queue),
+                                       name=f"batch_infer:{i}", daemon=True)
+                      for i, d in enumerate(detectors)]
+    for thread in worker_threads:
+        thread.start()
+
+    frames = 0
+    tagged = 0
+    finished = 0
+    last_report = start
+    try:
+        while finished < workers:
+            item = result_queue.get()
+            if item is None:
+                finished += 1
+                continue
+            source, index, t, (boxes, scores, class_ids) = item
+            frames += 1
+            lat, lon = tagger.tag(t) if tagger else (None, None)
+            if lat is not None:
+                tagged += 1
+            for (x1, y1, x2, y2), score, cls in zip(boxes, scores, class_ids):
+                name = CLASS_NAMES[cls] if cls < len(CLASS_NAMES) else f"class{cls}"
+                writer.write((source, index, round(t, 3), lat, lon, cls, name, round(score, 4),
+                              x1, y1, x2, y2))
+            now = time.time()
+            if now - last_report >= 5.0:
+                print(f"[Batch] {frames} frames, {frames / (now - start):.1f} fps")
+                last_report = now
+    finally:
+        writer.close()
+    reader_thread.join()
+    elapsed = time.time() - start
+    stats = {
+        "frames": frames,
+        "detections": writer.rows,
+        "gps_tagged_frames": tagged,
+        "read_errors": reader.errors,
+        "elapsed_sec": round(elapsed, 2),
+        "fps": round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        "backend": detectors[0].name,
+        "workers": workers
+    }
+    print(f"[Batch] Done: {frames} frames, {writer.rows} detections -> {output}")
+    print(f"[Batch] Throughput: {stats['fps']:.1f} fps ({elapsed:.1f}s, {workers} workers)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch detection over videos / image folders")
+    parser.add_argument("inputs", nargs="+", help="Video files or image directories")
+    parser.add_argument("-o", "--output", default="detections.csv", help=".csv or .parquet")
+    parser.add_argument("--workers", type=int, default=None, help="Inference workers (default: cores/2)")
+    parser.add_argument("--readers", type=int, default=2, help="Decode threads")
+    parser.add_argument("--mode", choices=DETECT_MODES, default="full")
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, help="auto | tflite | onnxruntime | opencv")
+    parser.add_argument("--telemetry", default=None, help="Track directory (gps_track) for GPS tags")
+    parser.add_argument("--stride", type=int, default=1, help="Process every Nth video frame")
+    parser.add_argument("--video-start", type=float, default=None,
+                        help="Epoch time of the first video frame (default: file mtime - duration)")
+    args = parser.parse_args()
+    run_batch(args.inputs, args.output, args.workers, args.readers, args.mode, args.backend,
+              args.telemetry, args.stride, args.video_start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark pipeline detection dùng chung cho detect.py (viewer) và detect_stream (web):
+- Thời gian từng bước của Detector: preprocess, infer, decode (NMS), draw
+- Thêm bước encode JPEG của web streamer
+- Lần lượt từng backend inference trên cùng tập ảnh mẫu
+
+Chạy: python bench_detection.py [--backends tflite,onnxruntime] [--mode full] [--runs 20]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from detector import BENCH_SAMPLES_DIR, DETECT_MODES, INPUT_SIZE, NUM_THREADS, TILE_ROI, Detector
+from inference_backends import BACKEND_NAMES, load_samples
+
+
+def sample_frames(directory, count=4, size=(640, 480)):
+    """Ảnh mẫu BGR uint8 kích thước camera (dùng lại ảnh benchmark chọn backend nếu có)"""
+    frames = []
+    for tensor in load_samples(directory, INPUT_SIZE, limit=count):
+        img = (tensor[0] * 255).astype(np.uint8)
+        frames.append(cv2.resize(img, size, interpolation=cv2.INTER_LINEAR))
+    return frames
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_detector(detector, frames, runs, mode, jpeg_quality=85):
+    """Thời gian trung bình (ms) mỗi bước trên runs frame"""
+    totals = {"preprocess": 0.0, "infer": 0.0, "decode": 0.0, "draw": 0.0, "jpeg": 0.0}
+    tiles = 1
+    for i in range(runs):
+        frame = frames[i % len(frames)]
+        if mode == "full":
+            (tensor, r, pad), ms = timed(detector.preprocess, frame)
+            totals["preprocess"] += ms
+            output, ms = timed(detector.infer, tensor)
+            totals["infer"] += ms
+            detections, ms = timed(detector.decode, output, r, pad, frame.shape)
+            totals["decode"] += ms
+        else:
+            # Tiled: preprocess/decode từng ô nằm trong detect_tiled, tính chung vào infer
+            (detections, tiles, _), ms = timed(detector.detect_tiled, frame,
+                                               TILE_ROI if mode == "roi" else None)
+            totals["infer"] += ms
+        drawn, ms = timed(detector.draw, frame.copy(), detections)
+        totals["draw"] += ms
+        _, ms = timed(cv2.imencode, ".jpg", drawn[0], [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        totals["jpeg"] += ms
+    result = {name: total / runs for name, total in totals.items()}
+    result["tiles"] = tiles
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection pipeline benchmark")
+    parser.add_argument("--backends", default=",".join(BACKEND_NAMES))
+    parser.add_argument("--mode", choices=DETECT_MODES, default="full")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=NUM_THREADS)
+    parser.add_argument("--samples", default=BENCH_SAMPLES_DIR)
+    parser.add_argument("--size", default="640x480", help="Frame size WxH (e.g. 1920x1080 for tiled)")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    frames = sample_frames(args.samples, size=(width, height))
+    for name in args.backends.split(","):
+        try:
+            detector = Detector(name, args.threads).load()
+            detector.warmup()
+        except Exception as e:
+            print(f"[Bench] {name}: unavailable ({e})")
+            continue
+        r = bench_detector(detector, frames, args.runs, args.mode)
+        viewer = r["preprocess"] + r["infer"] + r["decode"] + r["draw"]
+        print(f"[Bench] {name:12s} pre={r['preprocess']:.1f} infer={r['infer']:.1f} "
+              f"decode={r['decode']:.1f} draw={r['draw']:.1f} jpeg={r['jpeg']:.1f} ms  tiles={r['tiles']}")
+        print(f"[Bench] {name:12s} viewer (detect.py): {viewer:.1f}ms/frame ({1000 / viewer:.1f} fps)  "
+              f"web (detect_stream): {viewer + r['jpeg']:.1f}ms/frame")
+
+
+if __name__ == "__main__":
+    main()
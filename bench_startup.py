@@ -0,0 +1,63 @@
+"""
+Benchmark thời gian khởi động server:
+- Thời gian `import app` (không được load model / mở cổng serial)
+- Thời gian từ lúc chạy process đến khi /getGpsData trả lời
+
+Chạy: python bench_startup.py [--runs 3] [--server dev]
+"""
+import argparse
+import subprocess
+import sys
+import time
+import urllib.request
+
+from config import FLASK_PORT
+
+
+def measure_import():
+    """Đo thời gian import app trong process mới"""
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_response(server, timeout=30.0):
+    """Đo thời gian đến khi /getGpsData trả lời lần đầu"""
+    url = f"http://127.0.0.1:{FLASK_PORT}/getGpsData"
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "app.py", "--server", server],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=0.5) as resp:
+                    resp.read()
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"Server did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--server", choices=["dev", "waitress"], default="dev")
+    args = parser.parse_args()
+
+    import_times = [measure_import() for _ in range(args.runs)]
+    response_times = [measure_first_response(args.server) for _ in range(args.runs)]
+
+    print(f"[Bench] import app:            min={min(import_times) * 1000:.0f}ms  "
+          f"avg={sum(import_times) / len(import_times) * 1000:.0f}ms")
+    print(f"[Bench] first /getGpsData:     min={min(response_times) * 1000:.0f}ms  "
+          f"avg={sum(response_times) / len(response_times) * 1000:.0f}ms")
+    target = 1.0
+    status = "OK" if max(response_times) < target else "SLOW"
+    print(f"[Bench] target < {target:.1f}s: {status}")
+
+
+if __name__ == "__main__":
+    main()
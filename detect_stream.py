@@ -2,350 +2,535 @@ import cv2
 import numpy as np
 import time
 from concurrent.futures import ThreadPoolExecutor
-import os
 import threading
-
-# Try import TFLite runtime, fallback to TensorFlow if not available
-try:
-    import tflite_runtime.interpreter as tflite
-    print("[INFO] Using tflite_runtime")
-except ImportError:
-    try:
-        import tensorflow as tf
-        tflite = tf.lite
-        print("[INFO] Using TensorFlow Lite from tensorflow package")
-    except ImportError:
-        print("[WARNING] Neither tflite_runtime nor tensorflow found!")
-        print("[WARNING] Detection features will be disabled")
-        tflite = None
+from subsystems import registry
+from detector import CLASS_NAMES, DETECT_MODES, draw_detections, load_detector
+from video_encoder import EncoderSelector, H264Broadcaster
 
 # ===================== CONFIG =====================
-MODEL_PATH = "model.tflite"
-INPUT_SIZE = 480        
-NUM_THREADS = 4
-CONF_THRESH = 0.3
-NMS_THRESH = 0.45
-CLASS_FILE = "classes.txt"
-SKIP_FRAMES = 2
-
-# ===================== ENV TWEAKS =====================
-os.environ["OMP_NUM_THREADS"] = str(NUM_THREADS)
-os.environ["OPENBLAS_NUM_THREADS"] = str(NUM_THREADS)
-os.environ["NUMEXPR_NUM_THREADS"] = str(NUM_THREADS)
-
-# ===================== LOAD CLASSES =====================
-if os.path.exists(CLASS_FILE):
-    with open(CLASS_FILE, "r", encoding="utf-8") as f:
-        CLASS_NAMES = [c.strip() for c in f.readlines() if c.strip()]
-else:
-    # Fallback cho 2 classes: 0=Bệnh, 1=Bình thường
-    CLASS_NAMES = ["Benh", "Binh_thuong"]
-
-# ===================== LOAD TFLITE MODEL =====================
-interpreter = None
-input_details = None
-output_details = None
-
-if tflite is not None and os.path.exists(MODEL_PATH):
-    try:
-        print(f"Loading TFLite model: {MODEL_PATH}")
-        interpreter = tflite.Interpreter(model_path=MODEL_PATH, num_threads=NUM_THREADS)
-        interpreter.allocate_tensors()
-        input_details = interpreter.get_input_details()
-        output_details = interpreter.get_output_details()
-        print("Model loaded successfully.")
-    except Exception as e:
-        print(f"[ERROR] Failed to load model: {e}")
-        interpreter = None
-elif tflite is None:
-    print("[WARNING] TFLite not available - detection will be disabled")
-else:
-    print(f"[WARNING] Model file not found: {MODEL_PATH}")
-
-# ===================== GLOBAL VARIABLES =====================
-cap = None
-detection_enabled = False
-latest_frame = None
-frame_lock = threading.Lock()
-executor = ThreadPoolExecutor(max_workers=2)
-future = None
-latest_display = None
-fps_display = 0.0
-avg_inf_time = 0.0
-object_count = 0
-disease_count = 0  # Số cây bị bệnh
-healthy_count = 0  # Số cây bình thường
-
-# ===================== HELPERS =====================
-def letterbox(img, new_shape=(INPUT_SIZE, INPUT_SIZE), color=(114,114,114)):
-    """Resize and pad image while meeting stride-multiple constraints"""
-    shape = img.shape[:2]
-    if isinstance(new_shape, int):
-        new_shape = (new_shape, new_shape)
-    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
-    new_unpad = (int(round(shape[1] * r)), int(round(shape[0] * r)))
-    dw = new_shape[1] - new_unpad[0]
-    dh = new_shape[0] - new_unpad[1]
-    dw /= 2
-    dh /= 2
-
-    img_resized = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
-    top, bottom = int(round(dh - 0.0001)), int(round(dh + 0.0001))
-    left, right = int(round(dw - 0.0001)), int(round(dw + 0.0001))
-    img_padded = cv2.copyMakeBorder(img_resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
-    return img_padded, r, (left, top)
-
-def scale_coords(box_xywh, r, pad, orig_shape):
-    """Scale boxes from letterboxed image back to original"""
-    pad_x, pad_y = pad
-    x_center = (box_xywh[0] - pad_x) / r
-    y_center = (box_xywh[1] - pad_y) / r
-    w = box_xywh[2] / r
-    h = box_xywh[3] / r
-    x1 = int(x_center - w / 2)
-    y1 = int(y_center - h / 2)
-    x2 = int(x_center + w / 2)
-    y2 = int(y_center + h / 2)
-    x1 = max(0, min(orig_shape[1]-1, x1))
-    y1 = max(0, min(orig_shape[0]-1, y1))
-    x2 = max(0, min(orig_shape[1]-1, x2))
-    y2 = max(0, min(orig_shape[0]-1, y2))
-    return [x1, y1, x2, y2]
-
-def nms_boxes(boxes, scores, iou_threshold=NMS_THRESH):
-    """NMS using OpenCV"""
-    if len(boxes) == 0:
-        return []
-    rects = [[int(b[0]), int(b[1]), int(b[2]-b[0]), int(b[3]-b[1])] for b in boxes]
-    indices = cv2.dnn.NMSBoxes(rects, scores, CONF_THRESH, iou_threshold)
-    if len(indices) == 0:
-        return []
-    indices = np.array(indices).reshape(-1)
-    return indices.tolist()
-
-# ===================== INFERENCE WORKER =====================
-def infer_on_image(img_bgr):
-    """Run inference on image"""
-    # Kiểm tra nếu không có interpreter
-    if interpreter is None:
-        return None, 0, (0, 0), 0.0
-    
-    start_time = time.time()
-    
-    img_padded, r, pad = letterbox(img_bgr, (INPUT_SIZE, INPUT_SIZE))
-    input_tensor = img_padded.astype(np.float32) / 255.0
-    input_index = input_details[0]['index']
-    
-    if input_details[0]['dtype'] == np.float32:
-        interpreter.set_tensor(input_index, np.expand_dims(input_tensor, 0).astype(np.float32))
-    else:
-        interpreter.set_tensor(input_index, np.expand_dims(input_tensor, 0).astype(input_details[0]['dtype']))
-    
-    interpreter.invoke()
-    output_data = interpreter.get_tensor(output_details[0]['index'])
-    
-    inference_time = time.time() - start_time
-    return output_data[0], r, pad, inference_time
-
-# ===================== POSTPROCESS =====================
-def postprocess_and_draw(output, r, pad, frame):
-    """Decode model output and draw bounding boxes"""
-    global object_count, disease_count, healthy_count
-    
-    # Nếu không có output (interpreter = None)
-    if output is None:
-        return frame
-    
-    h0, w0 = frame.shape[:2]
-    boxes = []
-    scores = []
-    class_ids = []
-
-    for det in output:
-        x, y, w, hh, obj_conf = det[0], det[1], det[2], det[3], det[4]
-        class_confs = det[5:]
-        class_id = int(np.argmax(class_confs))
-        class_conf = float(class_confs[class_id])
-        final_conf = float(obj_conf) * class_conf
-        if final_conf < CONF_THRESH:
-            continue
-
-        if max(x, y, w, hh) <= 1.01:
-            x_px = x * INPUT_SIZE
-            y_px = y * INPUT_SIZE
-            w_px = w * INPUT_SIZE
-            h_px = hh * INPUT_SIZE
-        else:
-            x_px = x
-            y_px = y
-            w_px = w
-            h_px = hh
-
-        box_xywh = [x_px, y_px, w_px, h_px]
-        x1, y1, x2, y2 = scale_coords(box_xywh, r, pad, (h0, w0))
-        boxes.append([x1, y1, x2, y2])
-        scores.append(final_conf)
-        class_ids.append(class_id)
-
-    indices = nms_boxes(boxes, scores, iou_threshold=NMS_THRESH)
-    object_count = len(indices)
-    
-    # Đếm số lượng từng loại
-    disease_count = 0
-    healthy_count = 0
-    
-    if len(indices) == 0:
-        return frame
+# Model, ngưỡng, tiled và backend inference: xem detector.py
+# Bỏ qua inference khi xe đứng yên và khung hình gần như không đổi
+GATE_ENABLED = True
+GATE_SIZE = (32, 24)        # Kích thước ảnh xám thu nhỏ để so sánh
+GATE_DIFF_THRESH = 6.0      # Chênh lệch trung bình (mức xám 0-255) coi là cảnh đã đổi
+GATE_MAX_AGE_SEC = 5.0      # Kết quả cũ hơn thì vẫn chạy inference lại
+DETECT_MODE = "full"        # Chế độ mặc định: "full", "tiled" hoặc "roi" (detector.DETECT_MODES)
+CAPTURE_SIZE = None         # (rộng, cao) yêu cầu camera, ví dụ (1920, 1080) cho tiled; None = mặc định
+# Stream video (chỉ ảnh gửi cho người xem; detection luôn dùng frame gốc độ phân giải đầy đủ)
+STREAM_MAX_WIDTH = 960      # Thu nhỏ frame phát đi về chiều rộng này (None = giữ nguyên)
+STREAM_LEVELS = ((1.0, 85), (0.75, 70), (0.5, 50))  # Mức MJPEG (tỉ lệ kích thước, chất lượng JPEG)
+STREAM_ADAPTIVE = True      # Tự đổi mức theo tỉ lệ frame client bỏ lỡ (client chậm / Wi-Fi yếu)
+STREAM_ADAPT_WINDOW = 30    # Số frame gửi đi giữa 2 lần xét đổi mức
+STREAM_DROP_DOWN = 0.3      # Bỏ lỡ > 30% frame mới -> hạ 1 mức
+STREAM_DROP_UP = 0.05       # Bỏ lỡ < 5% -> nâng 1 mức
+# H.264 (/video_feed_h264): thử lần lượt, encoder phần cứng V4L2 của Pi trước, x264 phần mềm sau
+H264_ENCODERS = (("ffmpeg", "h264_v4l2m2m"), ("gstreamer", "v4l2h264enc"),
+                 ("ffmpeg", "libx264"), ("gstreamer", "x264enc"))
+H264_HW_DEVICE = "/dev/video11"  # Thiết bị encoder phần cứng (không có thì bỏ qua codec V4L2)
+H264_FPS = 15
+H264_BITRATE = 1000000      # bit/s
+H264_GOP = 30               # Khoảng cách keyframe (frame)
+H264_BACKLOG = 16           # Số fragment MP4 giữ lại cho người xem chậm trước khi phải chờ keyframe
 
-    for i in indices:
-        x1, y1, x2, y2 = boxes[i]
-        cls = class_ids[i]
-        label = CLASS_NAMES[cls] if cls < len(CLASS_NAMES) else f"class{cls}"
-        conf = scores[i]
-        
-        # Đếm số lượng
-        if cls == 0:
-            disease_count += 1
-        else:
-            healthy_count += 1
-        
-        # Màu sắc: Đỏ nếu bệnh (class 0), Xanh lá nếu bình thường (class 1)
-        if cls == 0:
-            color = (0, 0, 255)  # Đỏ - Bệnh
-            display_label = f"BENH {conf:.2f}"
-        else:
-            color = (0, 255, 0)  # Xanh lá - Bình thường
-            display_label = f"BINH THUONG {conf:.2f}"
-        
-        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
-        txt = display_label
-        t_size = cv2.getTextSize(txt, 0, fontScale=0.7, thickness=2)[0]
-        cv2.rectangle(frame, (x1, y1 - 25), (x1 + t_size[0] + 10, y1), color, -1)
-        cv2.putText(frame, txt, (x1 + 5, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2, cv2.LINE_AA)
+# Model không load lúc import (import tensorflow mất nhiều giây trên Pi): Detector được load
+# trong thread nền ở lần /start_detection đầu tiên, kèm warmup. Mỗi camera session có Detector
+# riêng (backend không thread-safe), nên nhiều camera không phải chờ lock của nhau.
 
-    return frame
 
-# ===================== CAMERA FUNCTIONS =====================
-def init_camera():
-    """Initialize camera"""
-    global cap
-    if cap is None or not cap.isOpened():
-        cap = cv2.VideoCapture(0)
-        if cap.isOpened():
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            print("Camera initialized")
+class FrameGate:
+    """
+    Cổng thay đổi khung hình: so ảnh xám thu nhỏ (GATE_SIZE) của khung hình mới với khung hình
+    đã chạy inference gần nhất. Cảnh tĩnh -> dùng lại kết quả cũ (tối đa GATE_MAX_AGE_SEC).
+    Chỉ dùng khi xe đứng yên; khi xe đang chạy cảnh luôn đổi nên không tốn công so sánh.
+    """
+    def __init__(self, size=GATE_SIZE, threshold=GATE_DIFF_THRESH, max_age=GATE_MAX_AGE_SEC):
+        self.size = size
+        self.threshold = threshold
+        self.max_age = max_age
+        self.reference = None
+        self.reference_time = 0.0
+        self.last_diff = None
+        self.skipped = 0
+
+    def signature(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def should_infer(self, frame, stationary):
+        """True nếu cần chạy inference cho frame (và ghi nhớ frame làm mốc so sánh)"""
+        now = time.time()
+        if not stationary:
+            self.reference = None
+            self.last_diff = None
             return True
-    return cap is not None and cap.isOpened()
-
-def release_camera():
-    """Release camera"""
-    global cap
-    if cap is not None:
-        cap.release()
-        cap = None
-        print("Camera released")
-
-def get_frame():
-    """Get current frame with or without detection"""
-    global latest_frame, latest_display, future, fps_display, avg_inf_time
-    global frame_lock, detection_enabled
-    
-    if cap is None or not cap.isOpened():
-        return None
-    
-    ret, frame = cap.read()
-    if not ret:
-        return None
-    
-    with frame_lock:
-        latest_frame = frame.copy()
-    
-    if detection_enabled and interpreter is not None:
-        # Detection mode - run inference
-        if future is not None and future.done():
-            try:
-                output, r, pad, inf_time = future.result()
-                latest_display = postprocess_and_draw(output, r, pad, frame.copy())
-                avg_inf_time = inf_time
-            except Exception as e:
-                print("Error processing detection:", e)
-                latest_display = frame
-        
-        if future is None or future.done():
-            future = executor.submit(infer_on_image, frame.copy())
+        signature = self.signature(frame)
+        if self.reference is not None and now - self.reference_time < self.max_age:
+            self.last_diff = float(np.abs(signature - self.reference).mean())
+            if self.last_diff < self.threshold:
+                self.skipped += 1
+                return False
+        self.reference = signature
+        self.reference_time = now
+        return True
+
+    def reset(self):
+        self.reference = None
+        self.last_diff = None
+
+
+class CameraSession:
+    """
+    1 camera: VideoCapture, backend inference, executor inference, broadcaster và bộ đếm riêng.
+    Trạng thái tách riêng theo camera nên 1 server có thể chạy nhiều camera (nhiều rover) song song.
+    """
+    def __init__(self, camera_id, source=0):
+        self.id = camera_id
+        self.source = source
+        self.cap = None
+        self.detection_enabled = False
+        self.latest_frame = None
+        self.frame_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"detect_infer:{camera_id}")
+        self.future = None
+        self.frame_id = 0  # Số thứ tự frame đọc từ camera (gắn với kết quả detection và MJPEG)
+        self.result = None  # Kết quả detection mới nhất dạng dữ liệu (xem _set_result)
+        self.result_detections = None
+        self.result_seq = 0  # Tăng mỗi kết quả mới (client hỏi /detections?since=<seq>)
+        self.result_checked = 0.0  # Lần cuối kết quả được xác nhận còn đúng (inference / cảnh không đổi)
+        self.fps_display = 0.0
+        self.avg_inf_time = 0.0
+        self.object_count = 0
+        self.disease_count = 0  # Số cây bị bệnh
+        self.healthy_count = 0  # Số cây bình thường
+        self.detections_total = 0  # Tổng số lượt phát hiện từ khi khởi động (thống kê mission)
+        self.inferences = 0
+        self.mode = DETECT_MODE
+        self.tiles = 0
+        self.gate = FrameGate()
+        # Hàm trả về True khi xe đứng yên (rover gán theo trạng thái route); None = luôn chạy inference
+        self.is_stationary = None
+        self.model = registry.register(f"detection_model:{camera_id}", load_detector)
+        self.broadcaster = FrameBroadcaster(self)
+        self.h264 = None  # H264Broadcaster, tạo ở người xem H.264 đầu tiên
+
+    def load_model_async(self):
+        """Bắt đầu load model trong thread nền (không chặn request)"""
+        return self.model.start_async()
+
+    def init_camera(self):
+        """Initialize camera"""
+        if self.cap is None or not self.cap.isOpened():
+            self.cap = open_capture(self.source)
+            if self.cap.isOpened():
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                if CAPTURE_SIZE is not None:
+                    self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_SIZE[0])
+                    self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_SIZE[1])
+                print(f"Camera {self.id} initialized")
+                return True
+        return self.cap is not None and self.cap.isOpened()
+
+    def release_camera(self):
+        """Release camera"""
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+            print(f"Camera {self.id} released")
+
+    def get_frame(self):
+        """
+        Đọc 1 frame thô (không vẽ gì lên ảnh) và gửi frame cho inference khi bật detection.
+        Kết quả detection được lưu dạng dữ liệu (get_result) gắn với frame_id của frame đã chạy.
+        """
+        cap = self.cap
+        if cap is None or not cap.isOpened():
+            return None
         
-        display = latest_display if latest_display is not None else frame
+        ret, frame = cap.read()
+        if not ret:
+            return None
         
-        # Draw stats on frame
-        cv2.putText(display, f"FPS: {fps_display:.1f}", (10, 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
-        cv2.putText(display, f"Inference: {avg_inf_time*1000:.0f}ms", (10, 60), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255), 2)
-        cv2.putText(display, f"Cay phat hien: {object_count}", (10, 90), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,100,255), 2)
+        with self.frame_lock:
+            self.latest_frame = frame.copy()
+            self.frame_id += 1
         
-        return display
-    elif detection_enabled and interpreter is None:
-        # Detection requested but model not available
-        cv2.putText(frame, "Detection unavailable - Model not loaded", (10, 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
-        return frame
-    else:
-        # Camera only mode - no detection
-        cv2.putText(frame, "Camera Mode - No Detection", (10, 30), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        model = self.model.value if self.model.is_ready() else None
+        if self.detection_enabled and model is not None:
+            # Detection mode - run inference
+            future = self.future
+            if future is not None and future.done():
+                try:
+                    detections, tiles, inf_time = future.result()
+                    self._set_result(future.frame_id, frame.shape, detections, tiles, inf_time)
+                except Exception as e:
+                    print("Error processing detection:", e)
+            
+            if future is None or future.done():
+                stationary = GATE_ENABLED and self.is_stationary is not None and self.is_stationary()
+                if self.result is None or self.gate.should_infer(frame, stationary):
+                    future = self.executor.submit(model.run, frame.copy(), self.mode)
+                    future.frame_id = self.frame_id
+                    self.future = future
+                    self.inferences += 1
+                else:
+                    # Cảnh không đổi: giữ kết quả cũ, không chạy inference
+                    self.future = None
+                    self.result_checked = time.time()
         return frame
 
-def generate_frames():
-    """Generator for video streaming"""
-    frame_count = 0
-    fps_start_time = time.time()
-    global fps_display
-    
-    while True:
-        frame = get_frame()
-        if frame is None:
-            time.sleep(0.1)
-            continue
-        
-        # Update FPS
-        frame_count += 1
-        current_time = time.time()
-        elapsed = current_time - fps_start_time
-        if elapsed >= 1.0:
-            fps_display = frame_count / elapsed
-            frame_count = 0
-            fps_start_time = current_time
-        
-        # Encode frame to JPEG
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        if not ret:
-            continue
-        
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    def _set_result(self, frame_id, shape, detections, tiles, inf_time):
+        """Lưu kết quả inference dạng dữ liệu có cấu trúc + cập nhật bộ đếm"""
+        boxes, scores, class_ids = detections
+        self.tiles = tiles
+        self.avg_inf_time = inf_time
+        self.object_count = len(boxes)
+        self.disease_count = sum(1 for cls in class_ids if cls == 0)
+        self.healthy_count = self.object_count - self.disease_count
+        self.detections_total += self.object_count
+        self.result_seq += 1
+        result = {
+            "seq": self.result_seq,
+            "frame_id": frame_id,
+            "t": time.time(),
+            "width": shape[1],
+            "height": shape[0],
+            "mode": self.mode,
+            "inference_ms": round(inf_time * 1000, 1),
+            "detections": [
+                {"box": [int(v) for v in box], "class_id": int(cls),
+                 "class_name": CLASS_NAMES[cls] if cls < len(CLASS_NAMES) else f"class{cls}",
+                 "score": round(float(score), 4)}
+                for box, score, cls in zip(boxes, scores, class_ids)
+            ]
+        }
+        with self.frame_lock:
+            self.result = result
+            self.result_detections = detections
+            self.result_checked = result["t"]
+
+    def get_result(self):
+        """
+        Kết quả detection mới nhất (dict, None nếu chưa có) kèm frame_id đang phát và age_ms:
+        thời gian từ lần cuối kết quả được xác nhận, để client bỏ box đã cũ
+        """
+        with self.frame_lock:
+            if self.result is None:
+                return None
+            return {**self.result, "stream_frame_id": self.frame_id,
+                    "age_ms": round((time.time() - self.result_checked) * 1000)}
+
+    def annotate(self, frame):
+        """
+        Bản vẽ sẵn box + thông số trên server (cho client không tự vẽ overlay được,
+        ví dụ VLC). Chỉ chạy khi có người xem /video_feed?overlay=1
+        """
+        display = frame.copy()
+        model_ready = self.model.is_ready()
+        if self.detection_enabled and model_ready:
+            with self.frame_lock:
+                detections = self.result_detections
+            if detections is not None:
+                draw_detections(display, *detections)
+            
+            # Draw stats on frame
+            cv2.putText(display, f"FPS: {self.fps_display:.1f}", (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0), 2)
+            cv2.putText(display, f"Inference: {self.avg_inf_time*1000:.0f}ms", (10, 60), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255), 2)
+            cv2.putText(display, f"Cay phat hien: {self.object_count}", (10, 90), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,100,255), 2)
+        elif self.detection_enabled and self.model.state == "loading":
+            # Model đang load trong thread nền
+            cv2.putText(display, "Loading model...", (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255), 2)
+        elif self.detection_enabled:
+            # Detection requested but model not available
+            cv2.putText(display, "Detection unavailable - Model not loaded", (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
+        else:
+            # Camera only mode - no detection
+            cv2.putText(display, "Camera Mode - No Detection", (10, 30), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        return display
+
+    def generate_frames(self, overlay=False, level=None):
+        """
+        Generator for video streaming (overlay=True: frame đã vẽ box trên server;
+        level: mức STREAM_LEVELS cố định, None = tự động)
+        """
+        for _, frame_bytes in self.broadcaster.frames(overlay, level):
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+    def generate_h264(self):
+        """
+        Stream H.264 (fragmented MP4) từ encoder dùng chung của camera.
+        Trả về None nếu máy không có encoder H.264 nào
+        """
+        choice = h264_selector.select()
+        if choice is None:
+            return None
+        if self.h264 is None:
+            backend, codec = choice
+            self.h264 = H264Broadcaster(self.broadcaster.raw_frames, backend, codec, H264_FPS, H264_BITRATE,
+                                        H264_GOP, STREAM_MAX_WIDTH, H264_BACKLOG, name=f"h264:{self.id}")
+        return self.h264.chunks()
+
+    def set_detection_mode(self, mode):
+        """Chế độ inference: "full", "tiled" hoặc "roi" (áp dụng từ khung hình kế tiếp)"""
+        if mode not in DETECT_MODES:
+            raise ValueError(f"Unknown detection mode: {mode}")
+        self.mode = mode
+        self.gate.reset()
+
+    def set_detection_enabled(self, enabled):
+        """Enable or disable detection"""
+        self.detection_enabled = enabled
+        if enabled:
+            self.load_model_async()
+        else:
+            with self.frame_lock:
+                self.result = None
+                self.result_detections = None
+            self.future = None
+            self.gate.reset()
+            self.object_count = 0
+            self.disease_count = 0
+            self.healthy_count = 0
+        print(f"Detection {'enabled' if enabled else 'disabled'} on camera {self.id}")
+
+    def get_stats(self):
+        """Get current detection statistics"""
+        return {
+            "fps": round(self.fps_display, 1),
+            "plants_detected": self.object_count,  # Số cây phát hiện
+            "disease_count": self.disease_count,    # Số cây bị bệnh
+            "healthy_count": self.healthy_count,    # Số cây bình thường
+            "detections_total": self.detections_total,
+            "inferences": self.inferences,
+            "gated_frames": self.gate.skipped,
+            "gate_diff": round(self.gate.last_diff, 2) if self.gate.last_diff is not None else None,
+            "inference_time": round(self.avg_inf_time * 1000, 0),
+            "mode": self.mode,
+            "tiles": self.tiles,
+            "ms_per_tile": round(self.avg_inf_time * 1000 / self.tiles, 1) if self.tiles else None,
+            "model_state": self.model.state,
+            "backend": self.model.value.name if self.model.is_ready() else None,
+            "frame_id": self.frame_id,
+            "viewers": self.broadcaster.client_count(),
+            "stream": self.broadcaster.stats(),
+            "h264": self.h264.stats() if self.h264 is not None else None
+        }
+
+def scale_width(frame, max_width):
+    """Thu nhỏ frame về chiều rộng tối đa max_width (giữ tỉ lệ)"""
+    if max_width and frame.shape[1] > max_width:
+        scale = max_width / frame.shape[1]
+        return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return frame
+
+
+class FrameBroadcaster:
+    """Đọc camera + encode JPEG một lần, phát cùng 1 frame cho mọi client.
+
+    Mỗi client /video_feed chỉ chờ frame mới trên Condition thay vì tự gọi
+    cap.read() và imencode, nên nhiều người xem cùng lúc không làm tăng CPU.
+    Frame phát đi là ảnh thô; overlay detection do trình duyệt tự vẽ từ /detections.
+    Mỗi biến thể (mức STREAM_LEVELS, có/không overlay vẽ sẵn) chỉ được encode khi có
+    client đang xem nó. Client chậm bỏ lỡ frame -> tự hạ mức (ảnh nhỏ hơn, nén mạnh hơn).
+    Thread capture tự dừng khi không còn client nào.
+    """
+    def __init__(self, session, levels=STREAM_LEVELS, idle_timeout=2.0):
+        self.session = session
+        self.cond = threading.Condition()
+        self.levels = levels
+        self.idle_timeout = idle_timeout
+        self.variants = {}      # (mức, overlay) -> JPEG của frame hiện tại
+        self.wanted = {}        # (mức, overlay) -> số client đang xem
+        self.raw_frame = None   # Frame thô hiện tại (cho encoder H.264)
+        self.frame_id = 0
+        self.clients = 0
+        self.bytes_sent = 0
+        self.level_changes = 0
+        self._thread = None
+
+    def _ensure_running(self):
+        # Gọi khi đang giữ self.cond
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"camera_broadcaster:{self.session.id}",
+                                            daemon=True)
+            self._thread.start()
+
+    def _encode(self, frame, level):
+        scale, quality = self.levels[level]
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes() if ret else None
+
+    def _run(self):
+        frame_count = 0
+        fps_start_time = time.time()
+        idle_since = None
         
-        time.sleep(0.01)  # Small delay to prevent CPU overload
-
-def set_detection_enabled(enabled):
-    """Enable or disable detection"""
-    global detection_enabled, latest_display, future, object_count, disease_count, healthy_count
-    detection_enabled = enabled
-    if not enabled:
-        latest_display = None
-        future = None
-        object_count = 0
-        disease_count = 0
-        healthy_count = 0
-    print(f"Detection {'enabled' if enabled else 'disabled'}")
-
-def get_stats():
-    """Get current detection statistics"""
-    return {
-        "fps": round(fps_display, 1),
-        "plants_detected": object_count,  # Số cây phát hiện
-        "disease_count": disease_count,    # Số cây bị bệnh
-        "healthy_count": healthy_count,    # Số cây bình thường
-        "inference_time": round(avg_inf_time * 1000, 0)
-    }
+        while True:
+            with self.cond:
+                if self.clients == 0:
+                    if idle_since is None:
+                        idle_since = time.time()
+                    elif time.time() - idle_since > self.idle_timeout:
+                        self._thread = None
+                        print("[Camera] Broadcaster stopped (no clients)")
+                        return
+                else:
+                    idle_since = None
+                wanted = [key for key, count in self.wanted.items() if count > 0]
+            
+            frame = self.session.get_frame()
+            if frame is None:
+                time.sleep(0.1)
+                continue
+            
+            # Update FPS
+            frame_count += 1
+            current_time = time.time()
+            elapsed = current_time - fps_start_time
+            if elapsed >= 1.0:
+                self.session.fps_display = frame_count / elapsed
+                frame_count = 0
+                fps_start_time = current_time
+            
+            # Encode frame to JPEG (1 lần cho mỗi biến thể đang có người xem)
+            small = scale_width(frame, STREAM_MAX_WIDTH)
+            annotated = None
+            variants = {}
+            for level, overlay in wanted:
+                if overlay and annotated is None:
+                    annotated = scale_width(self.session.annotate(frame), STREAM_MAX_WIDTH)
+                variants[(level, overlay)] = self._encode(annotated if overlay else small, level)
+            
+            with self.cond:
+                self.variants = variants
+                self.raw_frame = frame
+                self.frame_id = self.session.frame_id
+                self.cond.notify_all()
+
+    def _watch(self, key, delta):
+        # Gọi khi đang giữ self.cond
+        self.wanted[key] = self.wanted.get(key, 0) + delta
+
+    def frames(self, overlay=False, level=None):
+        """
+        Generator trả về (frame_id, JPEG) các frame mới cho 1 client.
+        level: mức cố định trong STREAM_LEVELS; None = tự động theo backpressure (STREAM_ADAPTIVE)
+        """
+        adaptive = level is None and STREAM_ADAPTIVE
+        level = max(0, min(level or 0, len(self.levels) - 1))
+        with self.cond:
+            self.clients += 1
+            self._watch((level, overlay), 1)
+            self._ensure_running()
+            last_id = self.frame_id
+        sent = 0
+        missed = 0
+        try:
+            while True:
+                with self.cond:
+                    # Chờ frame mới; timeout để phát hiện broadcaster dừng
+                    if not self.cond.wait_for(lambda: self.frame_id != last_id, timeout=1.0):
+                        self._ensure_running()
+                        continue
+                    # Frame ra đời trong lúc client còn đang nhận frame trước = bỏ lỡ
+                    if last_id:
+                        missed += max(0, self.frame_id - last_id - 1)
+                    last_id = self.frame_id
+                    frame_bytes = self.variants.get((level, overlay))
+                    if frame_bytes is not None:
+                        self.bytes_sent += len(frame_bytes)
+                if frame_bytes is None:
+                    continue
+                yield last_id, frame_bytes
+                sent += 1
+                if adaptive and sent >= STREAM_ADAPT_WINDOW:
+                    drop = missed / (sent + missed)
+                    new_level = level
+                    if drop > STREAM_DROP_DOWN and level < len(self.levels) - 1:
+                        new_level = level + 1
+                    elif drop < STREAM_DROP_UP and level > 0:
+                        new_level = level - 1
+                    if new_level != level:
+                        with self.cond:
+                            self._watch((level, overlay), -1)
+                            self._watch((new_level, overlay), 1)
+                            self.level_changes += 1
+                        level = new_level
+                    sent = 0
+                    missed = 0
+        finally:
+            with self.cond:
+                self.clients -= 1
+                self._watch((level, overlay), -1)
+
+    def raw_frames(self):
+        """Generator frame thô mới nhất (bỏ qua frame khi người dùng chậm) cho encoder H.264"""
+        with self.cond:
+            self.clients += 1
+            self._ensure_running()
+            last_id = self.frame_id
+        try:
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.frame_id != last_id and self.raw_frame is not None,
+                                              timeout=1.0):
+                        self._ensure_running()
+                        continue
+                    last_id = self.frame_id
+                    frame = self.raw_frame
+                yield frame
+        finally:
+            with self.cond:
+                self.clients -= 1
+
+    def client_count(self):
+        with self.cond:
+            return self.clients
+
+    def stats(self):
+        with self.cond:
+            return {
+                "clients": self.clients,
+                "variants": {f"level{level}{'_overlay' if overlay else ''}": count
+                             for (level, overlay), count in self.wanted.items() if count > 0},
+                "bytes_sent": self.bytes_sent,
+                "level_changes": self.level_changes
+            }
+
+
+
+# Nguồn camera đặc biệt "<scheme>:<tham số>" -> hàm mở trả về đối tượng giống cv2.VideoCapture
+# (ví dụ "sim:<rover_id>" của simulator.py)
+camera_openers = {}
+
+def open_capture(source):
+    if isinstance(source, str) and ":" in source:
+        scheme, arg = source.split(":", 1)
+        opener = camera_openers.get(scheme)
+        if opener is not None:
+            return opener(arg)
+    return cv2.VideoCapture(source)
+
+# Global instance (kiểm tra encoder H.264 có trên máy 1 lần cho mọi camera)
+h264_selector = EncoderSelector(H264_ENCODERS, H264_HW_DEVICE)
+
+# Các camera đang quản lý (camera_id -> CameraSession)
+camera_sessions = {}
+sessions_lock = threading.Lock()
+
+def get_camera_session(camera_id, source=0):
+    """Lấy (tạo nếu chưa có) camera session theo ID"""
+    with sessions_lock:
+        session = camera_sessions.get(camera_id)
+        if session is None:
+            session = CameraSession(camera_id, source)
+            camera_sessions[camera_id] = session
+        return session
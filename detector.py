@@ -0,0 +1,333 @@
+"""
+Thư viện detection dùng chung cho mọi front end (detect.py, detect_stream.py, batch_detect.py):
+- Cấu hình model/ngưỡng/tiled và danh sách class
+- API decode không trạng thái: letterbox, scale_coords, nms_boxes, decode_output,
+  merge_detections, draw_detections, make_tiles
+- Detector: load -> warmup -> preprocess -> infer -> decode -> draw trên 1 backend inference
+
+Không load model lúc import (import tensorflow mất nhiều giây trên Pi); front end gọi
+Detector().load() khi cần. Detection trả về dạng (boxes [x1, y1, x2, y2], scores, class_ids)
+theo toạ độ ảnh gốc.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+from inference_backends import BACKEND_AUTO, BACKEND_NAMES, BackendSelector, create_backend
+
+# ===================== CONFIG =====================
+MODEL_PATH = "model.tflite"
+INPUT_SIZE = 480
+NUM_THREADS = 4
+CONF_THRESH = 0.3
+NMS_THRESH = 0.45
+CLASS_FILE = "classes.txt"
+# Chế độ detection: "full" (thu cả khung về INPUT_SIZE), "tiled" (cắt ô INPUT_SIZE chồng lấn
+# trên ảnh độ phân giải cao, giữ chi tiết nhỏ), "roi" (như tiled nhưng chỉ trong dải luống cây)
+DETECT_MODES = ("full", "tiled", "roi")
+TILE_OVERLAP = 96           # Số pixel chồng lấn giữa 2 ô kề nhau (>= kích thước vật nhỏ nhất)
+TILE_SCALE = 1.0            # Thu nhỏ ảnh trước khi cắt ô (< 1 = ít ô hơn, nhanh hơn)
+TILE_ROI = (0.35, 0.95)     # Dải luống cây theo chiều cao khung hình (tỉ lệ 0-1) cho chế độ "roi"
+TILE_MERGE_IOS = 0.6        # Box bị box điểm cao hơn phủ quá tỉ lệ này (vật bị cắt ở mép ô) thì bỏ
+# Backend inference: "auto" (benchmark chọn backend nhanh nhất trên CPU này), "tflite",
+# "onnxruntime" hoặc "opencv" (2 backend sau dùng ONNX_MODEL_PATH)
+INFERENCE_BACKEND = "auto"
+AUTO_BACKENDS = BACKEND_NAMES   # Các backend được thử khi "auto"
+ONNX_MODEL_PATH = "model.onnx"
+TFLITE_XNNPACK = True           # Delegate XNNPACK cho TFLite (False = kernel tham chiếu)
+BENCH_SAMPLES_DIR = "bench_samples"  # Ảnh mẫu cho benchmark chọn backend (không có thì dùng nhiễu)
+BENCH_RUNS = 10
+BACKEND_CACHE = "backend_choice.json"  # Kết quả benchmark, chỉ chạy lại khi đổi máy/model
+
+# ===================== ENV TWEAKS =====================
+os.environ["OMP_NUM_THREADS"] = str(NUM_THREADS)
+os.environ["OPENBLAS_NUM_THREADS"] = str(NUM_THREADS)
+os.environ["NUMEXPR_NUM_THREADS"] = str(NUM_THREADS)
+
+# ===================== LOAD CLASSES =====================
+if os.path.exists(CLASS_FILE):
+    with open(CLASS_FILE, "r", encoding="utf-8") as f:
+        CLASS_NAMES = [c.strip() for c in f.readlines() if c.strip()]
+else:
+    # Fallback cho 2 classes: 0=Bệnh, 1=Bình thường
+    CLASS_NAMES = ["Benh", "Binh_thuong"]
+
+# ===================== HELPERS =====================
+def letterbox(img, new_shape=(INPUT_SIZE, INPUT_SIZE), color=(114,114,114)):
+    """Resize and pad image while meeting stride-multiple constraints.
+       Returns resized image, scale, and padding (dw, dh).
+    """
+    shape = img.shape[:2]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = (int(round(shape[1] * r)), int(round(shape[0] * r)))
+    dw = new_shape[1] - new_unpad[0]
+    dh = new_shape[0] - new_unpad[1]
+    dw /= 2
+    dh /= 2
+
+    img_resized = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.0001)), int(round(dh + 0.0001))
+    left, right = int(round(dw - 0.0001)), int(round(dw + 0.0001))
+    img_padded = cv2.copyMakeBorder(img_resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img_padded, r, (left, top)
+
+def scale_coords(box_xywh, r, pad, orig_shape):
+    """Scale boxes from letterboxed image back to original image size.
+       box_xywh: [x_center, y_center, w, h] in pixels relative to input_size
+    """
+    pad_x, pad_y = pad
+    x_center = (box_xywh[0] - pad_x) / r
+    y_center = (box_xywh[1] - pad_y) / r
+    w = box_xywh[2] / r
+    h = box_xywh[3] / r
+    x1 = int(x_center - w / 2)
+    y1 = int(y_center - h / 2)
+    x2 = int(x_center + w / 2)
+    y2 = int(y_center + h / 2)
+    x1 = max(0, min(orig_shape[1]-1, x1))
+    y1 = max(0, min(orig_shape[0]-1, y1))
+    x2 = max(0, min(orig_shape[1]-1, x2))
+    y2 = max(0, min(orig_shape[0]-1, y2))
+    return [x1, y1, x2, y2]
+
+def nms_boxes(boxes, scores, iou_threshold=NMS_THRESH):
+    """NMS using OpenCV. boxes in [x1, y1, x2, y2] format"""
+    if len(boxes) == 0:
+        return []
+    rects = [[int(b[0]), int(b[1]), int(b[2]-b[0]), int(b[3]-b[1])] for b in boxes]
+    indices = cv2.dnn.NMSBoxes(rects, scores, CONF_THRESH, iou_threshold)
+    if len(indices) == 0:
+        return []
+    indices = np.array(indices).reshape(-1)
+    return indices.tolist()
+
+# ===================== DECODE (STATELESS) =====================
+def decode_output(output, r, pad, orig_shape, input_size=INPUT_SIZE):
+    """Output model -> (boxes [x1, y1, x2, y2] theo ảnh gốc, scores, class_ids) trước NMS"""
+    boxes = []
+    scores = []
+    class_ids = []
+    if output is None:
+        return boxes, scores, class_ids
+    h0, w0 = orig_shape[:2]
+
+    # output is (N, 5 + num_classes): [x, y, w, h, obj_conf, class_scores...]
+    for det in output:
+        x, y, w, hh, obj_conf = det[0], det[1], det[2], det[3], det[4]
+        class_confs = det[5:]
+        class_id = int(np.argmax(class_confs))
+        class_conf = float(class_confs[class_id])
+        final_conf = float(obj_conf) * class_conf
+        if final_conf < CONF_THRESH:
+            continue
+
+        # Toạ độ chuẩn hoá (0..1) hoặc pixel (0..input_size)
+        if max(x, y, w, hh) <= 1.01:
+            x_px = x * input_size
+            y_px = y * input_size
+            w_px = w * input_size
+            h_px = hh * input_size
+        else:
+            x_px = x
+            y_px = y
+            w_px = w
+            h_px = hh
+
+        box_xywh = [x_px, y_px, w_px, h_px]
+        x1, y1, x2, y2 = scale_coords(box_xywh, r, pad, (h0, w0))
+        boxes.append([x1, y1, x2, y2])
+        scores.append(final_conf)
+        class_ids.append(class_id)
+    return boxes, scores, class_ids
+
+def merge_detections(boxes, scores, class_ids, merge_ios=None):
+    """
+    NMS toàn cục. merge_ios: bỏ thêm box bị box điểm cao hơn phủ quá tỉ lệ diện tích này
+    (mảnh vật thể bị cắt ở mép ô khi chạy tiled - IoU thấp nên NMS không loại được)
+    """
+    indices = nms_boxes(boxes, scores, iou_threshold=NMS_THRESH)
+    if merge_ios is not None and len(indices) > 1:
+        indices = sorted(indices, key=lambda i: -scores[i])
+        kept = []
+        for i in indices:
+            x1, y1, x2, y2 = boxes[i]
+            area = max(1, (x2 - x1) * (y2 - y1))
+            covered = False
+            for j in kept:
+                ix = max(0, min(x2, boxes[j][2]) - max(x1, boxes[j][0]))
+                iy = max(0, min(y2, boxes[j][3]) - max(y1, boxes[j][1]))
+                if ix * iy / area > merge_ios:
+                    covered = True
+                    break
+            if not covered:
+                kept.append(i)
+        indices = kept
+    return [boxes[i] for i in indices], [scores[i] for i in indices], [class_ids[i] for i in indices]
+
+def draw_detections(frame, boxes, scores, class_ids):
+    """Vẽ box đã qua NMS. Trả về (frame, số cây, số cây bệnh, số cây bình thường)"""
+    # Đếm số lượng từng loại
+    disease_count = 0
+    healthy_count = 0
+
+    for (x1, y1, x2, y2), conf, cls in zip(boxes, scores, class_ids):
+        # Đếm số lượng
+        if cls == 0:
+            disease_count += 1
+        else:
+            healthy_count += 1
+
+        # Màu sắc: Đỏ nếu bệnh (class 0), Xanh lá nếu bình thường (class 1)
+        if cls == 0:
+            color = (0, 0, 255)  # Đỏ - Bệnh
+            display_label = f"BENH {conf:.2f}"
+        else:
+            color = (0, 255, 0)  # Xanh lá - Bình thường
+            display_label = f"BINH THUONG {conf:.2f}"
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+        txt = display_label
+        t_size = cv2.getTextSize(txt, 0, fontScale=0.7, thickness=2)[0]
+        cv2.rectangle(frame, (x1, y1 - 25), (x1 + t_size[0] + 10, y1), color, -1)
+        cv2.putText(frame, txt, (x1 + 5, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2, cv2.LINE_AA)
+
+    return frame, len(boxes), disease_count, healthy_count
+
+# ===================== TILES =====================
+def tile_starts(length, tile, overlap):
+    """Vị trí bắt đầu các ô phủ kín đoạn [0, length), ô cuối sát mép"""
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+def make_tiles(shape, roi=None, tile=INPUT_SIZE, overlap=TILE_OVERLAP):
+    """
+    Các ô (x1, y1, x2, y2) kích thước tile, chồng lấn overlap pixel.
+    roi: (y_min, y_max) tỉ lệ chiều cao - chỉ cắt ô trong dải này
+    """
+    h, w = shape[:2]
+    y_lo, y_hi = 0, h
+    if roi is not None:
+        y_lo = int(h * roi[0])
+        y_hi = max(y_lo + 1, int(h * roi[1]))
+    tiles = []
+    for y in tile_starts(y_hi - y_lo, tile, overlap):
+        for x in tile_starts(w, tile, overlap):
+            tiles.append((x, y_lo + y, min(w, x + tile), min(y_hi, y_lo + y + tile)))
+    return tiles
+
+
+# Global instance (benchmark chọn backend chạy 1 lần cho mọi Detector trong process)
+backend_selector = BackendSelector(BACKEND_CACHE)
+
+
+class Detector:
+    """
+    1 model trên 1 backend inference. Backend không thread-safe nên mỗi luồng inference
+    (mỗi camera, mỗi worker batch) dùng 1 Detector riêng.
+    """
+    def __init__(self, backend=INFERENCE_BACKEND, num_threads=NUM_THREADS, input_size=INPUT_SIZE):
+        self.backend_name = backend
+        self.num_threads = num_threads
+        self.input_size = input_size
+        self.backend = None
+
+    @property
+    def name(self):
+        return self.backend.name if self.backend is not None else None
+
+    def load(self):
+        """Load backend ("auto" = backend nhanh nhất theo benchmark chung, có cache)"""
+        name = self.backend_name
+        if name == BACKEND_AUTO:
+            name = backend_selector.select(AUTO_BACKENDS, MODEL_PATH, ONNX_MODEL_PATH, NUM_THREADS,
+                                           self.input_size, BENCH_SAMPLES_DIR, BENCH_RUNS, TFLITE_XNNPACK)
+        backend = create_backend(name, MODEL_PATH, ONNX_MODEL_PATH, self.num_threads, self.input_size,
+                                 TFLITE_XNNPACK)
+        if backend is None:
+            path = MODEL_PATH if name == "tflite" else ONNX_MODEL_PATH
+            raise RuntimeError(f"Model file not found: {path}")
+        print(f"Loading model with {name} backend: {backend.model_path}")
+        self.backend = backend.load()
+        return self
+
+    def warmup(self):
+        """Lần chạy đầu tiên chậm hơn nhiều (cấp phát, chọn kernel). Trả về thời gian (giây)"""
+        warmup_time = self.backend.warmup()
+        print(f"Model loaded successfully (warmup {warmup_time * 1000:.0f}ms).")
+        return warmup_time
+
+    def preprocess(self, img_bgr):
+        """Letterbox -> tensor NHWC float32 0-1. Trả về (tensor, r, pad)"""
+        img_padded, r, pad = letterbox(img_bgr, (self.input_size, self.input_size))
+        return np.expand_dims(img_padded.astype(np.float32) / 255.0, 0), r, pad
+
+    def infer(self, tensor):
+        """Output thô của model [N, 5 + số class]"""
+        return self.backend.run(tensor)
+
+    def decode(self, output, r, pad, orig_shape, merge_ios=None):
+        """Output thô -> detection đã NMS theo toạ độ ảnh gốc"""
+        return merge_detections(*decode_output(output, r, pad, orig_shape, self.input_size),
+                                merge_ios=merge_ios)
+
+    def draw(self, frame, detections):
+        """Vẽ detection lên frame. Trả về (frame, số cây, số cây bệnh, số cây bình thường)"""
+        return draw_detections(frame, *detections)
+
+    def detect(self, img_bgr):
+        """Detection cả khung hình. Trả về (detections, số ô = 1, thời gian)"""
+        start_time = time.time()
+        tensor, r, pad = self.preprocess(img_bgr)
+        detections = self.decode(self.infer(tensor), r, pad, img_bgr.shape)
+        return detections, 1, time.time() - start_time
+
+    def detect_tiled(self, img_bgr, roi=None, scale=TILE_SCALE):
+        """
+        Inference trên từng ô ở độ phân giải gốc (không thu cả khung về input_size) rồi gộp box
+        qua mép ô bằng NMS toàn cục. Các ô chạy lần lượt (mỗi lần chạy backend đã dùng
+        num_threads lõi). Trả về (detections theo ảnh gốc, số ô, thời gian)
+        """
+        start_time = time.time()
+        img = img_bgr
+        if scale != 1.0:
+            img = cv2.resize(img_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        boxes, scores, class_ids = [], [], []
+        tiles = make_tiles(img.shape, roi, self.input_size)
+        for x1, y1, x2, y2 in tiles:
+            crop = img[y1:y2, x1:x2]
+            tensor, r, pad = self.preprocess(crop)
+            tile_boxes, tile_scores, tile_classes = decode_output(self.infer(tensor), r, pad, crop.shape,
+                                                                  self.input_size)
+            for bx1, by1, bx2, by2 in tile_boxes:
+                boxes.append([int((bx1 + x1) / scale), int((by1 + y1) / scale),
+                              int((bx2 + x1) / scale), int((by2 + y1) / scale)])
+            scores += tile_scores
+            class_ids += tile_classes
+        detections = merge_detections(boxes, scores, class_ids, merge_ios=TILE_MERGE_IOS)
+        return detections, len(tiles), time.time() - start_time
+
+    def run(self, img_bgr, mode="full"):
+        """Detection theo chế độ "full", "tiled" hoặc "roi". Trả về (detections, số ô, thời gian)"""
+        if mode == "full":
+            return self.detect(img_bgr)
+        if mode not in DETECT_MODES:
+            raise ValueError(f"Unknown detection mode: {mode}")
+        return self.detect_tiled(img_bgr, TILE_ROI if mode == "roi" else None)
+
+    def info(self):
+        return self.backend.info() if self.backend is not None else {"backend": self.backend_name}
+
+
+def load_detector(backend=INFERENCE_BACKEND, num_threads=NUM_THREADS):
+    """Tạo + load + warmup 1 Detector (dùng làm hàm khởi tạo subsystem)"""
+    detector = Detector(backend, num_threads).load()
+    detector.warmup()
+    return detector
@@ -0,0 +1,268 @@
+"""
+Bộ parse GPS dạng streaming với decoder cắm thêm được:
+- CsvDecoder: "yaw,lat,lon,speed" từ ESP32 (định dạng cũ)
+- NmeaDecoder: $xxGGA / $xxRMC / $xxVTG, kiểm tra checksum
+- UbxDecoder: UBX NAV-PVT nhị phân (u-blox)
+
+StreamParser nhận bytes từ các lần đọc lớn (ser.read(ser.in_waiting)),
+tự cắt khung và trả về danh sách dict để SerialData.update().
+"""
+import struct
+import time
+
+UBX_SYNC = b"\xb5\x62"
+UBX_NAV_PVT = (0x01, 0x07)
+KNOTS_TO_MS = 0.514444
+KMH_TO_MS = 1.0 / 3.6
+MAX_LINE_LEN = 256
+
+
+def nmea_checksum_ok(sentence):
+    """Kiểm tra checksum NMEA: XOR các byte giữa '$' và '*'"""
+    star = sentence.rfind(b"*")
+    if star < 0 or star + 3 > len(sentence):
+        return False
+    checksum = 0
+    for b in sentence[1:star]:
+        checksum ^= b
+    try:
+        return checksum == int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
+
+def nmea_to_degrees(value, hemisphere):
+    """ddmm.mmmm + N/S/E/W -> độ thập phân"""
+    if not value:
+        return None
+    raw = float(value)
+    degrees = int(raw / 100)
+    result = degrees + (raw - degrees * 100) / 60.0
+    if hemisphere in ("S", "W"):
+        result = -result
+    return result
+
+
+def add_position(data, lat, lon):
+    """Chỉ thêm tọa độ khi cả lat và lon đều đọc được (trường rỗng -> giữ vị trí cũ)"""
+    if lat is not None and lon is not None:
+        data["lat"] = lat
+        data["lon"] = lon
+
+
+def nmea_time_to_seconds(value):
+    """hhmmss.ss -> giây trong ngày UTC"""
+    if len(value) < 6:
+        return None
+    return int(value[0:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:])
+
+
+class CsvDecoder:
+    """Định dạng ESP32: yaw,lat,lon[,speed]"""
+    name = "csv"
+
+    def decode(self, line):
+        parts = line.split(b",")
+        if len(parts) < 3:
+            return None
+        yaw = float(parts[0])
+        lat = float(parts[1])
+        lon = float(parts[2])
+        data = {"yaw": yaw}
+        # Nếu lat/lon đều 0 thì bỏ qua (giữ tọa độ cũ)
+        if not (lat == 0.0 and lon == 0.0):
+            data["lat"] = lat
+            data["lon"] = lon
+        if len(parts) >= 4 and parts[3].strip():
+            data["speed"] = float(parts[3])
+        return data
+
+
+class NmeaDecoder:
+    """NMEA 0183: GGA (vị trí, fix, HDOP), RMC (vị trí, tốc độ, hướng), VTG (tốc độ)"""
+    name = "nmea"
+
+    def decode(self, line):
+        if not nmea_checksum_ok(line):
+            raise ValueError("bad NMEA checksum")
+        fields = line[1:line.rfind(b"*")].decode("ascii").split(",")
+        kind = fields[0][2:]
+        if kind == "GGA":
+            return self._gga(fields)
+        if kind == "RMC":
+            return self._rmc(fields)
+        if kind == "VTG":
+            return self._vtg(fields)
+        return None
+
+    def _gga(self, f):
+        fix_quality = int(f[6]) if f[6] else 0
+        data = {"fix_quality": fix_quality, "satellites": int(f[7]) if f[7] else 0}
+        if f[8]:
+            data["hdop"] = float(f[8])
+        if f[1]:
+            data["gps_time"] = nmea_time_to_seconds(f[1])
+        if fix_quality > 0:
+            add_position(data, nmea_to_degrees(f[2], f[3]), nmea_to_degrees(f[4], f[5]))
+        return data
+
+    def _rmc(self, f):
+        data = {}
+        if f[1]:
+            data["gps_time"] = nmea_time_to_seconds(f[1])
+        if f[2] != "A":
+            # Fix không hợp lệ: chỉ cập nhật thời gian
+            data["fix_quality"] = 0
+            return data
+        add_position(data, nmea_to_degrees(f[3], f[4]), nmea_to_degrees(f[5], f[6]))
+        if f[7]:
+            data["speed"] = float(f[7]) * KNOTS_TO_MS
+        if f[8]:
+            data["course"] = float(f[8])
+        return data
+
+    def _vtg(self, f):
+        data = {}
+        if f[1]:
+            data["course"] = float(f[1])
+        if len(f) > 7 and f[7]:
+            data["speed"] = float(f[7]) * KMH_TO_MS
+        return data
+
+
+class UbxDecoder:
+    """UBX NAV-PVT (92 byte payload)"""
+    name = "ubx"
+    # iTOW, year, month, day, hour, min, sec, valid, tAcc, nano, fixType, flags,
+    # flags2, numSV, lon, lat, height, hMSL, hAcc, vAcc, velN, velE, velD,
+    # gSpeed, headMot, sAcc, headAcc, pDOP
+    PVT_FORMAT = struct.Struct("<IHBBBBBBIiBBBBiiiiIIiiiiiIIH")
+
+    def decode_frame(self, cls, msg_id, payload):
+        if (cls, msg_id) != UBX_NAV_PVT or len(payload) < self.PVT_FORMAT.size:
+            return None
+        (itow, _year, _month, _day, hour, minute, sec, _valid, _tacc, nano, fix_type, flags,
+         _flags2, num_sv, lon, lat, _height, _hmsl, hacc, _vacc, _veln, _vele, _veld,
+         gspeed, head_mot, _sacc, _headacc, pdop) = self.PVT_FORMAT.unpack_from(payload)
+        gnss_fix_ok = bool(flags & 0x01)
+        data = {
+            "fix_quality": fix_type if gnss_fix_ok else 0,
+            "satellites": num_sv,
+            "hdop": pdop * 0.01,  # NAV-PVT chỉ có pDOP
+            "h_acc": hacc / 1000.0,
+            "gps_time": hour * 3600 + minute * 60 + sec + nano * 1e-9,
+            "speed": gspeed / 1000.0,
+            "course": head_mot * 1e-5,
+        }
+        if gnss_fix_ok and fix_type >= 2:
+            data["lat"] = lat * 1e-7
+            data["lon"] = lon * 1e-7
+        return data
+
+
+def ubx_checksum(body):
+    """Fletcher-8 trên class..payload"""
+    ck_a = ck_b = 0
+    for b in body:
+        ck_a = (ck_a + b) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+class StreamParser:
+    """
+    Cắt khung từ luồng byte hỗn hợp (dòng text + UBX nhị phân) và gọi decoder.
+    Thống kê: số message, lỗi, thời gian parse trung bình mỗi message.
+    """
+    def __init__(self, decoders=("csv", "nmea", "ubx")):
+        self.buffer = bytearray()
+        self.csv = CsvDecoder() if "csv" in decoders else None
+        self.nmea = NmeaDecoder() if "nmea" in decoders else None
+        self.ubx = UbxDecoder() if "ubx" in decoders else None
+        self.messages = {}
+        self.errors = 0
+        self.parse_time = 0.0
+
+    def _count(self, name, elapsed):
+        self.messages[name] = self.messages.get(name, 0) + 1
+        self.parse_time += elapsed
+
+    def feed(self, chunk):
+        """Thêm bytes, trả về danh sách dict đã decode"""
+        self.buffer += chunk
+        results = []
+        buf = self.buffer
+        pos = 0
+        n = len(buf)
+        while pos < n:
+            # Khung UBX nhị phân
+            if self.ubx is not None and buf[pos] == 0xB5:
+                if n - pos < 2:
+                    break
+                if buf[pos + 1] == 0x62:
+                    if n - pos < 8:
+                        break
+                    length = buf[pos + 4] | (buf[pos + 5] << 8)
+                    end = pos + 6 + length + 2
+                    if end > n:
+                        break
+                    t0 = time.perf_counter()
+                    body = bytes(buf[pos + 2:pos + 6 + length])
+                    if ubx_checksum(body) == (buf[end - 2], buf[end - 1]):
+                        data = self.ubx.decode_frame(body[0], body[1], body[4:])
+                        if data:
+                            results.append(data)
+                            self._count("ubx", time.perf_counter() - t0)
+                        pos = end
+                    else:
+                        self.errors += 1
+                        pos += 1
+                    continue
+            # Dòng text (CSV / NMEA)
+            nl = buf.find(b"\n", pos)
+            end = nl if nl >= 0 else n
+            sync = buf.find(UBX_SYNC, pos, end) if self.ubx is not None else -1
+            if sync > pos:
+                # Khung UBX xen vào giữa: phần text trước đó coi như 1 dòng
+                line = bytes(buf[pos:sync]).strip()
+                pos = sync
+            elif nl >= 0:
+                line = bytes(buf[pos:nl]).strip()
+                pos = nl + 1
+            else:
+                # Chưa có xuống dòng: giữ lại, nhưng chống buffer rác quá dài
+                if n - pos > MAX_LINE_LEN:
+                    self.errors += 1
+                    pos = n
+                break
+            if line:
+                self._decode_line(line, results)
+        del buf[:pos]
+        return results
+
+    def _decode_line(self, line, results):
+        t0 = time.perf_counter()
+        try:
+            if line[:1] == b"$":
+                if self.nmea is None:
+                    return
+                name, data = "nmea", self.nmea.decode(line)
+            elif self.csv is not None:
+                name, data = "csv", self.csv.decode(line)
+            else:
+                return
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            self.errors += 1
+            print(f"[Serial] Parsing error: {e} -> {line[:80]!r}")
+            return
+        if data:
+            results.append(data)
+            self._count(name, time.perf_counter() - t0)
+
+    def stats(self):
+        total = sum(self.messages.values())
+        return {
+            "messages": dict(self.messages),
+            "errors": self.errors,
+            "avg_parse_us": round(self.parse_time / total * 1e6, 1) if total else 0.0
+        }
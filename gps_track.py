@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import TRACK_CAPACITY, TRACK_DIR, TRACK_SPILL_INTERVAL_SEC
+
+# Các cột lưu trữ (mỗi cột 1 file float64 trên đĩa)
+TRACK_COLUMNS = ("t", "lat", "lon", "yaw", "speed")
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: chọn n_out chỉ số giữ hình dạng đường đi"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        # Điểm trung bình của bucket kế tiếp
+        next_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        # Diện tích tam giác (a, điểm ứng viên, trung bình bucket sau)
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def douglas_peucker(x, y, epsilon):
+    """Douglas-Peucker (không đệ quy): giữ các điểm lệch > epsilon khỏi đoạn thẳng"""
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        norm = np.hypot(dx, dy)
+        if norm == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(dx * py - dy * px) / norm
+        idx = int(np.argmax(dist))
+        if dist[idx] > epsilon:
+            mid = first + 1 + idx
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return np.nonzero(keep)[0]
+
+
+def douglas_peucker_budget(x, y, n_out, iterations=20):
+    """Tìm epsilon (bằng chia đôi) sao cho số điểm giữ lại <= n_out"""
+    if len(x) <= n_out:
+        return np.arange(len(x))
+    lo, hi = 0.0, float(max(np.ptp(x), np.ptp(y)))
+    best = np.array([0, len(x) - 1])
+    for _ in range(iterations):
+        eps = (lo + hi) / 2
+        idx = douglas_peucker(x, y, eps)
+        if len(idx) > n_out:
+            lo = eps
+        else:
+            best = idx
+            hi = eps
+    return best
+
+
+class TrackHistory:
+    """
+    Lịch sử vị trí GPS:
+    - Ring buffer numpy cấp phát sẵn trong RAM (TRACK_CAPACITY điểm)
+    - Định kỳ ghi nối các điểm mới ra file cột trên đĩa (TRACK_DIR/<cột>.f64) trong thread
+      track_spill riêng: append() chạy trong event loop serial nên không được chờ I/O đĩa
+    - query() trả về đoạn đường giữa 2 thời điểm, đã giảm mẫu theo số điểm yêu cầu
+    """
+    def __init__(self, capacity=TRACK_CAPACITY, directory=TRACK_DIR,
+                 spill_interval=TRACK_SPILL_INTERVAL_SEC):
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()   # 1 lần ghi đĩa tại một thời điểm
+        self.capacity = capacity
+        self.directory = directory
+        self.spill_interval = spill_interval
+        self.columns = {name: np.zeros(capacity, dtype=np.float64) for name in TRACK_COLUMNS}
+        self.count = 0        # Tổng số điểm đã ghi vào ring
+        self.spilled = 0      # Số điểm (tính từ đầu) đã ghi ra đĩa
+        self.last_spill = time.time()
+        self.spill_event = threading.Event()
+        self.spill_thread = None
+
+    def append(self, t, lat, lon, yaw=0.0, speed=0.0):
+        """Thêm 1 fix (gọi từ callback GPS trong event loop serial - không chặn)"""
+        with self.lock:
+            i = self.count % self.capacity
+            self.columns["t"][i] = t
+            self.columns["lat"][i] = lat
+            self.columns["lon"][i] = lon
+            self.columns["yaw"][i] = yaw
+            self.columns["speed"][i] = speed
+            self.count += 1
+            now = time.time()
+            if self.directory and now - self.last_spill >= self.spill_interval:
+                self.last_spill = now
+                if self.spill_thread is None:
+                    self.spill_thread = threading.Thread(target=self._spill_loop, name="track_spill",
+                                                         daemon=True)
+                    self.spill_thread.start()
+                self.spill_event.set()
+
+    def _spill_loop(self):
+        """Thread track_spill: ghi đĩa mỗi khi append() báo đến hạn"""
+        while True:
+            self.spill_event.wait()
+            self.spill_event.clear()
+            self.spill()
+
+    def _ring_slice(self, start, stop):
+        """Lấy các điểm [start, stop) (chỉ số tuyệt đối) từ ring - gọi khi giữ lock"""
+        idx = np.arange(start, stop) % self.capacity
+        return {name: col[idx] for name, col in self.columns.items()}
+
+    def spill(self):
+        """
+        Ghi nối các điểm chưa lưu ra file cột trên đĩa. spilled chỉ tăng khi mọi cột đã ghi
+        xong; ghi lỗi giữa chừng thì cắt các file về kích thước cũ để các cột không lệch nhau
+        """
+        with self.spill_lock:
+            with self.lock:
+                # Điểm cũ hơn capacity đã bị ghi đè trước khi kịp lưu
+                start = max(self.spilled, self.count - self.capacity)
+                stop = self.count
+                chunk = self._ring_slice(start, stop)
+                self.last_spill = time.time()
+            if stop == start:
+                return 0
+            sizes = {}
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                for name, values in chunk.items():
+                    path = os.path.join(self.directory, f"{name}.f64")
+                    sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+                    with open(path, "ab") as f:
+                        f.write(values.tobytes())
+            except Exception as e:
+                print(f"[Track] Spill error: {e}")
+                for path, size in sizes.items():
+                    try:
+                        with open(path, "r+b") as f:
+                            f.truncate(size)
+                    except OSError as e2:
+                        print(f"[Track] Spill rollback error ({path}): {e2}")
+                return 0
+            with self.lock:
+                self.spilled = stop
+            return stop - start
+
+    def _load_disk(self, t_start, t_end):
+        """Đọc đoạn thời gian từ file trên đĩa (memmap, chỉ đọc phần cần)"""
+        t_path = os.path.join(self.directory, "t.f64") if self.directory else None
+        if not t_path or not os.path.exists(t_path) or os.path.getsize(t_path) == 0:
+            return None
+        t_disk = np.memmap(t_path, dtype=np.float64, mode="r")
+        # Các cột có thể lệch độ dài nếu đang ghi dở -> lấy độ dài nhỏ nhất
+        n = min(os.path.getsize(os.path.join(self.directory, f"{name}.f64")) // 8
+                for name in TRACK_COLUMNS)
+        t_disk = t_disk[:n]
+        lo = int(np.searchsorted(t_disk, t_start, side="left"))
+        hi = int(np.searchsorted(t_disk, t_end, side="right"))
+        if hi <= lo:
+            return None
+        result = {"t": np.array(t_disk[lo:hi])}
+        for name in TRACK_COLUMNS[1:]:
+            col = np.memmap(os.path.join(self.directory, f"{name}.f64"), dtype=np.float64, mode="r")
+            result[name] = np.array(col[lo:hi])
+        return result
+
+    def query(self, t_start, t_end, max_points=1000, method="lttb"):
+        """Đường đi giữa t_start và t_end, giảm mẫu còn tối đa max_points"""
+        with self.lock:
+            mem_start = max(self.spilled, self.count - self.capacity)
+            mem = self._ring_slice(mem_start, self.count)
+            first_mem_t = mem["t"][0] if len(mem["t"]) else np.inf
+        parts = []
+        disk = self._load_disk(t_start, min(t_end, first_mem_t))
+        if disk is not None:
+            # Bỏ phần trùng với RAM
+            mask = disk["t"] < first_mem_t
+            parts.append({k: v[mask] for k, v in disk.items()})
+        mask = (mem["t"] >= t_start) & (mem["t"] <= t_end)
+        parts.append({k: v[mask] for k, v in mem.items()})
+        data = {name: np.concatenate([p[name] for p in parts]) for name in TRACK_COLUMNS}
+
+        total = len(data["t"])
+        if total > max_points:
+            # Giảm mẫu theo không gian (lat/lon) để giữ hình dạng đường đi
+            if method == "dp":
+                idx = douglas_peucker_budget(data["lon"], data["lat"], max_points)
+            else:
+                idx = lttb(data["lon"], data["lat"], max_points)
+            data = {k: v[idx] for k, v in data.items()}
+        return data, total
+
+    def stats(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "in_memory": min(self.count, self.capacity),
+                "spilled": self.spilled,
+                "capacity": self.capacity
+            }
+
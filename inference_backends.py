@@ -0,0 +1,349 @@
+"""
+Backend inference cho model YOLO, dùng chung 1 giao diện:
+- "tflite":      TFLite (tflite_runtime hoặc tensorflow) với delegate XNNPACK
+- "onnxruntime": ONNX Runtime, CPUExecutionProvider
+- "opencv":      OpenCV DNN (đọc file .onnx, không cần cài thêm gì ngoài cv2)
+
+Tất cả chạy trên CPU x86/ARM thường, không cần phần cứng đặc biệt. Backend nhận tensor đã
+letterbox NHWC float32 (0-1, batch 1) và trả về output thô [N, 5 + số class], nên phần
+tiền/hậu xử lý không cần biết backend nào đang chạy.
+
+Chọn backend "auto": benchmark các backend có sẵn trên tập ảnh mẫu, lấy backend có thời gian
+inference trung vị nhỏ nhất trên CPU hiện tại. Kết quả được lưu vào file cache (theo máy và
+file model) để các lần khởi động sau không phải benchmark lại.
+"""
+import glob
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+BACKEND_AUTO = "auto"
+BACKEND_NAMES = ("tflite", "onnxruntime", "opencv")
+
+
+def import_tflite():
+    """Try import TFLite runtime, fallback to TensorFlow if not available"""
+    try:
+        import tflite_runtime.interpreter as tflite
+        print("[INFO] Using tflite_runtime")
+        return tflite
+    except ImportError:
+        try:
+            import tensorflow as tf
+            print("[INFO] Using TensorFlow Lite from tensorflow package")
+            return tf.lite
+        except ImportError:
+            return None
+
+
+def import_onnxruntime():
+    try:
+        import onnxruntime
+        return onnxruntime
+    except ImportError:
+        return None
+
+
+def import_cv2():
+    try:
+        import cv2
+        return cv2
+    except ImportError:
+        return None
+
+
+class InferenceBackend:
+    """
+    Giao diện chung: load() -> warmup() -> run(tensor).
+    tensor: np.float32 [1, H, W, 3] giá trị 0-1 (NHWC); run() trả về output [N, 5 + số class]
+    """
+    name = None
+
+    def __init__(self, model_path, num_threads):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.input_size = None  # (cao, rộng) của input model
+
+    def load(self):
+        raise NotImplementedError
+
+    def run(self, tensor):
+        raise NotImplementedError
+
+    def warmup(self, runs=1):
+        """Lần chạy đầu chậm hơn nhiều (cấp phát, chọn kernel). Trả về thời gian (giây)"""
+        start = time.time()
+        dummy = np.zeros((1, self.input_size[0], self.input_size[1], 3), dtype=np.float32)
+        for _ in range(runs):
+            self.run(dummy)
+        return time.time() - start
+
+    def info(self):
+        return {"backend": self.name, "model": self.model_path, "threads": self.num_threads,
+                "input_size": list(self.input_size) if self.input_size else None}
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    TFLite Interpreter. XNNPACK là delegate mặc định của TFLite >= 2.3 cho model float
+    (op resolver BUILTIN); xnnpack=False dùng kernel tham chiếu (BUILTIN_WITHOUT_DEFAULT_DELEGATES).
+    """
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads, xnnpack=True):
+        super().__init__(model_path, num_threads)
+        self.xnnpack = xnnpack
+        self.interpreter = None
+        self.input_details = None
+        self.output_details = None
+
+    def load(self):
+        tflite = import_tflite()
+        if tflite is None:
+            raise RuntimeError("TFLite not available")
+        kwargs = {"model_path": self.model_path, "num_threads": self.num_threads}
+        # tflite_runtime: interpreter.OpResolverType; tensorflow: tf.lite.experimental.OpResolverType
+        resolver = getattr(tflite, "OpResolverType", None)
+        if resolver is None:
+            resolver = getattr(getattr(tflite, "experimental", None), "OpResolverType", None)
+        if resolver is not None:
+            kwargs["experimental_op_resolver_type"] = (
+                resolver.BUILTIN if self.xnnpack else resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        self.interpreter = tflite.Interpreter(**kwargs)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        shape = self.input_details[0]['shape']
+        self.input_size = (int(shape[1]), int(shape[2]))
+        return self
+
+    def run(self, tensor):
+        detail = self.input_details[0]
+        self.interpreter.set_tensor(detail['index'], tensor.astype(detail['dtype'], copy=False))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_details[0]['index'])[0]
+
+    def info(self):
+        return {**super().info(), "xnnpack": self.xnnpack}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime trên CPU; model export NCHW (mặc định của YOLOv5) được transpose tự động"""
+    name = "onnxruntime"
+
+    def __init__(self, model_path, num_threads):
+        super().__init__(model_path, num_threads)
+        self.session = None
+        self.input_name = None
+        self.nchw = True
+
+    def load(self):
+        ort = import_onnxruntime()
+        if ort is None:
+            raise RuntimeError("onnxruntime not available")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        shape = model_input.shape
+        self.nchw = shape[1] == 3
+        h, w = (shape[2], shape[3]) if self.nchw else (shape[1], shape[2])
+        if not isinstance(h, int) or not isinstance(w, int):
+            raise RuntimeError(f"Dynamic input shape not supported: {shape}")
+        self.input_size = (h, w)
+        return self
+
+    def run(self, tensor):
+        if self.nchw:
+            tensor = tensor.transpose(0, 3, 1, 2)
+        tensor = np.ascontiguousarray(tensor, dtype=np.float32)
+        return self.session.run(None, {self.input_name: tensor})[0][0]
+
+
+class OpenCVDnnBackend(InferenceBackend):
+    """OpenCV DNN (backend OpenCV, target CPU) đọc cùng file .onnx; input NCHW cố định input_size"""
+    name = "opencv"
+
+    def __init__(self, model_path, num_threads, input_size):
+        super().__init__(model_path, num_threads)
+        self.input_size = input_size
+        self.net = None
+
+    def load(self):
+        cv2 = import_cv2()
+        if cv2 is None:
+            raise RuntimeError("OpenCV not available")
+        cv2.setNumThreads(self.num_threads)
+        self.net = cv2.dnn.readNetFromONNX(self.model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return self
+
+    def run(self, tensor):
+        blob = np.ascontiguousarray(tensor.transpose(0, 3, 1, 2), dtype=np.float32)
+        self.net.setInput(blob)
+        return self.net.forward()[0]
+
+
+def create_backend(name, tflite_path, onnx_path, num_threads, input_size, xnnpack=True):
+    """Tạo backend theo tên (chưa load). Trả về None nếu không có file model tương ứng"""
+    if name == "tflite":
+        path = tflite_path
+    elif name in ("onnxruntime", "opencv"):
+        path = onnx_path
+    else:
+        raise ValueError(f"Unknown inference backend: {name}")
+    if not path or not os.path.exists(path):
+        return None
+    if name == "tflite":
+        return TFLiteBackend(path, num_threads, xnnpack)
+    if name == "onnxruntime":
+        return OnnxRuntimeBackend(path, num_threads)
+    return OpenCVDnnBackend(path, num_threads, (input_size, input_size))
+
+
+def load_samples(directory, input_size, limit=8):
+    """
+    Tensor mẫu cho benchmark từ ảnh trong directory (resize về input_size);
+    không có ảnh thì dùng nhiễu ngẫu nhiên (thời gian inference không phụ thuộc nội dung ảnh)
+    """
+    cv2 = import_cv2()
+    samples = []
+    if directory and cv2 is not None and os.path.isdir(directory):
+        paths = sorted(p for p in glob.glob(os.path.join(directory, "*"))
+                       if p.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+        for path in paths[:limit]:
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            img = cv2.resize(img, (input_size, input_size), interpolation=cv2.INTER_LINEAR)
+            samples.append(np.expand_dims(img.astype(np.float32) / 255.0, 0))
+    if not samples:
+        rng = np.random.default_rng(0)
+        samples = [rng.random((1, input_size, input_size, 3), dtype=np.float32) for _ in range(2)]
+    return samples
+
+
+def benchmark_backend(backend, samples, runs):
+    """Thời gian inference (ms) của backend đã load: min, trung vị, trung bình sau warmup"""
+    backend.warmup()
+    times = []
+    for i in range(runs):
+        sample = samples[i % len(samples)]
+        start = time.perf_counter()
+        backend.run(sample)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"min_ms": round(times[0], 2), "median_ms": round(times[len(times) // 2], 2),
+            "mean_ms": round(sum(times) / len(times), 2), "runs": runs}
+
+
+def benchmark_backends(names, tflite_path, onnx_path, num_threads, input_size,
+                       samples_dir=None, runs=10, xnnpack=True):
+    """
+    Load và benchmark lần lượt các backend. Trả về {tên: kết quả} - backend không dùng được
+    có "error" thay cho thời gian
+    """
+    samples = load_samples(samples_dir, input_size)
+    results = {}
+    for name in names:
+        try:
+            backend = create_backend(name, tflite_path, onnx_path, num_threads, input_size, xnnpack)
+            if backend is None:
+                results[name] = {"error": "model file not found"}
+                continue
+            backend.load()
+            results[name] = benchmark_backend(backend, samples, runs)
+            print(f"[Backend] {name}: median {results[name]['median_ms']:.1f}ms")
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            print(f"[Backend] {name} unavailable: {e}")
+    return results
+
+
+def fastest(results):
+    """Tên backend có thời gian trung vị nhỏ nhất, None nếu không backend nào chạy được"""
+    timed = [(r["median_ms"], name) for name, r in results.items() if "median_ms" in r]
+    return min(timed)[1] if timed else None
+
+
+def cache_key(tflite_path, onnx_path, num_threads):
+    """Khoá cache: máy + số thread + file model (đổi model/phần cứng thì benchmark lại)"""
+    models = []
+    for path in (tflite_path, onnx_path):
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            models.append(f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}")
+    return "|".join([platform.machine(), platform.processor(), str(os.cpu_count()),
+                     str(num_threads)] + models)
+
+
+class BackendSelector:
+    """
+    Chọn backend cho cấu hình "auto" đúng 1 lần mỗi process (nhiều camera load model cùng lúc
+    thì chỉ 1 thread benchmark, các thread khác chờ kết quả), có cache trên đĩa
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.choice = None
+        self.results = {}
+        self.benchmarked_at = None
+
+    def _read_cache(self, key):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached if cached.get("key") == key else None
+
+    def _write_cache(self, key):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "choice": self.choice, "results": self.results,
+                           "benchmarked_at": self.benchmarked_at}, f, indent=2)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"[Backend] Cannot write cache {self.cache_path}: {e}")
+
+    def select(self, names, tflite_path, onnx_path, num_threads, input_size,
+               samples_dir=None, runs=10, xnnpack=True, force=False):
+        """Tên backend nhanh nhất (đọc cache nếu khớp máy/model, force=True để benchmark lại)"""
+        with self.lock:
+            key = cache_key(tflite_path, onnx_path, num_threads)
+            if self.choice is not None and not force:
+                return self.choice
+            cached = None if force else self._read_cache(key)
+            if cached is not None and cached.get("choice"):
+                self.choice = cached["choice"]
+                self.results = cached.get("results", {})
+                self.benchmarked_at = cached.get("benchmarked_at")
+                print(f"[Backend] Using cached choice: {self.choice}")
+                return self.choice
+            print(f"[Backend] Benchmarking {', '.join(names)} ({runs} runs)...")
+            self.results = benchmark_backends(names, tflite_path, onnx_path, num_threads, input_size,
+                                              samples_dir, runs, xnnpack)
+            self.choice = fastest(self.results)
+            if self.choice is None:
+                raise RuntimeError("No inference backend available")
+            self.benchmarked_at = time.time()
+            self._write_cache(key)
+            print(f"[Backend] Selected {self.choice}")
+            return self.choice
+
+    def status(self):
+        return {"choice": self.choice, "results": self.results, "benchmarked_at": self.benchmarked_at}
@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+
+from config import (LIDAR_MEDIAN_FRAMES, LIDAR_HYSTERESIS_ON, LIDAR_HYSTERESIS_OFF,
+                    LIDAR_NEIGHBOR_BINS, LIDAR_NEIGHBOR_MIN, LIDAR_NEIGHBOR_TOL)
+from lidar_scan import ScanFrame
+
+
+class ScanFilter:
+    """
+    Lọc nhiễu cho scan frame (vector hóa trên mảng bin):
+    1. Bỏ điểm cô lập: bin phải có >= LIDAR_NEIGHBOR_MIN bin lân cận (±LIDAR_NEIGHBOR_BINS)
+       với khoảng cách chênh nhau không quá LIDAR_NEIGHBOR_TOL (tỉ lệ)
+    2. Median theo thời gian trên LIDAR_MEDIAN_FRAMES vòng gần nhất
+    3. Hysteresis: bin bật khi có dữ liệu trong >= LIDAR_HYSTERESIS_ON vòng,
+       chỉ tắt khi còn < LIDAR_HYSTERESIS_OFF vòng
+    """
+    def __init__(self, median_frames=LIDAR_MEDIAN_FRAMES, on_count=LIDAR_HYSTERESIS_ON,
+                 off_count=LIDAR_HYSTERESIS_OFF, neighbor_bins=LIDAR_NEIGHBOR_BINS,
+                 neighbor_min=LIDAR_NEIGHBOR_MIN, neighbor_tol=LIDAR_NEIGHBOR_TOL):
+        self.median_frames = median_frames
+        self.on_count = on_count
+        self.off_count = off_count
+        self.neighbor_bins = neighbor_bins
+        self.neighbor_min = neighbor_min
+        self.neighbor_tol = neighbor_tol
+        self.history = None
+        self.state = None
+        self.index = 0
+        self.frames = 0
+        self.removed_isolated = 0
+        self.process_time = 0.0
+
+    def remove_isolated(self, ranges):
+        """Bỏ các bin không có đủ bin lân cận ở khoảng cách tương tự (vòng tròn 360°)"""
+        valid = ranges > 0
+        neighbors = np.zeros(len(ranges), dtype=np.int32)
+        for k in range(1, self.neighbor_bins + 1):
+            for shift in (k, -k):
+                other = np.roll(ranges, shift)
+                close = np.abs(other - ranges) <= self.neighbor_tol * ranges
+                neighbors += (other > 0) & close
+        keep = valid & (neighbors >= self.neighbor_min)
+        self.removed_isolated += int(valid.sum() - keep.sum())
+        return np.where(keep, ranges, 0).astype(np.float32)
+
+    def temporal(self, ranges):
+        """Median theo thời gian + hysteresis có/không có dữ liệu của từng bin"""
+        if self.history is None or self.history.shape[1] != len(ranges):
+            self.history = np.zeros((self.median_frames, len(ranges)), dtype=np.float32)
+            self.state = np.zeros(len(ranges), dtype=bool)
+            self.index = 0
+        self.history[self.index % self.median_frames] = ranges
+        self.index += 1
+
+        present = self.history > 0
+        count = present.sum(axis=0)
+        # Median của các giá trị hợp lệ: đẩy bin trống (0) xuống cuối rồi lấy phần tử giữa
+        ordered = np.sort(np.where(present, self.history, np.inf), axis=0)
+        mid = np.maximum(count - 1, 0) // 2
+        median = np.take_along_axis(ordered, mid[None, :], axis=0)[0]
+
+        self.state = np.where(self.state, count >= self.off_count, count >= self.on_count)
+        return np.where(self.state, median, 0).astype(np.float32)
+
+    def process(self, frame):
+        """Trả về ScanFrame mới đã lọc (giữ seq, timestamp, period)"""
+        start = time.perf_counter()
+        ranges = self.remove_isolated(frame.ranges)
+        ranges = self.temporal(ranges)
+        self.frames += 1
+        self.process_time += time.perf_counter() - start
+        return ScanFrame(frame.seq, frame.timestamp, frame.period, frame.bin_deg,
+                         ranges, frame.count)
+
+    def reset(self):
+        self.history = None
+        self.state = None
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "removed_isolated": self.removed_isolated,
+            "avg_process_ms": round(self.process_time / self.frames * 1000, 3) if self.frames else 0.0
+        }
+
+
+class Debouncer:
+    """Chống dội cho trạng thái bool: bật sau on_sec liên tục, tắt sau off_sec liên tục"""
+    def __init__(self, on_sec, off_sec):
+        self.on_sec = on_sec
+        self.off_sec = off_sec
+        self.state = False
+        self.pending_since = None
+
+    def update(self, raw, now=None):
+        now = time.time() if now is None else now
+        if raw == self.state:
+            self.pending_since = None
+            return self.state
+        if self.pending_since is None:
+            self.pending_since = now
+        hold = self.on_sec if raw else self.off_sec
+        if now - self.pending_since >= hold:
+            self.state = raw
+            self.pending_since = None
+        return self.state
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import numpy as np
+
+from config import LIDAR_SCAN_BIN_DEG, LIDAR_WRAP_THRESHOLD_DEG
+
+
+class ScanFrame:
+    """1 vòng quét 360° đầy đủ, gom theo bin góc (giá trị = khoảng cách nhỏ nhất, 0 = không có)"""
+    __slots__ = ("seq", "timestamp", "period", "bin_deg", "ranges", "count")
+
+    def __init__(self, seq, timestamp, period, bin_deg, ranges, count):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.period = period
+        self.bin_deg = bin_deg
+        self.ranges = ranges
+        self.count = count
+
+    @property
+    def scan_rate(self):
+        return 1.0 / self.period if self.period > 0 else 0.0
+
+    def bin_angles(self):
+        """Góc giữa mỗi bin (độ)"""
+        return (np.arange(len(self.ranges)) + 0.5) * self.bin_deg
+
+    def points(self):
+        """(góc độ, khoảng cách mm) của các bin có dữ liệu, đã sắp xếp theo góc"""
+        valid = self.ranges > 0
+        return self.bin_angles()[valid], self.ranges[valid]
+
+    def to_dict(self):
+        return {
+            "seq": self.seq,
+            "timestamp": self.timestamp,
+            "scan_rate": round(self.scan_rate, 2),
+            "bin_deg": self.bin_deg,
+            "count": self.count,
+            "ranges": np.round(self.ranges).astype(np.int32).tolist()
+        }
+
+
+class ScanAssembler:
+    """
+    Ghép luồng điểm (góc, khoảng cách) thành từng vòng quét.
+    Phát hiện hết vòng khi góc giảm đột ngột (quay lại gần 0°), rồi phát
+    ScanFrame cho các callback đã đăng ký.
+    """
+    def __init__(self, bin_deg=LIDAR_SCAN_BIN_DEG, wrap_threshold=LIDAR_WRAP_THRESHOLD_DEG):
+        self.bin_deg = bin_deg
+        self.num_bins = int(round(360.0 / bin_deg))
+        self.wrap_threshold = wrap_threshold
+        self.listeners = []
+        self.frame_filter = None  # Tầng lọc nhiễu (có hàm process(frame)), tùy chọn
+        self.lock = threading.Lock()
+        self.latest = None
+        self.seq = 0
+        self._reset_current()
+        self.last_angle = None
+        self.last_wrap_time = None
+
+    def _reset_current(self):
+        self.current = np.zeros(self.num_bins, dtype=np.float32)
+        self.current_count = 0
+
+    def add_listener(self, callback):
+        """callback(frame) được gọi trong thread đọc LIDAR mỗi khi có vòng quét mới"""
+        self.listeners.append(callback)
+
+    def add_point(self, angle_deg, distance_mm):
+        """Thêm 1 điểm (gọi từ thread đọc Serial)"""
+        angle = angle_deg % 360.0
+        if self.last_angle is not None and self.last_angle - angle > self.wrap_threshold:
+            self._emit()
+        self.last_angle = angle
+        b = int(angle / self.bin_deg) % self.num_bins
+        current = self.current[b]
+        if current == 0 or distance_mm < current:
+            self.current[b] = distance_mm
+        self.current_count += 1
+
+    def _emit(self):
+        now = time.time()
+        # Vòng đầu tiên thường thiếu (bắt đầu giữa chừng) -> bỏ
+        if self.last_wrap_time is not None:
+            self.seq += 1
+            frame = ScanFrame(self.seq, now, now - self.last_wrap_time, self.bin_deg,
+                              self.current, self.current_count)
+            if self.frame_filter is not None:
+                frame = self.frame_filter.process(frame)
+            with self.lock:
+                self.latest = frame
+            for callback in self.listeners:
+                try:
+                    callback(frame)
+                except Exception as e:
+                    print(f"[LIDAR] Scan listener error: {e}")
+        self.last_wrap_time = now
+        self._reset_current()
+
+    def get_latest(self, max_age=None):
+        """Vòng quét mới nhất (None nếu chưa có hoặc cũ hơn max_age giây)"""
+        with self.lock:
+            frame = self.latest
+        if frame is None or (max_age is not None and time.time() - frame.timestamp > max_age):
+            return None
+        return frame
+
+    def reset(self):
+        with self.lock:
+            self.latest = None
+        if self.frame_filter is not None:
+            self.frame_filter.reset()
+        self._reset_current()
+        self.last_angle = None
+        self.last_wrap_time = None
@@ -0,0 +1,207 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from config import (CLUSTER_BREAK_MIN_M, CLUSTER_BREAK_RATIO, CLUSTER_MERGE_EPS_M, CLUSTER_MIN_POINTS,
+                    TRACK_GATE_M, TRACK_MAX_MISSES, TRACK_VELOCITY_ALPHA)
+from obstacle_eval import to_robot_frame
+
+
+class Cluster:
+    """1 vật thể trong 1 vòng quét (tọa độ robot, mét)"""
+    __slots__ = ("cx", "cy", "min_x", "max_x", "min_y", "max_y", "count", "min_range")
+
+    def __init__(self, xs, ys):
+        self.cx = float(xs.mean())
+        self.cy = float(ys.mean())
+        self.min_x = float(xs.min())
+        self.max_x = float(xs.max())
+        self.min_y = float(ys.min())
+        self.max_y = float(ys.max())
+        self.count = len(xs)
+        self.min_range = float(np.hypot(xs, ys).min())
+
+
+def segment_scan(xs, ys, bin_deg):
+    """
+    Chia 1 vòng quét (điểm đã sắp theo góc) thành các đoạn liên tục:
+    tách ở chỗ khoảng cách giữa 2 điểm kề nhau nhảy vọt (range-jump breakpoint).
+    Trả về danh sách mảng chỉ số.
+    """
+    n = len(xs)
+    if n == 0:
+        return []
+    ranges = np.hypot(xs, ys)
+    # Ngưỡng tách thích nghi theo khoảng cách (điểm xa thì thưa hơn)
+    step = np.hypot(np.diff(xs), np.diff(ys))
+    threshold = np.maximum(CLUSTER_BREAK_MIN_M,
+                           CLUSTER_BREAK_RATIO * ranges[:-1] * math.radians(bin_deg))
+    breaks = np.nonzero(step > threshold)[0] + 1
+    segments = np.split(np.arange(n), breaks)
+    # Nối đoạn cuối với đoạn đầu nếu liền nhau qua mốc 360°
+    if len(segments) > 1:
+        gap = math.hypot(xs[0] - xs[-1], ys[0] - ys[-1])
+        if gap <= max(CLUSTER_BREAK_MIN_M, CLUSTER_BREAK_RATIO * ranges[-1] * math.radians(bin_deg)):
+            segments[0] = np.concatenate([segments[-1], segments[0]])
+            segments.pop()
+    return segments
+
+
+def merge_segments(xs, ys, segments, eps=CLUSTER_MERGE_EPS_M):
+    """
+    Gộp các đoạn bị che khuất 1 phần (DBSCAN theo lưới trên điểm đầu/cuối đoạn):
+    băm điểm đầu/cuối vào ô lưới cỡ eps, đoạn nào có điểm mút cách nhau < eps thì gộp.
+    """
+    parent = list(range(len(segments)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    grid = {}
+    for si, seg in enumerate(segments):
+        for idx in (seg[0], seg[-1]):
+            key = (int(math.floor(xs[idx] / eps)), int(math.floor(ys[idx] / eps)))
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for sj, jdx in grid.get((key[0] + dx, key[1] + dy), ()):
+                        if sj != si and math.hypot(xs[idx] - xs[jdx], ys[idx] - ys[jdx]) < eps:
+                            parent[find(si)] = find(sj)
+            grid.setdefault(key, []).append((si, idx))
+
+    groups = {}
+    for si, seg in enumerate(segments):
+        groups.setdefault(find(si), []).append(seg)
+    return [np.concatenate(g) for g in groups.values()]
+
+
+def cluster_frame(frame):
+    """Chia 1 ScanFrame thành danh sách Cluster"""
+    angles, distances = frame.points()
+    xs, ys = to_robot_frame(angles, distances)
+    segments = merge_segments(xs, ys, segment_scan(xs, ys, frame.bin_deg))
+    return [Cluster(xs[s], ys[s]) for s in segments if len(s) >= CLUSTER_MIN_POINTS]
+
+
+class Track:
+    """Vật thể được theo dõi qua nhiều vòng quét, ID ổn định"""
+    def __init__(self, track_id, cluster, timestamp):
+        self.id = track_id
+        self.cluster = cluster
+        self.vx = 0.0
+        self.vy = 0.0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+        self.misses = 0
+
+    def update(self, cluster, timestamp):
+        dt = timestamp - self.last_seen
+        if dt > 0:
+            # Vận tốc tương đối so với robot, làm mượt theo hàm mũ
+            a = TRACK_VELOCITY_ALPHA
+            self.vx = (1 - a) * self.vx + a * (cluster.cx - self.cluster.cx) / dt
+            self.vy = (1 - a) * self.vy + a * (cluster.cy - self.cluster.cy) / dt
+        self.cluster = cluster
+        self.last_seen = timestamp
+        self.hits += 1
+        self.misses = 0
+
+    def to_dict(self):
+        c = self.cluster
+        return {
+            "id": self.id,
+            "x": round(c.cx, 3), "y": round(c.cy, 3),
+            "vx": round(self.vx, 3), "vy": round(self.vy, 3),
+            "min_x": round(c.min_x, 3), "max_x": round(c.max_x, 3),
+            "min_y": round(c.min_y, 3), "max_y": round(c.max_y, 3),
+            "points": c.count,
+            "range": round(c.min_range, 3),
+            "age": round(self.last_seen - self.first_seen, 2),
+            "hits": self.hits
+        }
+
+
+class ObjectTracker:
+    """
+    Phân cụm mỗi vòng quét rồi ghép với các track cũ (láng giềng gần nhất trong cổng
+    TRACK_GATE_M, ưu tiên cặp gần nhất). Track không thấy quá TRACK_MAX_MISSES vòng thì bỏ.
+    Đăng ký làm listener của ScanAssembler -> chạy đúng tốc độ quét.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.next_id = 1
+        self.timestamp = None  # Thời điểm vòng quét cuối cùng đã xử lý
+        self.frames = 0
+        self.process_time = 0.0
+
+    def update(self, frame):
+        start = time.perf_counter()
+        clusters = cluster_frame(frame)
+        with self.lock:
+            tracks = self.tracks
+            pairs = []
+            if tracks and clusters:
+                # Dự đoán vị trí track theo vận tốc rồi tính ma trận khoảng cách
+                dt = np.array([frame.timestamp - t.last_seen for t in tracks])
+                px = np.array([t.cluster.cx + t.vx * d for t, d in zip(tracks, dt)])
+                py = np.array([t.cluster.cy + t.vy * d for t, d in zip(tracks, dt)])
+                cx = np.array([c.cx for c in clusters])
+                cy = np.array([c.cy for c in clusters])
+                dist = np.hypot(px[:, None] - cx[None, :], py[:, None] - cy[None, :])
+                order = np.argsort(dist, axis=None)
+                used_t, used_c = set(), set()
+                for flat in order:
+                    ti, ci = divmod(int(flat), len(clusters))
+                    if dist[ti, ci] > TRACK_GATE_M:
+                        break
+                    if ti in used_t or ci in used_c:
+                        continue
+                    used_t.add(ti)
+                    used_c.add(ci)
+                    pairs.append((ti, ci))
+            matched_t = {ti for ti, _ in pairs}
+            matched_c = {ci for _, ci in pairs}
+            for ti, ci in pairs:
+                tracks[ti].update(clusters[ci], frame.timestamp)
+            for ti, track in enumerate(tracks):
+                if ti not in matched_t:
+                    track.misses += 1
+            survivors = [t for t in tracks if t.misses <= TRACK_MAX_MISSES]
+            for ci, cluster in enumerate(clusters):
+                if ci not in matched_c:
+                    survivors.append(Track(self.next_id, cluster, frame.timestamp))
+                    self.next_id += 1
+            self.tracks = survivors
+            self.timestamp = frame.timestamp
+            self.frames += 1
+            self.process_time += time.perf_counter() - start
+
+    def get_tracks(self, confirmed_only=True, max_age=None):
+        """
+        Các track hiện tại (chỉ track đã thấy >= 2 lần và vừa thấy ở vòng cuối nếu confirmed_only).
+        Trả về None nếu vòng quét cuối cũ hơn max_age giây (LIDAR mất kết nối).
+        """
+        with self.lock:
+            if max_age is not None and (self.timestamp is None or time.time() - self.timestamp > max_age):
+                return None
+            return [t for t in self.tracks
+                    if not confirmed_only or (t.hits >= 2 and t.misses == 0)]
+
+    def reset(self):
+        with self.lock:
+            self.tracks = []
+            self.timestamp = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tracks": len(self.tracks),
+                "frames": self.frames,
+                "avg_process_ms": round(self.process_time / self.frames * 1000, 3) if self.frames else 0.0
+            }
@@ -0,0 +1,77 @@
+import math
+import time
+
+import numpy as np
+
+from config import (AVOID_WINDOW_M, AVOID_SECTOR_DEG, AVOID_MAX_TURN_DEG, ROBOT_WIDTH_M,
+                    OBSTACLE_SIDE_MARGIN_M)
+from obstacle_eval import to_robot_frame
+
+
+class VfhPlanner:
+    """
+    Chọn hướng vòng tránh theo Vector Field Histogram (bản nhị phân):
+    - Mỗi điểm trong cửa sổ AVOID_WINDOW_M chặn 1 cung góc được nới rộng theo nửa thân xe
+      (asin(bán kính xe / khoảng cách)) -> hướng tự do nghĩa là thân xe lọt qua được
+    - Chọn sector tự do gần hướng đích nhất trong ±AVOID_MAX_TURN_DEG
+    Toàn bộ là phép toán numpy trên ma trận sector x điểm (72 x ~360) nên chạy < 1 ms,
+    luôn xong trong 1 chu kỳ quét.
+    """
+    def __init__(self, window_m=AVOID_WINDOW_M, sector_deg=AVOID_SECTOR_DEG,
+                 max_turn_deg=AVOID_MAX_TURN_DEG):
+        self.window_m = window_m
+        self.sector_deg = sector_deg
+        self.max_turn_deg = max_turn_deg
+        self.robot_radius = ROBOT_WIDTH_M / 2 + OBSTACLE_SIDE_MARGIN_M
+        # Tâm các sector: -180..180 độ, dương = bên trái
+        self.sectors = np.arange(-180.0, 180.0, sector_deg) + sector_deg / 2
+        self.last_plan_ms = 0.0
+
+    def histogram(self, angles_deg, distances_mm):
+        """Mảng bool: sector bị chặn + khoảng cách gần nhất (m) theo từng sector"""
+        x, y = to_robot_frame(angles_deg, distances_mm)
+        r = np.hypot(x, y)
+        near = (r > 0) & (r < self.window_m)
+        r = r[near]
+        theta = np.degrees(np.arctan2(y[near], x[near]))
+        # Nới rộng theo bán kính thân xe (điểm càng gần thì cung bị chặn càng rộng)
+        spread = np.degrees(np.arcsin(np.minimum(self.robot_radius / np.maximum(r, 1e-3), 1.0)))
+        diff = np.abs((self.sectors[:, None] - theta[None, :] + 180.0) % 360.0 - 180.0)
+        hit = diff <= spread[None, :] + self.sector_deg / 2
+        blocked = hit.any(axis=1)
+        nearest = np.where(hit, r[None, :], np.inf).min(axis=1) if len(r) else np.full(len(self.sectors), np.inf)
+        return blocked, nearest
+
+    def plan(self, angles_deg, distances_mm, goal_deg=0.0):
+        """
+        Trả về dict {heading (độ, dương = trái), obstacle_range (m), free_sectors} hoặc None
+        nếu không có hướng tự do trong ±max_turn_deg
+        """
+        start = time.perf_counter()
+        blocked, nearest = self.histogram(angles_deg, distances_mm)
+        offset = (self.sectors - goal_deg + 180.0) % 360.0 - 180.0
+        candidates = ~blocked & (np.abs(offset) <= self.max_turn_deg)
+        result = None
+        if candidates.any():
+            # Gần hướng đích nhất; bằng nhau thì chọn bên có vùng trống rộng hơn
+            cost = np.abs(offset) + np.where(candidates, 0.0, np.inf)
+            best = np.flatnonzero(cost == cost.min())
+            if len(best) > 1:
+                left_free = np.count_nonzero(candidates & (offset > 0))
+                right_free = np.count_nonzero(candidates & (offset < 0))
+                best = best[offset[best] > 0] if left_free >= right_free else best[offset[best] < 0]
+            heading = float(self.sectors[best[0]])
+            # Vật cản đang chặn hướng đích
+            goal_sector = int(np.argmin(np.abs(offset)))
+            obstacle_range = float(nearest[goal_sector])
+            result = {
+                "heading": heading,
+                "obstacle_range": obstacle_range if math.isfinite(obstacle_range) else 0.0,
+                "free_sectors": int(np.count_nonzero(candidates))
+            }
+        self.last_plan_ms = (time.perf_counter() - start) * 1000
+        return result
+
+
+# Global instance
+vfh_planner = VfhPlanner()
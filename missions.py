@@ -0,0 +1,379 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+
+from config import (MISSION_DB, MISSION_HOME, MISSION_RETURN_HOME, MISSION_HOME_TOLERANCE_M,
+                    MISSION_CHARGE_AFTER_M, MISSION_CHARGE_SEC, MISSION_AUTOSTART, MAP_YAW_OFFSET_DEG)
+from occupancy_grid import LocalProjection
+from route_executor import ROUTE_FINISHED, ROUTE_STOPPED
+
+# Loại mission: route khảo sát do người dùng đưa vào, về trạm, sạc (2 loại sau do scheduler chèn)
+KIND_SURVEY = "survey"
+KIND_HOME = "home"
+KIND_CHARGE = "charge"
+
+# Trạng thái mission
+MISSION_PENDING = "pending"
+MISSION_RUNNING = "running"
+MISSION_DONE = "done"
+MISSION_STOPPED = "stopped"
+MISSION_FAILED = "failed"
+MISSION_CANCELLED = "cancelled"
+MISSION_INTERRUPTED = "interrupted"  # Server khởi động lại khi đang chạy (xem /recoverRoute)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS missions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rover TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'survey',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    route TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    distance_m REAL NOT NULL DEFAULT 0,
+    obstacle_stops INTEGER NOT NULL DEFAULT 0,
+    detections INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS missions_queue ON missions (rover, status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+MISSION_COLUMNS = ("id", "rover", "name", "kind", "priority", "status", "route", "created", "started",
+                   "finished", "distance_m", "obstacle_stops", "detections", "error")
+
+
+def mission_to_dict(row):
+    mission = dict(zip(MISSION_COLUMNS, row))
+    mission["route"] = json.loads(mission["route"]) if mission["route"] else None
+    duration = (mission["finished"] or time.time()) - mission["started"] if mission["started"] else None
+    mission["duration_sec"] = round(duration, 1) if duration is not None else None
+    mission["detections_per_m"] = (round(mission["detections"] / mission["distance_m"], 3)
+                                   if mission["distance_m"] > 0 else None)
+    return mission
+
+
+def parse_route(dis, dir_, dir_value):
+    """Route dạng /startRoute (chuỗi "1,2" hoặc list) -> dict; raise ValueError nếu không hợp lệ"""
+    def as_list(value, cast):
+        if isinstance(value, str):
+            value = [x for x in value.split(",") if x]
+        return [cast(x) for x in value]
+    route = {"dis": as_list(dis, float), "dir": as_list(dir_, int), "dir_value": as_list(dir_value, float)}
+    if not route["dis"] or not len(route["dis"]) == len(route["dir"]) == len(route["dir_value"]):
+        raise ValueError("dis, dir and dir_value must be non-empty and the same length")
+    return route
+
+
+def home_route(lat, lon, yaw, home_lat, home_lon):
+    """
+    Route về trạm theo đường thẳng: quay tại chỗ về hướng trạm rồi đi thẳng.
+    None nếu đã ở trong MISSION_HOME_TOLERANCE_M.
+    """
+    x, y = LocalProjection(lat, lon).to_xy(home_lat, home_lon)
+    distance = math.hypot(x, y)
+    if distance <= MISSION_HOME_TOLERANCE_M:
+        return None
+    # Hướng hiện tại theo cùng quy ước với occupancy grid (từ trục Đông, ngược chiều kim đồng hồ)
+    turn = (math.degrees(math.atan2(y, x)) - (yaw + MAP_YAW_OFFSET_DEG) + 180.0) % 360.0 - 180.0
+    # Đoạn 0: đi 0 m rồi quay (-1 trái / 1 phải), đoạn 1: đi thẳng về trạm
+    return {"dis": [0.0, round(distance, 2)],
+            "dir": [-1 if turn > 0 else 1, 0],
+            "dir_value": [round(abs(turn), 1), 0.0]}
+
+
+class MissionStore:
+    """
+    Hàng đợi mission trong SQLite (1 file, không cần server): lấy mission kế tiếp theo
+    (rover, status, priority, id) bằng index nên hàng trăm mission vẫn truy vấn tức thì.
+    Kết nối mở lười ở lần dùng đầu tiên, dùng chung cho mọi thread (có lock).
+    """
+    def __init__(self, path=MISSION_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def add(self, rover, name, route, priority=0, kind=KIND_SURVEY, status=MISSION_PENDING):
+        with self.lock:
+            db = self._db()
+            cursor = db.execute(
+                "INSERT INTO missions (rover, name, kind, priority, status, route, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rover, name, kind, int(priority), status, json.dumps(route) if route else None, time.time()))
+            db.commit()
+            return cursor.lastrowid
+
+    def add_many(self, rover, missions):
+        """Thêm nhiều mission trong 1 transaction. missions: [(name, route, priority)]"""
+        now = time.time()
+        with self.lock:
+            db = self._db()
+            with db:
+                first = None
+                for name, route, priority in missions:
+                    cursor = db.execute(
+                        "INSERT INTO missions (rover, name, kind, priority, route, created) VALUES (?, ?, ?, ?, ?, ?)",
+                        (rover, name, KIND_SURVEY, int(priority), json.dumps(route), now))
+                    first = first or cursor.lastrowid
+            return first
+
+    def get(self, mission_id):
+        with self.lock:
+            row = self._db().execute(
+                f"SELECT {', '.join(MISSION_COLUMNS)} FROM missions WHERE id = ?", (mission_id,)).fetchone()
+        return mission_to_dict(row) if row else None
+
+    def next_pending(self, rover):
+        """Mission chờ có priority cao nhất (cùng priority thì vào trước chạy trước)"""
+        with self.lock:
+            row = self._db().execute(
+                f"SELECT {', '.join(MISSION_COLUMNS)} FROM missions WHERE rover = ? AND status = ? "
+                "ORDER BY priority DESC, id LIMIT 1", (rover, MISSION_PENDING)).fetchone()
+        return mission_to_dict(row) if row else None
+
+    def list(self, rover, status=None, limit=100, offset=0):
+        query = f"SELECT {', '.join(MISSION_COLUMNS)} FROM missions WHERE rover = ?"
+        params = [rover]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        params += [int(limit), int(offset)]
+        with self.lock:
+            rows = self._db().execute(query, params).fetchall()
+        return [mission_to_dict(row) for row in rows]
+
+    def update(self, mission_id, **fields):
+        if "route" in fields:
+            fields["route"] = json.dumps(fields["route"]) if fields["route"] else None
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock:
+            db = self._db()
+            db.execute(f"UPDATE missions SET {assignments} WHERE id = ?", (*fields.values(), mission_id))
+            db.commit()
+
+    def cancel(self, mission_id):
+        """Hủy mission đang chờ. False nếu không tồn tại hoặc đã chạy"""
+        with self.lock:
+            db = self._db()
+            cursor = db.execute("UPDATE missions SET status = ? WHERE id = ? AND status = ?",
+                                (MISSION_CANCELLED, mission_id, MISSION_PENDING))
+            db.commit()
+            return cursor.rowcount > 0
+
+    def mark_interrupted(self, rover):
+        """Mission còn 'running' từ lần chạy trước (server bị tắt giữa chừng)"""
+        with self.lock:
+            db = self._db()
+            db.execute("UPDATE missions SET status = ? WHERE rover = ? AND status = ?",
+                       (MISSION_INTERRUPTED, rover, MISSION_RUNNING))
+            db.commit()
+
+    def summary(self, rover):
+        """Số mission theo trạng thái + thống kê tổng của các mission khảo sát đã chạy"""
+        with self.lock:
+            db = self._db()
+            counts = dict(db.execute(
+                "SELECT status, COUNT(*) FROM missions WHERE rover = ? GROUP BY status", (rover,)).fetchall())
+            row = db.execute(
+                "SELECT COUNT(*), SUM(finished - started), SUM(distance_m), SUM(obstacle_stops), SUM(detections) "
+                "FROM missions WHERE rover = ? AND kind = ? AND started IS NOT NULL AND finished IS NOT NULL",
+                (rover, KIND_SURVEY)).fetchone()
+        runs, duration, distance, stops, detections = (v or 0 for v in row)
+        return {
+            "counts": counts,
+            "completed_runs": runs,
+            "total_duration_sec": round(duration, 1),
+            "avg_duration_sec": round(duration / runs, 1) if runs else None,
+            "total_distance_m": round(distance, 2),
+            "obstacle_stops": stops,
+            "stops_per_km": round(stops / distance * 1000, 2) if distance > 0 else None,
+            "detections": detections,
+            "detections_per_m": round(detections / distance, 3) if distance > 0 else None
+        }
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self._db().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            db.commit()
+
+
+class MissionScheduler:
+    """
+    Chạy lần lượt các mission của 1 rover qua route executor của rover:
+    - Lấy mission chờ có priority cao nhất, chạy xong mới lấy mission kế tiếp
+    - Trước mission sẽ làm tổng quãng đường từ lần sạc trước vượt MISSION_CHARGE_AFTER_M:
+      chèn chặng về trạm + sạc (chờ MISSION_CHARGE_SEC tại trạm)
+    - Hết hàng đợi: chèn chặng về trạm (MISSION_RETURN_HOME)
+    - Mission bị dừng/lỗi -> tạm dừng scheduler, chờ người vận hành
+    Mỗi chặng (kể cả về trạm/sạc) là 1 dòng trong bảng missions kèm thống kê.
+    """
+    def __init__(self, rover, store):
+        self.rover = rover
+        self.store = store
+        self.enabled = MISSION_AUTOSTART
+        self.wake = threading.Event()
+        self.current = None             # id mission đang chạy
+        self.distance_since_charge = 0.0
+        self.at_home = True
+        self.last_error = None
+
+    def start(self):
+        self.enabled = True
+        self.wake.set()
+
+    def pause(self):
+        """Không lấy mission mới (mission đang chạy vẫn chạy tiếp)"""
+        self.enabled = False
+
+    def notify(self):
+        """Có mission mới trong hàng đợi"""
+        self.wake.set()
+
+    def home(self):
+        """Vị trí trạm (lat, lon): đặt qua API, hoặc MISSION_HOME, hoặc None"""
+        home = self.store.get_meta(f"home:{self.rover.id}")
+        return tuple(home) if home else MISSION_HOME
+
+    def set_home(self, lat, lon):
+        self.store.set_meta(f"home:{self.rover.id}", [lat, lon])
+
+    def run(self):
+        """Vòng lặp của thread mission_scheduler:<rover_id>"""
+        self.store.mark_interrupted(self.rover.id)
+        while True:
+            self.wake.wait(1.0)
+            self.wake.clear()
+            # Không chen vào route đang chạy tay từ map.html
+            if not self.enabled or self.rover.route.is_running():
+                continue
+            try:
+                self._step()
+            except Exception as e:
+                self.last_error = str(e)
+                self.enabled = False
+                print(f"[Missions:{self.rover.id}] Scheduler error: {e}")
+
+    def _step(self):
+        mission = self.store.next_pending(self.rover.id)
+        if mission is None:
+            if MISSION_RETURN_HOME and not self.at_home:
+                self._go_home("Về trạm (hết hàng đợi)")
+            return
+        planned = sum(mission["route"]["dis"])
+        if self.distance_since_charge > 0 and self.distance_since_charge + planned > MISSION_CHARGE_AFTER_M:
+            if not self._go_home("Về trạm sạc"):
+                return
+            self._charge()
+            if not self.enabled:
+                return
+        self._execute(mission["id"], mission["route"])
+
+    def _go_home(self, name):
+        """Chèn + chạy chặng về trạm. False nếu không về được (scheduler tạm dừng)"""
+        home = self.home()
+        if home is None:
+            # Chưa biết trạm: coi vị trí hiện tại là trạm
+            self.at_home = True
+            return True
+        snap = self.rover.shared_data.snapshot()
+        if not self.rover.shared_data.has_fix(snap):
+            # Vị trí mặc định / cũ -> route về trạm sai hướng: chờ người vận hành
+            self.last_error = "No GPS fix - cannot plan route home"
+            self.enabled = False
+            print(f"[Missions:{self.rover.id}] No GPS fix - cannot plan route home, scheduler paused")
+            return False
+        route = home_route(snap["lat"], snap["lon"], snap.get("yaw", 0.0), *home)
+        if route is None:
+            self.at_home = True
+            return True
+        mission_id = self.store.add(self.rover.id, name, route, kind=KIND_HOME, status=MISSION_RUNNING)
+        done = self._execute(mission_id, route)
+        if done is None:
+            self.store.update(mission_id, status=MISSION_CANCELLED)
+        if not done:
+            return False
+        self.at_home = True
+        return True
+
+    def _charge(self):
+        """Chặng sạc: chờ tại trạm MISSION_CHARGE_SEC (dừng sớm nếu scheduler bị tạm dừng)"""
+        mission_id = self.store.add(self.rover.id, "Sạc", None, kind=KIND_CHARGE, status=MISSION_RUNNING)
+        self.current = mission_id
+        start = time.time()
+        self.store.update(mission_id, started=start)
+        print(f"[Missions:{self.rover.id}] Charging for {MISSION_CHARGE_SEC}s")
+        while self.enabled and time.time() - start < MISSION_CHARGE_SEC:
+            time.sleep(1.0)
+        status = MISSION_DONE if self.enabled else MISSION_STOPPED
+        self.store.update(mission_id, status=status, finished=time.time())
+        if status == MISSION_DONE:
+            self.distance_since_charge = 0.0
+        self.current = None
+
+    def _execute(self, mission_id, route):
+        """
+        Chạy 1 route qua route executor và ghi thống kê. True nếu hoàn thành, False nếu
+        dừng/lỗi, None nếu executor đang bận (route chạy tay vừa bắt đầu)
+        """
+        executor = self.rover.route
+        camera = self.rover.camera
+        detections_start = camera.detections_total
+        if not executor.start(route["dis"], route["dir"], route["dir_value"]):
+            return None
+        self.current = mission_id
+        self.at_home = False
+        self.store.update(mission_id, status=MISSION_RUNNING, started=time.time())
+        print(f"[Missions:{self.rover.id}] Mission {mission_id} started")
+        while executor.is_running():
+            time.sleep(0.5)
+        if executor.state == ROUTE_FINISHED:
+            status = MISSION_DONE
+        elif executor.state == ROUTE_STOPPED:
+            status = MISSION_STOPPED
+        else:
+            status = MISSION_FAILED
+        self.distance_since_charge += executor.distance_done
+        self.store.update(mission_id, status=status, finished=time.time(),
+                          distance_m=round(executor.distance_done, 2),
+                          obstacle_stops=executor.obstacle_stops,
+                          detections=camera.detections_total - detections_start,
+                          error=executor.last_error)
+        self.current = None
+        print(f"[Missions:{self.rover.id}] Mission {mission_id} {status}")
+        if status != MISSION_DONE:
+            # Dừng tay / lỗi / không tránh được vật cản -> chờ người vận hành
+            self.enabled = False
+            return False
+        return True
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "current": self.current,
+            "distance_since_charge": round(self.distance_since_charge, 2),
+            "at_home": self.at_home,
+            "home": self.home(),
+            "last_error": self.last_error
+        }
+
+
+# Global instance
+mission_store = MissionStore()
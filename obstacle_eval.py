@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+
+from config import (ROBOT_WIDTH_M, ROBOT_LENGTH_M, LIDAR_FRONT_OFFSET_M, OBSTACLE_SIDE_MARGIN_M,
+                    OBSTACLE_STOP_MARGIN_M, OBSTACLE_DECEL_MS2, OBSTACLE_REACTION_SEC,
+                    OBSTACLE_TTC_MIN_SEC, OBSTACLE_MIN_POINTS, LIDAR_ANGLE_CLOCKWISE)
+
+
+def to_robot_frame(angles_deg, distances_mm):
+    """Điểm LIDAR -> tọa độ robot (mét): x hướng tới trước, y sang trái"""
+    a = np.radians(np.asarray(angles_deg, dtype=np.float64))
+    r = np.asarray(distances_mm, dtype=np.float64) / 1000.0
+    if LIDAR_ANGLE_CLOCKWISE:
+        a = -a
+    return r * np.cos(a), r * np.sin(a)
+
+
+def stopping_distance(speed):
+    """Quãng đường cần để dừng: phản ứng + phanh + biên an toàn (mét)"""
+    return speed * OBSTACLE_REACTION_SEC + speed * speed / (2 * OBSTACLE_DECEL_MS2) + OBSTACLE_STOP_MARGIN_M
+
+
+class ObstacleEvaluator:
+    """
+    Đánh giá vật cản theo lệnh chuyển động hiện tại thay vì vùng góc cố định:
+    - 'T' (đi thẳng): chỉ xét điểm trong hành lang rộng bằng thân xe phía trước,
+      dừng khi khoảng cách < quãng đường dừng theo tốc độ hoặc TTC < ngưỡng
+    - 'L'/'R' (quay tại chỗ): chỉ xét điểm nằm trong vòng tròn quét của thân xe
+    """
+    def __init__(self):
+        self.half_width = ROBOT_WIDTH_M / 2 + OBSTACLE_SIDE_MARGIN_M
+        # Bán kính vòng quét khi quay tại chỗ (tâm quay ~ tâm xe, LIDAR ở phía trước)
+        self.sweep_radius = math.hypot(ROBOT_LENGTH_M / 2, ROBOT_WIDTH_M / 2) + OBSTACLE_SIDE_MARGIN_M
+        # Tâm xe so với LIDAR theo trục x (LIDAR nằm sau mũi xe LIDAR_FRONT_OFFSET_M)
+        self.center_offset = LIDAR_FRONT_OFFSET_M - ROBOT_LENGTH_M / 2
+
+    def evaluate(self, angles_deg, distances_mm, command, speed):
+        """
+        Trả về dict: detected, min_distance (mm, theo đường đi), ttc (giây hoặc None), zone
+        """
+        x, y = to_robot_frame(angles_deg, distances_mm)
+        if command == "T":
+            return self._forward(x, y, speed)
+        if command in ("L", "R"):
+            return self._rotate(x, y)
+        return {"detected": False, "min_distance": float('inf'), "ttc": None, "zone": "idle"}
+
+    def _forward(self, x, y, speed):
+        in_path = (x > 0) & (np.abs(y) <= self.half_width)
+        if np.count_nonzero(in_path) < OBSTACLE_MIN_POINTS:
+            return {"detected": False, "min_distance": float('inf'), "ttc": None, "zone": "corridor"}
+        # Khoảng cách từ mũi xe đến vật theo hướng đi
+        gap = max(float(np.min(x[in_path])) - LIDAR_FRONT_OFFSET_M, 0.0)
+        ttc = gap / speed if speed > 0.01 else None
+        detected = gap < stopping_distance(speed) or (ttc is not None and ttc < OBSTACLE_TTC_MIN_SEC)
+        return {"detected": detected, "min_distance": gap * 1000, "ttc": ttc, "zone": "corridor"}
+
+    def evaluate_tracks(self, tracks, command, speed):
+        """
+        Như evaluate() nhưng trên danh sách track (lidar_tracking.Track) thay cho đám điểm:
+        dùng khung bao của cụm và vận tốc tương đối để tính TTC chính xác hơn với vật đang di chuyển
+        """
+        if command == "T":
+            return self._forward_tracks(tracks, speed)
+        if command in ("L", "R"):
+            return self._rotate_tracks(tracks)
+        return {"detected": False, "min_distance": float('inf'), "ttc": None, "zone": "idle"}
+
+    def _forward_tracks(self, tracks, speed):
+        gap = float('inf')
+        ttc = None
+        for track in tracks:
+            c = track.cluster
+            if c.count < OBSTACLE_MIN_POINTS or c.max_x <= 0:
+                continue
+            if c.min_y > self.half_width or c.max_y < -self.half_width:
+                continue
+            track_gap = max(c.min_x - LIDAR_FRONT_OFFSET_M, 0.0)
+            # Tốc độ tiến lại gần: vật đứng yên -> -vx ~ tốc độ xe; vật đi ngược chiều -> lớn hơn
+            closing = max(-track.vx, speed)
+            track_ttc = track_gap / closing if closing > 0.01 else None
+            gap = min(gap, track_gap)
+            if track_ttc is not None and (ttc is None or track_ttc < ttc):
+                ttc = track_ttc
+        if gap == float('inf'):
+            return {"detected": False, "min_distance": gap, "ttc": None, "zone": "corridor"}
+        detected = gap < stopping_distance(speed) or (ttc is not None and ttc < OBSTACLE_TTC_MIN_SEC)
+        return {"detected": detected, "min_distance": gap * 1000, "ttc": ttc, "zone": "corridor"}
+
+    def _rotate_tracks(self, tracks):
+        nearest = float('inf')
+        detected = False
+        for track in tracks:
+            c = track.cluster
+            # Điểm gần tâm quay nhất của khung bao
+            dx = min(max(self.center_offset, c.min_x), c.max_x) - self.center_offset
+            dy = min(max(0.0, c.min_y), c.max_y)
+            dist = math.hypot(dx, dy)
+            nearest = min(nearest, dist)
+            if dist < self.sweep_radius and c.count >= OBSTACLE_MIN_POINTS:
+                detected = True
+        return {"detected": detected, "min_distance": nearest * 1000, "ttc": None, "zone": "sweep"}
+
+    def _rotate(self, x, y):
+        # Khoảng cách tới tâm quay
+        dist = np.hypot(x - self.center_offset, y)
+        inside = dist < self.sweep_radius
+        nearest = float(np.min(dist)) if len(dist) else float('inf')
+        detected = np.count_nonzero(inside) >= OBSTACLE_MIN_POINTS
+        return {"detected": bool(detected), "min_distance": nearest * 1000, "ttc": None, "zone": "sweep"}
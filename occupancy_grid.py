@@ -0,0 +1,202 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (MAP_RESOLUTION_M, MAP_TILE_CELLS, MAP_MAX_TILES, MAP_MAX_RANGE_MM,
+                    LIDAR_ANGLE_CLOCKWISE, MAP_YAW_OFFSET_DEG)
+
+EARTH_RADIUS_M = 6378137.0
+
+# Log-odds cập nhật mỗi lần quan sát
+LOG_ODDS_HIT = 0.85
+LOG_ODDS_MISS = -0.4
+LOG_ODDS_MIN = -4.0
+LOG_ODDS_MAX = 4.0
+
+
+class LocalProjection:
+    """Chuyển lat/lon sang mét (x: Đông, y: Bắc) quanh gốc là fix GPS đầu tiên"""
+    def __init__(self, lat0, lon0):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.cos_lat0 = math.cos(math.radians(lat0))
+
+    def to_xy(self, lat, lon):
+        x = math.radians(lon - self.lon0) * EARTH_RADIUS_M * self.cos_lat0
+        y = math.radians(lat - self.lat0) * EARTH_RADIUS_M
+        return x, y
+
+
+class OccupancyGrid:
+    """
+    Bản đồ chiếm chỗ 2D dạng tile, log-odds float32.
+    - Tile (MAP_TILE_CELLS x MAP_TILE_CELLS ô) chỉ cấp phát khi có tia đi qua
+    - Giới hạn MAP_MAX_TILES: khi vượt, bỏ tile ít dùng nhất nằm xa robot
+    - integrate_scan() ray-cast vector hóa toàn bộ scan bằng numpy
+    """
+    def __init__(self, resolution=MAP_RESOLUTION_M, tile_cells=MAP_TILE_CELLS,
+                 max_tiles=MAP_MAX_TILES, max_range_mm=MAP_MAX_RANGE_MM):
+        self.lock = threading.Lock()
+        self.resolution = resolution
+        self.tile_cells = tile_cells
+        self.max_tiles = max_tiles
+        self.max_range_m = max_range_mm / 1000.0
+        self.tiles = OrderedDict()  # (tx, ty) -> np.ndarray[tile_cells, tile_cells], thứ tự LRU
+        self.projection = None
+        self.robot_xy = (0.0, 0.0)
+        self.scans = 0
+        self.evicted = 0
+        self.last_update_ms = 0.0
+
+    def pose_from_gps(self, lat, lon, yaw_deg):
+        """Pose (x, y, theta) theo mét/radian từ GPS + yaw"""
+        if self.projection is None:
+            self.projection = LocalProjection(lat, lon)
+        x, y = self.projection.to_xy(lat, lon)
+        return x, y, math.radians(yaw_deg + MAP_YAW_OFFSET_DEG)
+
+    def _tile(self, key):
+        """Lấy tile (cấp phát nếu chưa có) và đánh dấu vừa dùng - gọi khi giữ lock"""
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = np.zeros((self.tile_cells, self.tile_cells), dtype=np.float32)
+            self.tiles[key] = tile
+        else:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def _evict(self):
+        """Bỏ tile khi vượt giới hạn: ưu tiên tile cũ nhất nằm ngoài tầm LIDAR"""
+        if len(self.tiles) <= self.max_tiles:
+            return
+        tile_m = self.tile_cells * self.resolution
+        rx = self.robot_xy[0] / tile_m
+        ry = self.robot_xy[1] / tile_m
+        keep_radius = self.max_range_m / tile_m + 1.5
+        for key in list(self.tiles.keys()):  # Từ cũ nhất đến mới nhất
+            if len(self.tiles) <= self.max_tiles:
+                return
+            if math.hypot(key[0] + 0.5 - rx, key[1] + 0.5 - ry) > keep_radius:
+                del self.tiles[key]
+                self.evicted += 1
+        # Vẫn còn quá nhiều (tất cả đều gần robot): bỏ theo LRU
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+            self.evicted += 1
+
+    def integrate_scan(self, pose, angles_deg, distances_mm):
+        """Ray-cast 1 scan (mảng góc độ, khoảng cách mm) từ pose (x, y, theta)"""
+        start = time.perf_counter()
+        angles_deg = np.asarray(angles_deg, dtype=np.float64)
+        ranges = np.asarray(distances_mm, dtype=np.float64) / 1000.0
+        valid = ranges > 0
+        angles_deg = angles_deg[valid]
+        ranges = ranges[valid]
+        if len(ranges) == 0:
+            return
+        px, py, theta = pose
+        rel = np.radians(angles_deg)
+        if LIDAR_ANGLE_CLOCKWISE:
+            rel = -rel
+        world = theta + rel
+        hit = ranges < self.max_range_m
+        ranges = np.minimum(ranges, self.max_range_m)
+        cos_w = np.cos(world)
+        sin_w = np.sin(world)
+
+        # Các điểm mẫu dọc tia (bước = resolution), ghép phẳng cho mọi tia
+        steps = np.maximum((ranges / self.resolution).astype(np.int64), 1)
+        beam_idx = np.repeat(np.arange(len(ranges)), steps)
+        offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        dist = offsets * self.resolution
+        free_x = np.floor((px + dist * cos_w[beam_idx]) / self.resolution).astype(np.int64)
+        free_y = np.floor((py + dist * sin_w[beam_idx]) / self.resolution).astype(np.int64)
+        hit_x = np.floor((px + ranges[hit] * cos_w[hit]) / self.resolution).astype(np.int64)
+        hit_y = np.floor((py + ranges[hit] * sin_w[hit]) / self.resolution).astype(np.int64)
+
+        # Cửa sổ cục bộ quanh robot: đánh dấu bằng phép gán (mỗi ô chỉ 1 lần/scan,
+        # không cần sort/unique); ô trúng đích không tính là trống
+        half = int(math.ceil(self.max_range_m / self.resolution)) + 1
+        ox = int(math.floor(px / self.resolution)) - half
+        oy = int(math.floor(py / self.resolution)) - half
+        size = 2 * half + 1
+        free = np.zeros((size, size), dtype=bool)
+        occupied = np.zeros((size, size), dtype=bool)
+        free[free_y - oy, free_x - ox] = True
+        occupied[hit_y - oy, hit_x - ox] = True
+        delta = np.where(occupied, np.float32(LOG_ODDS_HIT),
+                         np.where(free, np.float32(LOG_ODDS_MISS), np.float32(0.0)))
+
+        with self.lock:
+            self.robot_xy = (px, py)
+            self._apply_window(ox, oy, delta)
+            self._evict()
+            self.scans += 1
+            self.last_update_ms = (time.perf_counter() - start) * 1000
+
+    def _apply_window(self, ox, oy, delta):
+        """Cộng cửa sổ log-odds (gốc ô ox, oy) vào các tile giao với nó - gọi khi giữ lock"""
+        n = self.tile_cells
+        h, w = delta.shape
+        for ty in range(oy // n, (oy + h - 1) // n + 1):
+            for tx in range(ox // n, (ox + w - 1) // n + 1):
+                x0 = max(ox, tx * n)
+                x1 = min(ox + w, (tx + 1) * n)
+                y0 = max(oy, ty * n)
+                y1 = min(oy + h, (ty + 1) * n)
+                part = delta[y0 - oy:y1 - oy, x0 - ox:x1 - ox]
+                if not part.any():
+                    continue
+                tile = self._tile((tx, ty))
+                view = tile[y0 - ty * n:y1 - ty * n, x0 - tx * n:x1 - tx * n]
+                np.clip(view + part, LOG_ODDS_MIN, LOG_ODDS_MAX, out=view)
+
+    def render(self, radius_m=20.0):
+        """Ảnh xám quanh robot (0 = có vật, 255 = trống, 128 = chưa biết), trục y hướng Bắc lên trên"""
+        with self.lock:
+            px, py = self.robot_xy
+            half = int(radius_m / self.resolution)
+            cx0 = int(math.floor(px / self.resolution)) - half
+            cy0 = int(math.floor(py / self.resolution)) - half
+            size = 2 * half
+            log_odds = np.zeros((size, size), dtype=np.float32)
+            n = self.tile_cells
+            for ty in range(cy0 // n, (cy0 + size - 1) // n + 1):
+                for tx in range(cx0 // n, (cx0 + size - 1) // n + 1):
+                    tile = self.tiles.get((tx, ty))
+                    if tile is None:
+                        continue
+                    # Giao giữa tile và cửa sổ
+                    x0 = max(cx0, tx * n)
+                    x1 = min(cx0 + size, (tx + 1) * n)
+                    y0 = max(cy0, ty * n)
+                    y1 = min(cy0 + size, (ty + 1) * n)
+                    log_odds[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0] = \
+                        tile[y0 - ty * n:y1 - ty * n, x0 - tx * n:x1 - tx * n]
+        prob = 1.0 / (1.0 + np.exp(log_odds))  # Xác suất trống
+        image = (prob * 255).astype(np.uint8)
+        return np.flipud(image)
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.projection = None
+            self.scans = 0
+
+    def stats(self):
+        with self.lock:
+            tile_bytes = self.tile_cells * self.tile_cells * 4
+            return {
+                "tiles": len(self.tiles),
+                "max_tiles": self.max_tiles,
+                "memory_mb": round(len(self.tiles) * tile_bytes / 1e6, 2),
+                "scans": self.scans,
+                "evicted": self.evicted,
+                "last_update_ms": round(self.last_update_ms, 2),
+                "resolution_m": self.resolution,
+                "tile_cells": self.tile_cells
+            }
+
@@ -0,0 +1,138 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILER_INTERVAL_SEC, PROFILER_MAX_OVERHEAD, PROFILER_MAX_DEPTH
+
+
+class SamplingProfiler:
+    """Profiler lấy mẫu stack của tất cả thread theo chu kỳ (opt-in).
+
+    Kết quả được gộp thành dạng "folded stacks" (tương thích flamegraph.pl /
+    speedscope): mỗi dòng là `thread;frame1;frame2;... count`.
+    Chu kỳ lấy mẫu tự giãn ra nếu chi phí lấy mẫu vượt quá `max_overhead`.
+    """
+    def __init__(self, interval=PROFILER_INTERVAL_SEC, max_overhead=PROFILER_MAX_OVERHEAD,
+                 max_depth=PROFILER_MAX_DEPTH):
+        self.lock = threading.Lock()
+        self.base_interval = interval
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.sample_time = 0.0  # Tổng thời gian dành cho việc lấy mẫu (giây)
+        self.started_at = None
+        self._running = False
+        self._thread = None
+        self._stop_event = None   # Mỗi lần start 1 Event riêng: thread cũ không chạy lẫn với thread mới
+
+    def start(self):
+        """Bắt đầu lấy mẫu (trả về False nếu đang chạy)"""
+        with self.lock:
+            if self._running:
+                return False
+            self._running = True
+            self.started_at = time.time()
+            self.interval = self.base_interval
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop_event,),
+                                            name="profiler", daemon=True)
+            self._thread.start()
+        print(f"[Profiler] Started (interval={self.interval * 1000:.0f}ms)")
+        return True
+
+    def stop(self):
+        """Dừng lấy mẫu, giữ lại kết quả đã thu"""
+        with self.lock:
+            was_running = self._running
+            self._running = False
+            thread = self._thread
+            if was_running:
+                self._stop_event.set()
+        if was_running:
+            # Chờ mẫu đang lấy dở xong để kết quả sau stop() không đổi nữa
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+            print(f"[Profiler] Stopped after {self.samples} samples")
+        return was_running
+
+    def reset(self):
+        """Xóa kết quả đã thu"""
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.sample_time = 0.0
+            self.started_at = time.time() if self._running else None
+
+    def is_running(self):
+        with self.lock:
+            return self._running
+
+    def _format_stack(self, frame):
+        """Chuyển frame thành danh sách 'func (file:line)' từ gốc đến ngọn"""
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            filename = code.co_filename.replace("\\", "/").rsplit("/", 1)[-1]
+            parts.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        parts.reverse()
+        return parts
+
+    def sample_once(self):
+        """Lấy 1 mẫu stack của mọi thread (trừ chính profiler)"""
+        own_ident = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        folded = []
+        for ident, frame in frames.items():
+            if ident == own_ident:
+                continue
+            thread_name = names.get(ident, f"thread-{ident}")
+            stack = self._format_stack(frame)
+            folded.append(";".join([thread_name] + stack).replace(" ", "_"))
+        with self.lock:
+            self.stacks.update(folded)
+            self.samples += 1
+
+    def _run(self, stop_event):
+        while not stop_event.is_set():
+            t0 = time.perf_counter()
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"[Profiler] Sample error: {e}")
+            cost = time.perf_counter() - t0
+            with self.lock:
+                self.sample_time += cost
+                # Giữ chi phí lấy mẫu <= max_overhead: giãn chu kỳ nếu 1 mẫu quá tốn
+                self.interval = max(self.base_interval, cost / self.max_overhead)
+                interval = self.interval
+            stop_event.wait(interval)
+
+    def folded(self):
+        """Trả về chuỗi folded stacks, sắp xếp theo số mẫu giảm dần"""
+        with self.lock:
+            items = self.stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in items) + ("\n" if items else "")
+
+    def stats(self):
+        """Thống kê tóm tắt + số mẫu theo từng thread"""
+        with self.lock:
+            per_thread = Counter()
+            for stack, count in self.stacks.items():
+                per_thread[stack.split(";", 1)[0]] += count
+            elapsed = time.time() - self.started_at if self.started_at else 0.0
+            return {
+                "running": self._running,
+                "samples": self.samples,
+                "interval_ms": round(self.interval * 1000, 1),
+                "overhead_pct": round(100.0 * self.sample_time / elapsed, 3) if elapsed > 0 else 0.0,
+                "threads": dict(per_thread.most_common())
+            }
+
+
+# Global instance
+profiler = SamplingProfiler()
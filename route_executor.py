@@ -0,0 +1,513 @@
+import json
+import os
+import threading
+import time
+from time import sleep
+
+from config import (SERIAL_TIMEOUT_SEC, AVOID_ENABLED, AVOID_MAX_ATTEMPTS, AVOID_FALLBACK,
+                    ROUTE_CHECKPOINT_SEC, ROUTE_JOURNAL_FSYNC_SEC)
+from settings_store import settings
+from serial_io import serial_core
+from Read_Serial import avoid_obstacle, _yaw_delta
+
+# Trạng thái của route executor
+ROUTE_IDLE = "idle"
+ROUTE_INTERRUPTED = "interrupted"    # Có hành trình dở trong journal (sau khi khởi động lại)
+ROUTE_STARTING = "starting"
+ROUTE_DRIVING = "driving"
+ROUTE_TURNING = "turning"
+ROUTE_PAUSED = "paused"
+ROUTE_OBSTACLE = "obstacle"
+ROUTE_AVOIDING = "avoiding"
+ROUTE_FINISHED = "finished"
+ROUTE_STOPPED = "stopped"
+ROUTE_ABORTED = "aborted"
+ROUTE_FAILED = "failed"             # Lỗi giữa chừng: không ghi "end", vẫn khôi phục được
+
+
+class RouteJournal:
+    """
+    Nhật ký hành trình dạng JSON lines, chỉ ghi nối thêm:
+    {"k": "start", "route": {...}} -> nhiều {"k": "p", "i", "ph", ...} -> {"k": "end", "state"}.
+    Mỗi hành trình mới ghi đè file (journal chỉ giữ hành trình hiện tại). Ghi 1 dòng + flush
+    mỗi checkpoint, fsync tối đa mỗi ROUTE_JOURNAL_FSYNC_SEC nên chi phí rất nhỏ; dòng cuối
+    bị cắt dở khi mất điện được bỏ qua lúc đọc lại.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.last_sync = 0.0
+        self.records = 0
+
+    def _write(self, record, sync=False):
+        if self.file is None:
+            return
+        record["t"] = round(time.time(), 3)
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        self.records += 1
+        now = time.monotonic()
+        if sync or now - self.last_sync >= ROUTE_JOURNAL_FSYNC_SEC:
+            os.fsync(self.file.fileno())
+            self.last_sync = now
+
+    def begin(self, route):
+        """Bắt đầu hành trình mới (xóa journal cũ)"""
+        self.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.records = 0
+        self._write({"k": "start", "route": route}, sync=True)
+
+    def reopen(self):
+        """Ghi tiếp vào journal hiện có (khôi phục hành trình)"""
+        self.close()
+        self.file = open(self.path, "a+", encoding="utf-8")
+        # Dòng cuối bị cắt dở -> xuống dòng trước để bản ghi mới không dính vào
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+        self._write({"k": "resume"}, sync=True)
+
+    def checkpoint(self, step, phase, **values):
+        self._write({"k": "p", "i": step, "ph": phase, **values})
+
+    def end(self, state):
+        self._write({"k": "end", "state": state}, sync=True)
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def load(self):
+        """
+        Đọc lại journal. Trả về None nếu không có hành trình dở, ngược lại
+        {"route", "step", "phase", "done", "turned", "yaw", "t"} của checkpoint cuối cùng
+        (turned: số độ đã quay của pha turn, yaw: yaw lúc ghi checkpoint đó).
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        pending = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            kind = record.get("k")
+            if kind == "start":
+                pending = {"route": record["route"], "step": 0, "phase": "drive",
+                           "done": 0.0, "turned": 0.0, "yaw": None, "t": record.get("t")}
+            elif pending is None:
+                continue
+            elif kind == "p":
+                pending.update(step=record["i"], phase=record["ph"], done=record.get("done", 0.0),
+                               turned=record.get("turned", 0.0),
+                               yaw=record.get("yaw", record.get("yaw0")), t=record.get("t"))
+            elif kind == "end":
+                pending = None
+        return pending
+
+
+class RouteExecutor:
+    """
+    Thực thi hành trình của 1 rover dưới dạng máy trạng thái:
+    mỗi đoạn i gồm pha "drive" (đi thẳng dis[i] mét) rồi pha "turn" (quay dir_value[i] độ).
+    - Chỉ 1 executor chạy tại 1 thời điểm (start() từ chối khi đang chạy)
+    - Tiến độ (số mét đã đi / số độ đã quay) ghi vào RouteJournal mỗi
+      ROUTE_CHECKPOINT_SEC và mỗi lần chuyển pha
+    - Sau khi server khởi động lại, recover() chạy tiếp từ giữa đoạn dở thay vì lập lại lộ trình
+    Lệnh pause/resume/stop vẫn đi qua cờ route của SerialData như trước.
+    """
+    def __init__(self, rover_id, shared_data, port, baudrate, lidar=None, journal_path=None):
+        self.rover_id = rover_id
+        self.shared_data = shared_data
+        self.port = port
+        self.baudrate = baudrate
+        self.lidar = lidar
+        self.journal = RouteJournal(journal_path) if journal_path else None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.state = ROUTE_IDLE
+        self.state_since = time.time()
+        self.last_error = None
+        self.route = None
+        self.last_checkpoint = 0.0
+        # Thống kê của hành trình hiện tại (dùng cho thống kê mission)
+        self.distance_done = 0.0
+        self.obstacle_stops = 0
+        # Hành trình dở từ lần chạy trước
+        self.pending = self.journal.load() if self.journal is not None else None
+        if self.pending is not None:
+            self.state = ROUTE_INTERRUPTED
+            print(f"[Route:{rover_id}] Interrupted route found: step {self.pending['step'] + 1}, "
+                  f"{self.pending['phase']} ({self.pending['done']:.2f}m done)")
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.state_since = time.time()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, dis_list, dir_list, dir_value_list):
+        """Chạy hành trình mới. False nếu đang có hành trình chạy"""
+        route = {"dis": [float(x) for x in dis_list], "dir": [int(x) for x in dir_list],
+                 "dir_value": [float(x) for x in dir_value_list]}
+        return self._launch(route, None)
+
+    def recover(self):
+        """Chạy tiếp hành trình dở trong journal. False nếu không có hoặc đang chạy"""
+        if self.pending is None:
+            return False
+        return self._launch(self.pending["route"], self.pending)
+
+    def _launch(self, route, resume):
+        with self.lock:
+            if self.is_running() and self.shared_data.get_route_state()["stopped"]:
+                # Hành trình cũ vừa bị dừng, chờ thread thoát (tối đa 1 chu kỳ lệnh)
+                self.thread.join(1.0)
+            if self.is_running():
+                return False
+            self.route = route
+            self.pending = None
+            self.last_error = None
+            self.distance_done = 0.0
+            self.obstacle_stops = 0
+            self._set_state(ROUTE_STARTING)
+            self.shared_data.set_route_state(running=True, paused=False, stopped=False)
+            self.thread = threading.Thread(target=self._run, args=(route, resume),
+                                           name=f"route_executor:{self.rover_id}", daemon=True)
+            self.thread.start()
+            return True
+
+    def _checkpoint(self, step, phase, force=False, **values):
+        if self.journal is None:
+            return
+        now = time.monotonic()
+        if force or now - self.last_checkpoint >= ROUTE_CHECKPOINT_SEC:
+            self.journal.checkpoint(step, phase, **values)
+            self.last_checkpoint = now
+
+    def _finish(self, state):
+        self._set_state(state)
+        if self.journal is not None:
+            self.journal.end(state)
+
+    def _run(self, route, resume):
+        shared_data = self.shared_data
+        dis_list, dir_list, dir_value_list = route["dis"], route["dir"], route["dir_value"]
+        total = len(dis_list)
+        first_step = resume["step"] if resume else 0
+        self.distance_done = sum(float(d) for d in dis_list[:first_step])
+        try:
+            if resume:
+                print(f"[Serial] === Route execution resumed at step {first_step + 1}/{total} ===")
+                shared_data.update_route_progress(first_step, total, "Khôi phục hành trình...")
+                if self.journal is not None:
+                    self.journal.reopen()
+            else:
+                print("[Serial] === Route execution started ===")
+                shared_data.update_route_progress(0, total, "Bắt đầu hành trình...")
+                if self.journal is not None:
+                    self.journal.begin(route)
+
+            # Cổng điều khiển do serial core quản lý (dùng chung với emergency monitor)
+            ser = serial_core.open_port(self.port, self.baudrate)
+            if not ser.wait_connected(SERIAL_TIMEOUT_SEC):
+                raise RuntimeError(f"Control port {self.port} not connected")
+
+            for i in range(first_step, total):
+                # Kiểm tra nếu bị dừng
+                if shared_data.get_route_state()["stopped"]:
+                    print("[Serial] Route stopped by user")
+                    ser.write(b'S')  # Gửi lệnh dừng
+                    shared_data.update_route_progress(i, total, "Đã dừng")
+                    self._finish(ROUTE_STOPPED)
+                    return
+
+                distance = float(dis_list[i])
+                direction = int(dir_list[i])
+                angle = float(dir_value_list[i])
+                print(f"[Serial] Step {i+1}/{total}: dis={distance:.2f}, dir={direction}, angle={angle:.2f}")
+
+                # Pha đi thẳng (bỏ qua nếu journal cho biết đoạn này đã đi xong, đang quay dở)
+                turn_resume = None
+                if resume and i == first_step and resume["phase"] == "turn":
+                    turn_resume = (resume["turned"], resume["yaw"])
+                    self.distance_done += distance
+                else:
+                    done = resume["done"] if resume and i == first_step else 0.0
+                    outcome = self._drive_leg(ser, i, total, distance, done)
+                    if outcome != "ok":
+                        self._finish(outcome)
+                        return
+
+                # Pha quay
+                if direction != 0:
+                    outcome = self._turn_leg(ser, i, total, direction, angle, turn_resume)
+                    if outcome != "ok":
+                        self._finish(outcome)
+                        return
+                else:
+                    print(f"[Serial] No turn needed (final destination or straight path)")
+                self._checkpoint(i + 1, "drive", force=True, done=0.0)
+
+            # Kết thúc hành trình
+            ser.write(b'S')  # Dừng xe
+            shared_data.set_route_state(running=False)
+            shared_data.update_route_progress(total, total, "Hoàn thành hành trình!")
+            self._finish(ROUTE_FINISHED)
+            print("[Serial] === Route execution finished ===")
+
+        except Exception as e:
+            print(f"[Serial] Route execution error: {e}")
+            self.last_error = str(e)
+            self._set_state(ROUTE_FAILED)
+            if self.journal is not None:
+                self.journal.close()
+                # Vẫn giữ hành trình dở để khôi phục
+                self.pending = self.journal.load()
+            shared_data.set_route_state(running=False, stopped=True)
+            shared_data.update_route_progress(0, 0, f"Lỗi: {str(e)}")
+        finally:
+            shared_data.set_motion(None)
+
+    def _drive_leg(self, ser, i, total, distance, done):
+        """
+        Đi thẳng phần còn lại của đoạn i (đã đi done mét).
+        Trả về 'ok', ROUTE_STOPPED hoặc ROUTE_ABORTED
+        """
+        shared_data = self.shared_data
+        self._set_state(ROUTE_DRIVING)
+        shared_data.update_route_progress(i+1, total, f"Đi thẳng", distance - done)
+        shared_data.set_motion('T')
+        ser.write(b'T')
+        print(f"[Serial] Send: T (forward {distance - done:.2f}m of {distance:.2f}m)")
+        # Đọc TIME_PER_METER_SEC runtime (áp dụng cho từng đoạn mới)
+        total_time = settings.current["TIME_PER_METER_SEC"] * distance
+        elapsed = total_time * done / distance if distance > 0 else 0
+        interval = 0.1  # gửi lệnh mỗi 0.1s
+        avoid_attempts = 0
+        base = self.distance_done
+        self._checkpoint(i, "drive", force=True, done=round(done, 3))
+
+        while elapsed < total_time:
+            # Kiểm tra pause
+            while shared_data.get_route_state()["paused"]:
+                self._set_state(ROUTE_PAUSED)
+                ser.write(b'S')  # Dừng xe
+                shared_data.update_route_progress(i+1, total, "Đang tạm dừng...", distance * (1 - elapsed/total_time))
+                sleep(0.1)
+            self._set_state(ROUTE_DRIVING)
+
+            # Kiểm tra LIDAR obstacle (vật cản < 400mm phía trước)
+            lidar_status = shared_data.get_lidar_obstacle()
+            if lidar_status["detected"]:
+                self._set_state(ROUTE_OBSTACLE)
+                self.obstacle_stops += 1
+                print(f"[Serial] ⚠️ LIDAR OBSTACLE DETECTED! Distance: {lidar_status['min_distance']:.0f}mm - STOPPING")
+                shared_data.update_route_progress(i+1, total,
+                    f"⚠️ Phát hiện vật cản {lidar_status['min_distance']:.0f}mm - Tạm dừng",
+                    distance * (1 - elapsed/total_time))
+
+                # Vòng tránh bằng LIDAR (giới hạn số lần trên mỗi đoạn)
+                outcome = None
+                if AVOID_ENABLED and self.lidar is not None and avoid_attempts < AVOID_MAX_ATTEMPTS:
+                    avoid_attempts += 1
+                    self._set_state(ROUTE_AVOIDING)
+                    remaining_distance = distance * (1 - elapsed/total_time)
+                    outcome, progress = avoid_obstacle(
+                        ser, shared_data, self.lidar,
+                        lambda text: shared_data.update_route_progress(i+1, total, text, remaining_distance))
+                    shared_data.set_motion('T')
+                    if outcome == "stopped":
+                        shared_data.update_route_progress(i+1, total, "Đã dừng")
+                        print("[Serial] Route stopped during obstacle bypass")
+                        return ROUTE_STOPPED
+                    # Trừ phần đường đã đi được trong lúc vòng tránh
+                    elapsed = min(total_time, elapsed + progress * total_time / distance)
+                    self._checkpoint(i, "drive", force=True, done=round(distance * elapsed / total_time, 3))
+
+                if outcome not in ("cleared", "bypassed"):
+                    if AVOID_ENABLED and AVOID_FALLBACK == "abort":
+                        ser.write(b'S')
+                        shared_data.set_route_state(running=False, stopped=True)
+                        shared_data.update_route_progress(i+1, total, "⚠️ Không tránh được vật cản - Hủy hành trình")
+                        print("[Serial] Obstacle bypass failed - route aborted")
+                        return ROUTE_ABORTED
+                    # Chờ cho đến khi vật cản được di chuyển - GỬI 'S' LIÊN TỤC
+                    self._set_state(ROUTE_OBSTACLE)
+                    lidar_status = shared_data.get_lidar_obstacle()
+                    while lidar_status["detected"]:
+                        ser.write(b'S')  # Gửi lệnh dừng liên tục
+                        if shared_data.get_route_state()["stopped"]:
+                            print("[Serial] Route stopped during LIDAR obstacle wait")
+                            return ROUTE_STOPPED
+                        sleep(0.1)
+                        lidar_status = shared_data.get_lidar_obstacle()
+
+                print(f"[Serial] LIDAR obstacle cleared - Resuming movement")
+                self._set_state(ROUTE_DRIVING)
+                shared_data.update_route_progress(i+1, total, "Tiếp tục di chuyển", distance * (1 - elapsed/total_time))
+
+            # Kiểm tra stop
+            if shared_data.get_route_state()["stopped"]:
+                ser.write(b'S')
+                shared_data.update_route_progress(i+1, total, "Đã dừng")
+                print("[Serial] Route stopped during movement")
+                return ROUTE_STOPPED
+
+            ser.write(b'T')
+            remaining_distance = distance * (1 - elapsed/total_time)
+            shared_data.update_route_progress(i+1, total, f"Đi thẳng", remaining_distance)
+            sleep(interval)
+            elapsed += interval
+            self.distance_done = base + distance * min(elapsed / total_time, 1.0)
+            self._checkpoint(i, "drive", done=round(self.distance_done - base, 3))
+
+        self.distance_done = base + distance
+        shared_data.update_route_progress(i+1, total, f"Đã đi xong {distance:.2f}m", 0)
+        return "ok"
+
+    def _turn_leg(self, ser, i, total, direction, angle, resume=None):
+        """
+        Quay tại chỗ angle độ cuối đoạn i (direction -1 trái, 1 phải). Góc đã quay được cộng dồn
+        từ độ lệch yaw giữa 2 lần đọc liên tiếp (quay được cả 180° mà không bị vòng ±180).
+        resume = (số độ đã quay, yaw lúc checkpoint) lấy từ journal khi khôi phục giữa lúc quay.
+        Trả về 'ok' hoặc ROUTE_STOPPED
+        """
+        shared_data = self.shared_data
+        # Kiểm tra stop trước khi quay
+        if shared_data.get_route_state()["stopped"]:
+            ser.write(b'S')
+            shared_data.update_route_progress(i+1, total, "Đã dừng")
+            return ROUTE_STOPPED
+
+        self._set_state(ROUTE_TURNING)
+        turn_direction = "trái" if direction == -1 else "phải"
+        shared_data.update_route_progress(i+1, total, f"Quay {turn_direction} {angle:.2f}°")
+
+        # Quay trái/phải - gửi 'L' hoặc 'R' liên tục
+        cmd = b'L' if direction == -1 else b'R'
+        shared_data.set_motion(cmd.decode())
+        print(f"[Serial] Send: {cmd.decode()} (turn {angle:.2f}°)")
+
+        # Đọc giá trị yaw hiện tại
+        turned, prev_yaw = resume if resume is not None else (0.0, None)
+        if prev_yaw is None:
+            prev_yaw = shared_data.snapshot().get("yaw", 0.0)
+        start_yaw = prev_yaw
+        self._checkpoint(i, "turn", force=True, turned=round(turned, 2), yaw=prev_yaw)
+        remaining = angle - turned
+        target_yaw = start_yaw + remaining if direction == -1 else start_yaw - remaining
+
+        # Xử lý góc quay tròn
+        if target_yaw < 0:
+            target_yaw += 360
+        elif target_yaw >= 360:
+            target_yaw -= 360
+
+        print(f"[Serial] Start yaw: {start_yaw:.2f}°, Target yaw: {target_yaw:.2f}°, Need to turn: {remaining:.2f}°")
+
+        while True:
+            # Kiểm tra pause
+            while shared_data.get_route_state()["paused"]:
+                self._set_state(ROUTE_PAUSED)
+                ser.write(b'S')
+                shared_data.update_route_progress(i+1, total, "Đang tạm dừng...")
+                sleep(0.1)
+            self._set_state(ROUTE_TURNING)
+
+            # Kiểm tra LIDAR obstacle (vật cản trong vòng quét thân xe)
+            lidar_status = shared_data.get_lidar_obstacle()
+            if lidar_status["detected"]:
+                self._set_state(ROUTE_OBSTACLE)
+                self.obstacle_stops += 1
+                print(f"[Serial] ⚠️ LIDAR OBSTACLE DETECTED during turn! Distance: {lidar_status['min_distance']:.0f}mm - STOPPING")
+                shared_data.update_route_progress(i+1, total,
+                    f"⚠️ Phát hiện vật cản {lidar_status['min_distance']:.0f}mm - Tạm dừng",
+                    0)
+
+                # Chờ cho đến khi vật cản được di chuyển - GỬI 'S' LIÊN TỤC
+                while lidar_status["detected"]:
+                    ser.write(b'S')  # Gửi lệnh dừng liên tục
+                    if shared_data.get_route_state()["stopped"]:
+                        print("[Serial] Route stopped during LIDAR obstacle wait (turn)")
+                        return ROUTE_STOPPED
+                    sleep(0.1)
+                    lidar_status = shared_data.get_lidar_obstacle()
+
+                print(f"[Serial] LIDAR obstacle cleared - Resuming turn")
+                self._set_state(ROUTE_TURNING)
+                shared_data.update_route_progress(i+1, total, f"Tiếp tục quay {turn_direction}", 0)
+
+            # Kiểm tra stop
+            if shared_data.get_route_state()["stopped"]:
+                ser.write(b'S')
+                shared_data.update_route_progress(i+1, total, "Đã dừng")
+                return ROUTE_STOPPED
+
+            current_yaw = shared_data.snapshot().get("yaw", 0.0)
+
+            # Cộng dồn góc đã quay (trái: yaw tăng, phải: yaw giảm); mỗi lần đọc chỉ lệch vài độ
+            # nên độ lệch vòng về [-180, 180) luôn đúng, kể cả khi tổng góc quay tới 180° hoặc hơn
+            turned += -direction * _yaw_delta(prev_yaw, current_yaw)
+            prev_yaw = current_yaw
+            diff = turned
+            self._checkpoint(i, "turn", turned=round(turned, 2), yaw=current_yaw)
+
+            remaining_angle = angle - diff
+            shared_data.update_route_progress(i+1, total, f"Quay {turn_direction} (còn {remaining_angle:.1f}°)")
+
+            print(f"[Serial] Start: {start_yaw:.2f}°, Current: {current_yaw:.2f}°, Target: {target_yaw:.2f}°, Turned: {diff:.2f}°/{angle:.2f}°")
+
+            if diff >= angle:
+                print(f"[Serial] Done turn {angle:.2f}° (yaw={current_yaw:.2f})")
+                shared_data.update_route_progress(i+1, total, f"Đã quay xong {angle:.2f}°")
+                return "ok"
+
+            ser.write(cmd)  # gửi lệnh quay liên tục
+            sleep(0.05)
+
+    def discard(self):
+        """Bỏ hành trình dở trong journal (không khôi phục)"""
+        with self.lock:
+            if self.is_running() or self.pending is None:
+                return False
+            if self.journal is not None:
+                self.journal.begin(self.pending["route"])
+                self.journal.end(ROUTE_STOPPED)
+            self.pending = None
+            self._set_state(ROUTE_IDLE)
+            return True
+
+    def status(self):
+        pending = self.pending
+        return {
+            "state": self.state,
+            "state_since": self.state_since,
+            "running": self.is_running(),
+            "last_error": self.last_error,
+            "distance_done": round(self.distance_done, 2),
+            "obstacle_stops": self.obstacle_stops,
+            "journal_records": self.journal.records if self.journal is not None else 0,
+            "resumable": None if pending is None else {
+                "step": pending["step"] + 1,
+                "total_steps": len(pending["route"]["dis"]),
+                "phase": pending["phase"],
+                "done": pending["done"],
+                "t": pending["t"]
+            }
+        }
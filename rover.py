@@ -0,0 +1,102 @@
+import os
+import threading
+
+from config import ROVERS, DEFAULT_ROVER, TRACK_DIR, ROUTE_JOURNAL_DIR, SIM_ENABLED
+from Read_Serial import SerialData
+from route_executor import RouteExecutor
+from missions import MissionScheduler, mission_store
+from Read_lidar import LidarDevice
+from detect_stream import get_camera_session, camera_openers
+from gps_track import TrackHistory
+from occupancy_grid import OccupancyGrid
+
+
+class RoverSession:
+    """
+    Toàn bộ trạng thái của 1 rover: dữ liệu GPS/route (SerialData), route executor, LIDAR,
+    camera, occupancy grid và lịch sử đường đi. Mỗi rover có lock, coroutine và thread riêng nên nhiều
+    rover trên cùng server không tranh chấp lock của nhau; tài nguyên tăng tuyến tính
+    theo số rover.
+    """
+    def __init__(self, rover_id, cfg):
+        self.id = rover_id
+        self.gps_port = cfg["gps_port"]
+        self.gps_baud = cfg["gps_baud"]
+        self.control_port = cfg["control_port"]
+        self.control_baud = cfg["control_baud"]
+        self.shared_data = SerialData()
+        self.lidar = LidarDevice(rover_id, cfg["lidar_port"], cfg["lidar_baud"])
+        self.camera = get_camera_session(rover_id, cfg.get("camera", 0))
+        self.camera.is_stationary = self.is_stationary
+        # Rover mặc định giữ thư mục track cũ, rover khác ghi vào thư mục con riêng
+        track_dir = TRACK_DIR if rover_id == DEFAULT_ROVER else os.path.join(TRACK_DIR, rover_id)
+        self.track = TrackHistory(directory=track_dir)
+        self.grid = OccupancyGrid()
+        journal = os.path.join(ROUTE_JOURNAL_DIR, f"{rover_id}.jsonl") if ROUTE_JOURNAL_DIR else None
+        self.route = RouteExecutor(rover_id, self.shared_data, self.control_port, self.control_baud,
+                                   self.lidar, journal)
+        self.missions = MissionScheduler(self, mission_store)
+        self.threads = {}
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def is_stationary(self):
+        """Xe đang đứng yên: không chạy route, tạm dừng, đã dừng hoặc đang chờ vật cản"""
+        state = self.shared_data.get_route_state()
+        if not state["running"] or state["paused"] or state["stopped"]:
+            return True
+        return self.shared_data.get_lidar_obstacle()["detected"]
+
+    def start_tasks(self, core, coroutines):
+        """
+        Chạy các coroutine giám sát của rover trên serial core đúng 1 lần.
+        coroutines: {tên: hàm async(rover)}
+        """
+        with self.lock:
+            if self.tasks:
+                return False
+            for name, coroutine in coroutines.items():
+                self.tasks[name] = core.spawn(coroutine(self))
+            return True
+
+    def start_threads(self, targets):
+        """
+        Khởi động các thread nền của rover đúng 1 lần.
+        targets: {tên: hàm(rover)}; thread được đặt tên "<tên>:<rover_id>"
+        """
+        with self.lock:
+            if self.threads:
+                return False
+            for name, target in targets.items():
+                self.threads[name] = threading.Thread(
+                    target=target, args=(self,), name=f"{name}:{self.id}", daemon=True)
+            for thread in self.threads.values():
+                thread.start()
+            return True
+
+    def status(self):
+        return {
+            "id": self.id,
+            "gps_port": self.gps_port,
+            "control_port": self.control_port,
+            "lidar_port": self.lidar.port,
+            "lidar_connected": self.lidar.connected,
+            "camera": self.camera.source,
+            "route": {**self.shared_data.get_route_state(), **self.route.status()},
+            "missions": self.missions.status(),
+            "threads": {name: t.is_alive() for name, t in self.threads.items()},
+            "tasks": {name: not f.done() for name, f in self.tasks.items()}
+        }
+
+
+def rover_configs():
+    """Cấu hình rover: ROVERS trong config.py, hoặc các rover ảo khi SIM_ENABLED"""
+    if not SIM_ENABLED:
+        return ROVERS
+    from simulator import simulator
+    camera_openers["sim"] = simulator.open_camera
+    return simulator.rover_configs()
+
+
+# Global instance
+rovers = {rover_id: RoverSession(rover_id, cfg) for rover_id, cfg in rover_configs().items()}
@@ -0,0 +1,394 @@
+import asyncio
+import threading
+import time
+
+import serial
+import serial.tools.list_ports
+
+from config import (SERIAL_BACKOFF_MIN_SEC, SERIAL_BACKOFF_MAX_SEC, SERIAL_POLL_SEC, SERIAL_TIMEOUT_SEC,
+                    SERIAL_SCAN_SEC, SERIAL_WRITE_BUFFER_MAX)
+
+
+def import_pyudev():
+    """pyudev (Linux) cho phép nhận sự kiện cắm/rút USB thay vì quét định kỳ; không bắt buộc"""
+    try:
+        import pyudev
+        return pyudev
+    except ImportError:
+        return None
+
+
+def parse_port_spec(spec):
+    """
+    Cổng khai báo theo USB thay vì tên thiết bị (tên đổi sau khi cắm lại):
+    "usb:VID:PID" hoặc "usb:VID:PID:SERIAL" (VID/PID hex), "sn:SERIAL".
+    Trả về dict điều kiện, hoặc None nếu spec là tên cổng thường ("COM6", "/dev/ttyUSB0").
+    """
+    parts = spec.split(":")
+    if parts[0] == "usb" and len(parts) in (3, 4):
+        match = {"vid": int(parts[1], 16), "pid": int(parts[2], 16)}
+        if len(parts) == 4:
+            match["serial_number"] = parts[3]
+        return match
+    if parts[0] == "sn" and len(parts) == 2:
+        return {"serial_number": parts[1]}
+    return None
+
+
+def find_device(match, ports):
+    """Tên thiết bị đầu tiên trong ports (ListPortInfo) thỏa điều kiện match, hoặc None"""
+    for info in ports:
+        if all(getattr(info, key) == value for key, value in match.items()):
+            return info.device
+    return None
+
+
+class SerialPort:
+    """
+    1 cổng serial do SerialCore quản lý:
+    - Đọc không chặn: đăng ký fd với event loop (loop.add_reader) nên chỉ thức dậy khi có byte;
+      nền tảng không hỗ trợ (Windows) thì poll mỗi SERIAL_POLL_SEC trong cùng event loop
+    - Mất kết nối -> tự mở lại với backoff lũy thừa (SERIAL_BACKOFF_MIN_SEC..MAX_SEC)
+    - write() gọi được từ mọi thread (chuyển vào event loop). Ghi không chặn: phần chưa gửi
+      được nằm trong bộ đệm, gửi tiếp khi fd ghi được (loop.add_writer) hoặc ở lượt poll sau;
+      bộ đệm không vơi trong SERIAL_TIMEOUT_SEC -> coi như mất kết nối
+    """
+    def __init__(self, core, spec, baudrate):
+        self.core = core
+        self.spec = spec
+        self.match = parse_port_spec(spec)
+        self.port = None if self.match is not None else spec  # Tên thiết bị hiện tại
+        self.baudrate = baudrate
+        self.listeners = []
+        self.ser = None
+        self.connected = False
+        self.connected_event = threading.Event()
+        self.future = None   # concurrent.futures.Future của coroutine run()
+        self.lost = None     # asyncio.Future: hoàn tất khi cổng bị mất
+        self.mode = None     # "fd" | "poll"
+        self.state = "starting"  # starting | waiting_device | backoff | connected
+        self.wake = None     # asyncio.Event: supervisor đánh thức khi thiết bị xuất hiện lại
+        self.connected_since = None
+        self.last_lost = None
+        self.reconnects = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped_writes = 0
+        self.last_error = None
+        self.out_buffer = bytearray()
+        self.writing = False       # Đang chờ fd ghi được (add_writer)
+        self.write_stalled_since = None
+
+    def add_listener(self, callback):
+        """callback(bytes) được gọi trong thread event loop mỗi khi đọc được dữ liệu"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    async def _sleep(self, delay):
+        """Ngủ tối đa delay giây; supervisor đánh thức sớm khi thiết bị được cắm lại"""
+        try:
+            await asyncio.wait_for(self.wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self.wake.clear()
+
+    async def run(self):
+        self.wake = asyncio.Event()
+        delay = SERIAL_BACKOFF_MIN_SEC
+        while True:
+            if self.match is not None:
+                # Tìm lại tên thiết bị theo VID/PID/serial (có thể đã đổi sau khi cắm lại)
+                self.port = find_device(self.match, self.core.devices)
+                if self.port is None:
+                    self.state = "waiting_device"
+                    await self._sleep(SERIAL_BACKOFF_MAX_SEC)
+                    continue
+            try:
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=0, write_timeout=0)
+            except (serial.SerialException, OSError, ValueError) as e:
+                self.last_error = str(e)
+                self.state = "backoff"
+                print(f"[SerialCore] {self.spec} open failed: {e}. Retry in {delay:.1f}s")
+                await self._sleep(delay)
+                delay = min(delay * 2, SERIAL_BACKOFF_MAX_SEC)
+                continue
+
+            delay = SERIAL_BACKOFF_MIN_SEC
+            self.lost = self.core.loop.create_future()
+            watching = self._watch_fd()
+            self.connected = True
+            self.connected_since = time.time()
+            self.state = "connected"
+            self.connected_event.set()
+            print(f"[SerialCore] {self.spec} connected on {self.port} @ {self.baudrate} ({self.mode})")
+            try:
+                if watching:
+                    await self.lost
+                else:
+                    while not self.lost.done():
+                        self._on_readable()
+                        if self.out_buffer:
+                            self._flush()
+                        await asyncio.sleep(SERIAL_POLL_SEC)
+            finally:
+                if self.mode == "fd":
+                    self.core.loop.remove_reader(self.ser.fileno())
+                    if self.writing:
+                        self.core.loop.remove_writer(self.ser.fileno())
+                self.writing = False
+                # Lệnh chưa gửi kịp thuộc về kết nối cũ -> bỏ
+                if self.out_buffer:
+                    self.dropped_writes += 1
+                    self.out_buffer.clear()
+                self.write_stalled_since = None
+                self.connected = False
+                self.connected_event.clear()
+                self.last_lost = time.time()
+                try:
+                    self.ser.close()
+                except Exception:
+                    pass
+                self.ser = None
+            self.reconnects += 1
+            self.state = "backoff"
+            print(f"[SerialCore] {self.spec} lost. Reconnecting in {delay:.1f}s...")
+            await self._sleep(delay)
+
+    def _watch_fd(self):
+        """Đăng ký fd với event loop; False nếu nền tảng không hỗ trợ"""
+        try:
+            self.core.loop.add_reader(self.ser.fileno(), self._on_readable)
+            self.mode = "fd"
+            return True
+        except (NotImplementedError, AttributeError, ValueError, OSError):
+            self.mode = "poll"
+            return False
+
+    def _on_readable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self._drop(e)
+            return
+        if not data:
+            return
+        self.bytes_in += len(data)
+        for callback in self.listeners:
+            try:
+                callback(data)
+            except Exception as e:
+                print(f"[SerialCore] {self.spec} listener error: {e}")
+
+    def _drop(self, error):
+        self.last_error = str(error)
+        print(f"[SerialCore] {self.spec} error: {error}")
+        if self.lost is not None and not self.lost.done():
+            self.lost.set_result(None)
+
+    def _write(self, data):
+        if self.ser is None or len(self.out_buffer) + len(data) > SERIAL_WRITE_BUFFER_MAX:
+            self.dropped_writes += 1
+            return
+        self.out_buffer += data
+        if not self.writing:
+            self._flush()
+        elif time.time() - self.write_stalled_since > SERIAL_TIMEOUT_SEC:
+            # fd không ghi được từ lâu (thiết bị treo) -> kết nối lại
+            self.dropped_writes += 1
+            self._drop(serial.SerialTimeoutException("Write timeout"))
+
+    def _flush(self):
+        """Gửi phần đầu bộ đệm mà driver nhận ngay (write_timeout=0 không chặn event loop)"""
+        try:
+            sent = self.ser.write(bytes(self.out_buffer)) or 0
+        except (serial.SerialException, OSError) as e:
+            self.dropped_writes += 1
+            self._drop(e)
+            return
+        del self.out_buffer[:sent]
+        self.bytes_out += sent
+        now = time.time()
+        if not self.out_buffer:
+            self.write_stalled_since = None
+        elif sent or self.write_stalled_since is None:
+            self.write_stalled_since = now
+        elif now - self.write_stalled_since > SERIAL_TIMEOUT_SEC:
+            self.dropped_writes += 1
+            self._drop(serial.SerialTimeoutException("Write timeout"))
+            return
+        if self.mode != "fd":
+            return
+        # Còn dữ liệu -> chờ fd ghi được; hết -> bỏ đăng ký
+        if self.out_buffer and not self.writing:
+            self.core.loop.add_writer(self.ser.fileno(), self._flush)
+            self.writing = True
+        elif not self.out_buffer and self.writing:
+            self.core.loop.remove_writer(self.ser.fileno())
+            self.writing = False
+
+    def write(self, data):
+        """Gửi dữ liệu (không chặn, gọi được từ mọi thread). Bị bỏ nếu cổng đang mất kết nối."""
+        self.core.loop.call_soon_threadsafe(self._write, data)
+
+    def wait_connected(self, timeout=None):
+        return self.connected_event.wait(timeout)
+
+    def stats(self):
+        now = time.time()
+        return {
+            "spec": self.spec,
+            "port": self.port,
+            "baudrate": self.baudrate,
+            "connected": self.connected,
+            "state": self.state,
+            "uptime_sec": round(now - self.connected_since, 1) if self.connected else 0.0,
+            "down_sec": round(now - self.last_lost, 1) if not self.connected and self.last_lost else None,
+            "mode": self.mode,
+            "reconnects": self.reconnects,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "dropped_writes": self.dropped_writes,
+            "write_buffered": len(self.out_buffer),
+            "last_error": self.last_error
+        }
+
+
+class SerialCore:
+    """
+    1 event loop asyncio (1 thread "serial_core") sở hữu mọi cổng serial của server
+    và chạy các coroutine giám sát/gửi lệnh, thay cho 1 thread chặn cho mỗi cổng.
+    Supervisor theo dõi danh sách thiết bị (sự kiện udev nếu có pyudev, nếu không thì
+    quét mỗi SERIAL_SCAN_SEC): thiết bị cắm lại -> đánh thức cổng đang chờ ngay,
+    thiết bị bị rút -> đóng cổng để mở lại khi xuất hiện.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.ports = {}
+        self.devices = []     # ListPortInfo lần quét gần nhất
+        self.device_scans = 0
+        self.hotplug = None   # "udev" | "poll"
+        self.started_at = None
+
+    def start(self):
+        """Khởi động event loop (gọi nhiều lần không sao)"""
+        with self.lock:
+            if self.loop is not None:
+                return False
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="serial_core", daemon=True)
+            self.thread.start()
+            self.started_at = time.time()
+            asyncio.run_coroutine_threadsafe(self._supervise(), self.loop)
+            print("[SerialCore] Event loop started")
+            return True
+
+    async def _scan_devices(self):
+        """Quét lại danh sách cổng (comports() đọc sysfs -> chạy ngoài event loop)"""
+        devices = await self.loop.run_in_executor(None, serial.tools.list_ports.comports)
+        self.device_scans += 1
+        before = {info.device for info in self.devices}
+        after = {info.device for info in devices}
+        self.devices = devices
+        if before == after:
+            return
+        with self.lock:
+            handles = list(self.ports.values())
+        for handle in handles:
+            if handle.connected:
+                # Thiết bị biến mất khỏi danh sách -> coi như mất kết nối
+                if handle.port in before and handle.port not in after:
+                    handle._drop("device removed")
+            elif handle.wake is not None:
+                present = (find_device(handle.match, devices) if handle.match is not None
+                           else handle.spec if handle.spec in after else None)
+                if present is not None:
+                    print(f"[SerialCore] {handle.spec} plugged in as {present}")
+                    handle.wake.set()
+
+    async def _supervise(self):
+        """Theo dõi cắm/rút thiết bị serial"""
+        await self._scan_devices()
+        pyudev = import_pyudev()
+        if pyudev is not None:
+            try:
+                monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                monitor.filter_by("tty")
+                monitor.start()
+                changed = asyncio.Event()
+
+                def on_event():
+                    while monitor.poll(timeout=0) is not None:
+                        pass
+                    changed.set()
+
+                self.loop.add_reader(monitor.fileno(), on_event)
+                self.hotplug = "udev"
+                while True:
+                    await changed.wait()
+                    changed.clear()
+                    # Chờ node /dev và thông tin sysfs sẵn sàng
+                    await asyncio.sleep(0.1)
+                    await self._scan_devices()
+            except Exception as e:
+                print(f"[SerialCore] udev monitor unavailable ({e}), polling devices")
+        self.hotplug = "poll"
+        while True:
+            await asyncio.sleep(SERIAL_SCAN_SEC)
+            try:
+                await self._scan_devices()
+            except Exception as e:
+                print(f"[SerialCore] Device scan error: {e}")
+
+    def open_port(self, port, baudrate, on_data=None):
+        """
+        Lấy cổng (mở nếu chưa có). Nhiều thành phần dùng chung 1 cổng thì dùng chung
+        1 handle (ví dụ route executor và emergency monitor cùng cổng điều khiển).
+        """
+        self.start()
+        with self.lock:
+            handle = self.ports.get(port)
+            if handle is None:
+                handle = SerialPort(self, port, baudrate)
+                self.ports[port] = handle
+                handle.future = asyncio.run_coroutine_threadsafe(handle.run(), self.loop)
+        if on_data is not None:
+            handle.add_listener(on_data)
+        return handle
+
+    def close_port(self, port):
+        """Đóng cổng và dừng tự kết nối lại"""
+        with self.lock:
+            handle = self.ports.pop(port, None)
+        if handle is not None and handle.future is not None:
+            handle.future.cancel()
+        return handle is not None
+
+    def spawn(self, coro):
+        """Chạy coroutine trên event loop, trả về concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stats(self):
+        with self.lock:
+            ports = list(self.ports.values())
+        return {
+            "running": self.loop is not None and self.loop.is_running(),
+            "uptime_sec": round(time.time() - self.started_at, 1) if self.started_at else 0.0,
+            "tasks": len(asyncio.all_tasks(self.loop)) if self.loop is not None else 0,
+            "hotplug": self.hotplug,
+            "device_scans": self.device_scans,
+            "devices": [{"device": d.device, "vid": f"{d.vid:04x}" if d.vid is not None else None,
+                         "pid": f"{d.pid:04x}" if d.pid is not None else None,
+                         "serial_number": d.serial_number} for d in self.devices],
+            "ports": [p.stats() for p in ports]
+        }
+
+
+# Global instance
+serial_core = SerialCore()
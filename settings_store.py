@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+from types import MappingProxyType
+
+import config
+
+SETTINGS_FILE = "settings.json"
+
+# Schema: key -> (kiểu, min, max). Giá trị mặc định lấy từ config.py
+SETTINGS_SCHEMA = {
+    "TIME_PER_METER_SEC": (float, 0.01, 60.0),
+    "LIDAR_MAX_POINTS": (int, 10, 100000),
+    "LIDAR_DOT_LIFETIME": (float, 0.05, 60.0),
+    "LIDAR_OBSTACLE_DISTANCE": (int, 0, 20000),
+    "LIDAR_DETECTION_ANGLE_MIN": (int, -180, 360),
+    "LIDAR_DETECTION_ANGLE_MAX": (int, -180, 360),
+}
+
+
+def default_settings():
+    """Giá trị mặc định từ config.py"""
+    return {key: getattr(config, key) for key in SETTINGS_SCHEMA}
+
+
+def validate_settings(values):
+    """Ép kiểu + kiểm tra giới hạn. Raise ValueError nếu không hợp lệ"""
+    result = {}
+    for key, value in values.items():
+        if key not in SETTINGS_SCHEMA:
+            raise ValueError(f"Unknown setting: {key}")
+        cast, lo, hi = SETTINGS_SCHEMA[key]
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be {cast.__name__}, got {value!r}")
+        if not lo <= value <= hi:
+            raise ValueError(f"{key}={value} out of range [{lo}, {hi}]")
+        result[key] = value
+    return result
+
+
+class SettingsSnapshot:
+    """Bản chụp settings bất biến, có số version. Đọc không cần lock."""
+    __slots__ = ("values", "version")
+
+    def __init__(self, values, version):
+        self.values = MappingProxyType(dict(values))
+        self.version = version
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def to_dict(self):
+        return dict(self.values)
+
+
+class SettingsStore:
+    """
+    Kho settings runtime:
+    - `current` là snapshot bất biến, thay thế nguyên khối khi cập nhật
+      (đọc là 1 phép gán tham chiếu, không lock)
+    - subscribe(callback) nhận (old, new) mỗi khi settings thay đổi
+    - save() ghi settings.json nguyên tử ngay (báo lỗi cho người gọi)
+    """
+    def __init__(self, path=SETTINGS_FILE):
+        self.path = path
+        self.write_lock = threading.Lock()
+        # Lấy trước write_lock, giữ tới khi gọi xong subscriber -> subscriber nhận các
+        # version theo đúng thứ tự (RLock: subscriber được phép gọi update())
+        self.notify_lock = threading.RLock()
+        self.current = SettingsSnapshot(default_settings(), 0)
+        self.subscribers = []
+        # 2 request save() đồng thời không ghi chồng nhau, không ghi đè bản mới bằng bản cũ
+        self.file_lock = threading.Lock()
+        self.saved_version = -1
+
+    def get(self, key):
+        return self.current.get(key)
+
+    def subscribe(self, callback, call_now=True):
+        """Đăng ký callback(old, new); gọi ngay với snapshot hiện tại nếu call_now"""
+        with self.notify_lock:
+            with self.write_lock:
+                self.subscribers.append(callback)
+                snap = self.current
+            if call_now:
+                callback(None, snap)
+
+    def update(self, values):
+        """Validate rồi áp dụng nguyên khối. Trả về snapshot mới"""
+        values = validate_settings(values)
+        with self.notify_lock:
+            with self.write_lock:
+                old = self.current
+                merged = old.to_dict()
+                merged.update(values)
+                if merged["LIDAR_DETECTION_ANGLE_MIN"] > merged["LIDAR_DETECTION_ANGLE_MAX"]:
+                    raise ValueError("LIDAR_DETECTION_ANGLE_MIN must be <= LIDAR_DETECTION_ANGLE_MAX")
+                new = SettingsSnapshot(merged, old.version + 1)
+                self.current = new
+                subscribers = list(self.subscribers)
+            for callback in subscribers:
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    print(f"[Settings] Subscriber error: {e}")
+        return new
+
+    def reset(self):
+        """Về mặc định config.py"""
+        return self.update(default_settings())
+
+    def load(self):
+        """Load settings từ settings.json nếu tồn tại"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                # Bỏ qua key lạ trong file cũ thay vì fail cả file
+                loaded = {k: v for k, v in loaded.items() if k in SETTINGS_SCHEMA}
+                self.update(loaded)
+                print(f"[Settings] Loaded from {self.path}: {self.current.to_dict()}")
+            else:
+                print(f"[Settings] No {self.path} found, using config.py defaults")
+        except Exception as e:
+            print(f"[Settings] Error loading {self.path}: {e}")
+
+    def _write_file(self, snapshot):
+        """Ghi nguyên tử: ghi file tạm rồi os.replace. Bỏ qua nếu đã lưu bản mới hơn"""
+        with self.file_lock:
+            if snapshot.version <= self.saved_version:
+                return False
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot.to_dict(), f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.saved_version = snapshot.version
+            return True
+
+    def save(self):
+        """Ghi snapshot hiện tại ra file ngay (chặn tới khi ghi xong, lỗi ném OSError)"""
+        snapshot = self.current
+        if self._write_file(snapshot):
+            print(f"[Settings] Saved to {self.path} (version {snapshot.version})")
+        return snapshot
+
+
+# Global instance
+settings = SettingsStore()
@@ -0,0 +1,424 @@
+"""
+Mô phỏng rover không cần phần cứng (Linux): mỗi rover ảo có 3 cổng serial ảo (pty)
+- điều khiển: nhận 'T'/'L'/'R'/'S' như Arduino, chuyển động vi sai (differential drive)
+- GPS: phát dòng CSV "yaw,lat,lon,speed" như ESP32
+- LIDAR: ray-cast bản đồ 2D, phát dòng "khoảng_cách góc"
+và 1 camera ảo (nguồn "sim:<rover_id>": vẽ cây trong tầm nhìn hoặc phát lại video).
+Thời gian mô phỏng chạy nhanh hơn thời gian thực SIM_SPEEDUP lần để chạy thử hàng loạt route.
+
+Chạy kèm server: đặt SIM_ENABLED = True trong config.py.
+Chạy riêng (server khác trỏ ROVERS vào các cổng in ra):
+    python simulator.py --rovers 3 --speedup 5 --world world.json
+"""
+import json
+import math
+import os
+import threading
+import time
+import tty
+
+import numpy as np
+
+from config import (SIM_ROVERS, SIM_SPEEDUP, SIM_WORLD, SIM_CAMERA_VIDEO, SIM_CAMERA_FPS, SIM_SPEED_MPS,
+                    SIM_TURN_DPS, SIM_GPS_HZ, SIM_GPS_NOISE_M, SIM_LIDAR_HZ, SIM_LIDAR_RAYS,
+                    SIM_LIDAR_NOISE_MM, SIM_LIDAR_MAX_RANGE_M, SIM_CMD_TIMEOUT_SEC, SIM_STEP_SEC,
+                    DEFAULT_ROVER, ROBOT_WIDTH_M, ROBOT_LENGTH_M, LIDAR_FRONT_OFFSET_M,
+                    LIDAR_ANGLE_CLOCKWISE, MAP_YAW_OFFSET_DEG)
+from occupancy_grid import EARTH_RADIUS_M
+
+# Bản đồ mặc định: ruộng 3 luống cây, vài vật cản, hàng rào 30 x 20 m
+DEFAULT_WORLD = {
+    "origin": [21.0278, 105.8342],
+    "start": [0.0, 0.0, 0.0],
+    "boxes": [[-5.0, -10.0, 25.0, 10.0], [6.0, -0.6, 6.8, 0.6]],
+    "circles": [[12.0, 0.3, 0.35], [15.0, -4.0, 0.5]],
+    "segments": [],
+    "plants": [[x, y, (int(x) * 7 + int(y) * 3) % 5 == 0]
+               for y in (-3.0, 3.0, 6.0) for x in np.arange(1.0, 22.0, 1.5).tolist()]
+}
+
+
+def load_world(path=SIM_WORLD):
+    """Đọc bản đồ JSON (cùng dạng DEFAULT_WORLD), None = bản đồ mặc định"""
+    if not path:
+        return dict(DEFAULT_WORLD)
+    with open(path, "r", encoding="utf-8") as f:
+        world = dict(DEFAULT_WORLD, plants=[], circles=[], boxes=[], segments=[])
+        world.update(json.load(f))
+        return world
+
+
+class SimWorld:
+    """Vật cản tĩnh (đoạn thẳng + hình tròn) và cây trồng, tọa độ mét (x: Đông, y: Bắc)"""
+    def __init__(self, world):
+        self.origin = world["origin"]
+        self.start = world["start"]
+        segments = [list(s) for s in world.get("segments", [])]
+        for box in world.get("boxes", []):
+            x0, y0, x1, y1 = box[:4]
+            segments += [[x0, y0, x1, y0], [x1, y0, x1, y1], [x1, y1, x0, y1], [x0, y1, x0, y0]]
+        self.segments = np.array(segments, dtype=np.float64).reshape(-1, 4)
+        self.circles = np.array(world.get("circles", []), dtype=np.float64).reshape(-1, 3)
+        self.plants = [(float(p[0]), float(p[1]), bool(p[2])) for p in world.get("plants", [])]
+        self.cos_lat0 = math.cos(math.radians(self.origin[0]))
+
+    def to_latlon(self, x, y):
+        """Ngược với occupancy_grid.LocalProjection"""
+        lat = self.origin[0] + math.degrees(y / EARTH_RADIUS_M)
+        lon = self.origin[1] + math.degrees(x / (EARTH_RADIUS_M * self.cos_lat0))
+        return lat, lon
+
+    def raycast(self, ox, oy, directions, max_range, extra_circles=None):
+        """Khoảng cách tới vật gần nhất theo từng hướng (radian), inf nếu không trúng"""
+        dx = np.cos(directions)[:, None]
+        dy = np.sin(directions)[:, None]
+        best = np.full(len(directions), np.inf)
+
+        circles = self.circles if extra_circles is None else np.vstack([self.circles, extra_circles])
+        if len(circles):
+            cx = circles[:, 0] - ox
+            cy = circles[:, 1] - oy
+            b = dx * cx + dy * cy
+            disc = b * b - (cx * cx + cy * cy - circles[:, 2] ** 2)
+            t = b - np.sqrt(np.maximum(disc, 0.0))
+            t = np.where((disc >= 0) & (t > 0), t, np.inf)
+            best = np.minimum(best, t.min(axis=1))
+
+        if len(self.segments):
+            x1, y1, x2, y2 = (self.segments[:, k] for k in range(4))
+            ex, ey = x2 - x1, y2 - y1
+            denom = dx * ey - dy * ex
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = ((x1 - ox) * ey - (y1 - oy) * ex) / denom
+                u = ((x1 - ox) * dy - (y1 - oy) * dx) / denom
+            t = np.where((np.abs(denom) > 1e-12) & (t > 0) & (u >= 0) & (u <= 1), t, np.inf)
+            best = np.minimum(best, t.min(axis=1))
+
+        best[best > max_range] = np.inf
+        return best
+
+    def clearance(self, x, y):
+        """Khoảng cách từ điểm tới vật cản gần nhất"""
+        d = np.inf
+        if len(self.circles):
+            d = min(d, float((np.hypot(self.circles[:, 0] - x, self.circles[:, 1] - y) - self.circles[:, 2]).min()))
+        if len(self.segments):
+            x1, y1, x2, y2 = (self.segments[:, k] for k in range(4))
+            ex, ey = x2 - x1, y2 - y1
+            u = np.clip(((x - x1) * ex + (y - y1) * ey) / np.maximum(ex * ex + ey * ey, 1e-12), 0.0, 1.0)
+            d = min(d, float(np.hypot(x1 + u * ex - x, y1 + u * ey - y).min()))
+        return d
+
+
+class VirtualPort:
+    """1 cổng serial ảo: server mở `path` (pty slave) như cổng thật, simulator đọc/ghi phía master"""
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        # Raw mode để dữ liệu không bị echo / đổi ký tự xuống dòng trước khi server mở cổng
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        self.dropped = 0
+
+    def read(self):
+        try:
+            return os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return b""
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            # Không ai đọc (server chưa mở cổng) -> bỏ như cổng thật
+            self.dropped += 1
+
+
+class SimCamera:
+    """
+    Camera ảo giao diện giống cv2.VideoCapture: phát lại SIM_CAMERA_VIDEO (lặp lại),
+    hoặc vẽ cây trong tầm nhìn 60° của rover (xanh = khỏe, vàng nâu = bệnh)
+    """
+    def __init__(self, rover, fps, width=640, height=480, video=None):
+        import cv2
+        self.cv2 = cv2
+        self.rover = rover
+        self.interval = 1.0 / fps
+        self.width = width
+        self.height = height
+        self.video = cv2.VideoCapture(video) if video else None
+        self.opened = True
+        self.next_frame = time.monotonic()
+
+    def isOpened(self):
+        return self.opened
+
+    def set(self, prop, value):
+        return True
+
+    def release(self):
+        self.opened = False
+        if self.video is not None:
+            self.video.release()
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        # Giữ đúng tốc độ khung hình như camera thật
+        self.next_frame += self.interval
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame = time.monotonic()
+        if self.video is not None:
+            ok, frame = self.video.read()
+            if not ok:
+                self.video.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self.video.read()
+            return ok, frame
+        return True, self.render()
+
+    def render(self):
+        cv2 = self.cv2
+        w, h = self.width, self.height
+        frame = np.empty((h, w, 3), dtype=np.uint8)
+        frame[:h // 2] = (235, 206, 135)   # Trời
+        frame[h // 2:] = (60, 90, 110)     # Đất
+        x, y, theta = self.rover.pose()
+        half_fov = math.radians(30)
+        visible = []
+        for px, py, diseased in self.rover.world.plants:
+            dx, dy = px - x, py - y
+            forward = dx * math.cos(theta) + dy * math.sin(theta)
+            left = -dx * math.sin(theta) + dy * math.cos(theta)
+            if 0.3 < forward < 10.0 and abs(math.atan2(left, forward)) < half_fov:
+                visible.append((forward, left, diseased))
+        # Vẽ cây xa trước, gần sau
+        for forward, left, diseased in sorted(visible, reverse=True):
+            u = int(w / 2 - left / forward / math.tan(half_fov) * w / 2)
+            v = int(h / 2 + h * 0.4 / forward)
+            radius = max(3, int(h * 0.12 / forward))
+            color = (40, 120, 170) if diseased else (40, 170, 40)
+            cv2.circle(frame, (u, v - radius), radius, color, -1)
+        return frame
+
+
+class SimRover:
+    """Trạng thái + cảm biến ảo của 1 rover"""
+    def __init__(self, rover_id, world, index):
+        self.id = rover_id
+        self.world = world
+        sx, sy, syaw = world.start
+        # Nhiều rover xuất phát cách nhau 2 m theo trục y
+        self.x = sx
+        self.y = sy + 2.0 * index
+        self.theta = math.radians(syaw)
+        self.radius = ROBOT_WIDTH_M / 2
+        self.lock = threading.Lock()
+        self.gps = VirtualPort()
+        self.control = VirtualPort()
+        self.lidar = VirtualPort()
+        self.command = b'S'
+        self.command_time = 0.0
+        self.commands = 0
+        self.speed = 0.0
+        self.distance = 0.0
+        self.collisions = 0
+        self.in_contact = False
+        self.next_gps = 0.0
+        self.next_lidar = 0.0
+        self.rng = np.random.default_rng(index)
+        # Góc các tia LIDAR (độ, theo quy ước của LIDAR)
+        self.ray_angles = np.arange(SIM_LIDAR_RAYS) * (360.0 / SIM_LIDAR_RAYS)
+        # LIDAR đặt trước tâm xe
+        self.lidar_offset = ROBOT_LENGTH_M / 2 - LIDAR_FRONT_OFFSET_M
+
+    def config(self):
+        """Cấu hình rover dạng config.ROVERS trỏ vào các cổng ảo"""
+        return {
+            "gps_port": self.gps.path, "gps_baud": 115200,
+            "control_port": self.control.path, "control_baud": 115200,
+            "lidar_port": self.lidar.path, "lidar_baud": 115200,
+            "camera": f"sim:{self.id}",
+        }
+
+    def pose(self):
+        with self.lock:
+            return self.x, self.y, self.theta
+
+    def read_commands(self, wall_now):
+        data = self.control.read()
+        for byte in data:
+            cmd = bytes([byte])
+            if cmd in (b'T', b'L', b'R', b'S'):
+                self.command = cmd
+                self.command_time = wall_now
+                self.commands += 1
+            # 'N' (không vật cản) từ emergency monitor: không đổi chuyển động
+        # Lệnh chuyển động phải được gửi lặp lại, mất lệnh quá lâu thì dừng (như watchdog Arduino)
+        if wall_now - self.command_time > SIM_CMD_TIMEOUT_SEC:
+            self.command = b'S'
+
+    def step(self, dt):
+        v = SIM_SPEED_MPS if self.command == b'T' else 0.0
+        omega = {b'L': 1.0, b'R': -1.0}.get(self.command, 0.0) * math.radians(SIM_TURN_DPS)
+        with self.lock:
+            theta = self.theta + omega * dt
+            x = self.x + v * math.cos(theta) * dt
+            y = self.y + v * math.sin(theta) * dt
+            contact = v > 0 and self.world.clearance(x, y) < self.radius
+            if contact:
+                # Va chạm: đứng yên (chỉ đếm 1 lần mỗi lần chạm)
+                if not self.in_contact:
+                    self.collisions += 1
+                    print(f"[Sim:{self.id}] Collision at ({self.x:.2f}, {self.y:.2f})")
+                self.theta = theta
+                self.speed = 0.0
+            else:
+                self.distance += math.hypot(x - self.x, y - self.y)
+                self.x, self.y, self.theta = x, y, theta
+                self.speed = v
+            self.in_contact = contact
+
+    def yaw_deg(self):
+        """Yaw như ESP32: tăng khi quay trái, 0-360"""
+        return (math.degrees(self.theta) - MAP_YAW_OFFSET_DEG) % 360.0
+
+    def emit_gps(self):
+        x, y, _ = self.pose()
+        noise = self.rng.normal(0.0, SIM_GPS_NOISE_M, 2) if SIM_GPS_NOISE_M > 0 else (0.0, 0.0)
+        lat, lon = self.world.to_latlon(x + noise[0], y + noise[1])
+        self.gps.write(f"{self.yaw_deg():.2f},{lat:.7f},{lon:.7f},{self.speed:.2f}\n".encode())
+
+    def emit_lidar(self, others):
+        x, y, theta = self.pose()
+        ox = x + self.lidar_offset * math.cos(theta)
+        oy = y + self.lidar_offset * math.sin(theta)
+        sign = -1.0 if LIDAR_ANGLE_CLOCKWISE else 1.0
+        directions = theta + sign * np.radians(self.ray_angles)
+        ranges = self.world.raycast(ox, oy, directions, SIM_LIDAR_MAX_RANGE_M, others)
+        hit = np.isfinite(ranges)
+        dist_mm = ranges[hit] * 1000.0
+        if SIM_LIDAR_NOISE_MM > 0:
+            dist_mm += self.rng.normal(0.0, SIM_LIDAR_NOISE_MM, len(dist_mm))
+        lines = "".join(f"{d:.1f} {a:.2f}\n" for d, a in zip(dist_mm, self.ray_angles[hit]))
+        self.lidar.write(lines.encode())
+
+    def stats(self):
+        x, y, theta = self.pose()
+        return {
+            "x": round(x, 3), "y": round(y, 3), "yaw": round(self.yaw_deg(), 2),
+            "command": self.command.decode(),
+            "commands": self.commands,
+            "distance_m": round(self.distance, 2),
+            "collisions": self.collisions,
+            "ports": {"gps": self.gps.path, "control": self.control.path, "lidar": self.lidar.path},
+            "dropped_writes": self.gps.dropped + self.lidar.dropped
+        }
+
+
+class Simulator:
+    """
+    Vòng lặp mô phỏng (1 thread): mỗi SIM_STEP_SEC thời gian mô phỏng cập nhật chuyển động,
+    phát GPS / LIDAR theo tần số của chúng. Thời gian mô phỏng = SIM_SPEEDUP x thời gian thực.
+    """
+    def __init__(self, speedup=SIM_SPEEDUP):
+        self.speedup = speedup
+        self.world = None
+        self.rovers = {}
+        self.thread = None
+        self.sim_time = 0.0
+        self.started_at = None
+
+    def rover_configs(self, count=SIM_ROVERS, world_path=SIM_WORLD):
+        """Tạo các rover ảo (1 lần), trả về dict giống config.ROVERS"""
+        if not self.rovers:
+            self.world = SimWorld(load_world(world_path))
+            for index in range(count):
+                rover_id = DEFAULT_ROVER if index == 0 else f"sim{index + 1}"
+                self.rovers[rover_id] = SimRover(rover_id, self.world, index)
+        return {rover_id: rover.config() for rover_id, rover in self.rovers.items()}
+
+    def open_camera(self, rover_id):
+        """Mở camera ảo (đăng ký làm nguồn "sim:" của detect_stream)"""
+        return SimCamera(self.rovers[rover_id], SIM_CAMERA_FPS * self.speedup, video=SIM_CAMERA_VIDEO)
+
+    def time_per_meter(self):
+        """TIME_PER_METER_SEC khớp với tốc độ mô phỏng (route đi đúng quãng đường)"""
+        return 1.0 / (SIM_SPEED_MPS * self.speedup)
+
+    def start(self):
+        if self.thread is not None:
+            return False
+        self.rover_configs()
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self._run, name="simulator", daemon=True)
+        self.thread.start()
+        print(f"[Sim] Started {len(self.rovers)} rover(s) at {self.speedup}x real time")
+        return True
+
+    def _run(self):
+        wall_step = SIM_STEP_SEC / self.speedup
+        next_tick = time.monotonic()
+        rovers = list(self.rovers.values())
+        while True:
+            wall_now = time.monotonic()
+            for rover in rovers:
+                rover.read_commands(wall_now)
+                rover.step(SIM_STEP_SEC)
+            self.sim_time += SIM_STEP_SEC
+            for rover in rovers:
+                if self.sim_time >= rover.next_gps:
+                    rover.next_gps = self.sim_time + 1.0 / SIM_GPS_HZ
+                    rover.emit_gps()
+                if self.sim_time >= rover.next_lidar:
+                    rover.next_lidar = self.sim_time + 1.0 / SIM_LIDAR_HZ
+                    # Các rover khác là vật cản di động (phục vụ thử tracking)
+                    others = [(*r.pose()[:2], r.radius) for r in rovers if r is not rover]
+                    rover.emit_lidar(np.array(others).reshape(-1, 3) if others else None)
+            next_tick += wall_step
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1.0:
+                # Máy không theo kịp tốc độ yêu cầu: không cố đuổi
+                next_tick = time.monotonic()
+
+    def stats(self):
+        wall = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            "running": self.thread is not None,
+            "speedup": self.speedup,
+            "sim_time_sec": round(self.sim_time, 2),
+            "realtime_factor": round(self.sim_time / wall, 2) if wall > 0 else 0.0,
+            "rovers": {rover_id: rover.stats() for rover_id, rover in self.rovers.items()}
+        }
+
+
+# Global instance
+simulator = Simulator()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rover simulator (virtual serial ports)")
+    parser.add_argument("--rovers", type=int, default=SIM_ROVERS)
+    parser.add_argument("--speedup", type=float, default=SIM_SPEEDUP)
+    parser.add_argument("--world", default=SIM_WORLD)
+    args = parser.parse_args()
+
+    simulator = Simulator(args.speedup)
+    configs = simulator.rover_configs(args.rovers, args.world)
+    simulator.start()
+    print(f"[Sim] Set TIME_PER_METER_SEC = {simulator.time_per_meter():.3f} on the server")
+    print(json.dumps(configs, indent=4))
+    try:
+        while True:
+            time.sleep(5)
+            stats = simulator.stats()
+            print(f"[Sim] t={stats['sim_time_sec']}s ({stats['realtime_factor']}x) " +
+                  ", ".join(f"{rid}: ({r['x']}, {r['y']}) {r['command']}" for rid, r in stats["rovers"].items()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class Subsystem:
+    """Một thành phần khởi tạo lười (lazy): chỉ chạy init_fn khi cần lần đầu"""
+    def __init__(self, name, init_fn):
+        self.name = name
+        self.init_fn = init_fn
+        self.lock = threading.Lock()
+        self.ready_event = threading.Event()
+        self.state = "idle"  # idle | loading | ready | failed
+        self.value = None
+        self.error = None
+        self.load_time = 0.0
+
+    def _load(self):
+        """Chạy init_fn (chỉ 1 thread được chạy, các thread khác chờ)"""
+        with self.lock:
+            if self.state == "ready":
+                return self.value
+            self.state = "loading"
+            self.error = None
+            start = time.time()
+            try:
+                self.value = self.init_fn()
+                self.state = "ready"
+                self.load_time = time.time() - start
+                print(f"[Subsystem] {self.name} ready in {self.load_time * 1000:.0f}ms")
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                print(f"[Subsystem] {self.name} failed: {e}")
+            finally:
+                self.ready_event.set()
+            return self.value
+
+    def get(self):
+        """Lấy giá trị, khởi tạo đồng bộ nếu chưa có"""
+        if self.state == "ready":
+            return self.value
+        return self._load()
+
+    def start_async(self):
+        """Khởi tạo trong thread nền, không chặn request hiện tại"""
+        with self.lock:
+            if self.state in ("ready", "loading"):
+                return False
+            self.state = "loading"
+            self.ready_event.clear()
+        threading.Thread(target=self._load, name=f"init:{self.name}", daemon=True).start()
+        return True
+
+    def is_ready(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        """Chờ khởi tạo xong (ready hoặc failed)"""
+        self.ready_event.wait(timeout)
+        return self.is_ready()
+
+    def status(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "load_time_ms": round(self.load_time * 1000, 0)
+        }
+
+
+class SubsystemRegistry:
+    """Danh sách các subsystem khởi tạo lười của server"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subsystems = {}
+
+    def register(self, name, init_fn):
+        with self.lock:
+            if name not in self.subsystems:
+                self.subsystems[name] = Subsystem(name, init_fn)
+            return self.subsystems[name]
+
+    def get(self, name):
+        return self.subsystems[name].get()
+
+    def start_async(self, name):
+        return self.subsystems[name].start_async()
+
+    def status(self):
+        with self.lock:
+            return {name: sub.status() for name, sub in self.subsystems.items()}
+
+
+# Global instance
+registry = SubsystemRegistry()
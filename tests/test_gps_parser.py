@@ -0,0 +1,140 @@
+import struct
+
+import pytest
+
+from gps_parser import KNOTS_TO_MS, StreamParser, UbxDecoder, ubx_checksum
+
+
+def nmea(body):
+    """Câu NMEA đầy đủ với checksum đúng"""
+    checksum = 0
+    for b in body.encode("ascii"):
+        checksum ^= b
+    return f"${body}*{checksum:02X}\r\n".encode("ascii")
+
+
+def ubx_pvt(lat=21.0278, lon=105.8342, fix_type=3, fix_ok=True, gspeed_mm=1500):
+    """Khung UBX NAV-PVT hoàn chỉnh (sync + header + payload + checksum)"""
+    payload = UbxDecoder.PVT_FORMAT.pack(
+        0, 2024, 1, 1, 12, 30, 15, 0, 0, 0, fix_type, 0x01 if fix_ok else 0x00, 0, 9,
+        round(lon * 1e7), round(lat * 1e7), 0, 0, 1500, 2000, 0, 0, 0,
+        gspeed_mm, 0, 0, 0, 120)
+    body = bytes([0x01, 0x07]) + struct.pack("<H", len(payload)) + payload
+    return b"\xb5\x62" + body + bytes(ubx_checksum(body))
+
+
+# ---------- CSV ----------
+
+def test_csv_line():
+    parser = StreamParser()
+    [data] = parser.feed(b"12.5,21.0,105.8,0.7\n")
+    assert data == {"yaw": 12.5, "lat": 21.0, "lon": 105.8, "speed": 0.7}
+
+
+def test_csv_zero_position_keeps_only_yaw():
+    parser = StreamParser()
+    [data] = parser.feed(b"90.0,0,0\n")
+    assert data == {"yaw": 90.0}
+
+
+def test_csv_bad_number_counts_error():
+    parser = StreamParser()
+    assert parser.feed(b"abc,21.0,105.8\n") == []
+    assert parser.stats()["errors"] == 1
+
+
+# ---------- NMEA ----------
+
+GGA = "GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,"
+RMC = "GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W"
+
+
+def test_nmea_gga_position():
+    [data] = StreamParser().feed(nmea(GGA))
+    assert data["fix_quality"] == 1
+    assert data["hdop"] == pytest.approx(0.9)
+    assert data["lat"] == pytest.approx(48.1173)
+    assert data["lon"] == pytest.approx(11.516667)
+
+
+def test_nmea_bad_checksum_is_dropped():
+    parser = StreamParser()
+    line = nmea(GGA).replace(b"*", b"0*", 1)
+    assert parser.feed(line) == []
+    assert parser.stats()["errors"] == 1
+
+
+def test_nmea_gga_fix_with_empty_position_has_no_lat_lon():
+    [data] = StreamParser().feed(nmea("GPGGA,123519,,,,,1,08,0.9,545.4,M,46.9,M,,"))
+    assert data["fix_quality"] == 1
+    assert "lat" not in data and "lon" not in data
+
+
+def test_nmea_gga_half_position_has_no_lat_lon():
+    [data] = StreamParser().feed(nmea("GPGGA,123519,4807.038,N,,,1,08,0.9,545.4,M,46.9,M,,"))
+    assert "lat" not in data and "lon" not in data
+
+
+def test_nmea_rmc_void_has_no_position():
+    [data] = StreamParser().feed(nmea("GPRMC,123519,V,,,,,,,230394,,"))
+    assert data["fix_quality"] == 0
+    assert "lat" not in data
+
+
+def test_nmea_rmc_valid_with_empty_position_keeps_speed_only():
+    [data] = StreamParser().feed(nmea("GPRMC,123519,A,,,,,010.0,,230394,,"))
+    assert "lat" not in data and "lon" not in data
+    assert data["speed"] == pytest.approx(10.0 * KNOTS_TO_MS)
+
+
+def test_nmea_vtg_speed():
+    [data] = StreamParser().feed(nmea("GPVTG,054.7,T,034.4,M,005.5,N,010.2,K"))
+    assert data["course"] == pytest.approx(54.7)
+    assert data["speed"] == pytest.approx(10.2 / 3.6)
+
+
+def test_nmea_split_across_chunks():
+    parser = StreamParser()
+    raw = nmea(GGA) + nmea(RMC)
+    results = []
+    for i in range(0, len(raw), 7):
+        results += parser.feed(raw[i:i + 7])
+    assert len(results) == 2
+    assert results[1]["speed"] == pytest.approx(22.4 * KNOTS_TO_MS)
+    assert parser.stats()["errors"] == 0
+
+
+# ---------- UBX ----------
+
+def test_ubx_nav_pvt():
+    [data] = StreamParser().feed(ubx_pvt())
+    assert data["fix_quality"] == 3
+    assert data["lat"] == pytest.approx(21.0278)
+    assert data["lon"] == pytest.approx(105.8342)
+    assert data["speed"] == pytest.approx(1.5)
+
+
+def test_ubx_no_fix_has_no_position():
+    [data] = StreamParser().feed(ubx_pvt(fix_ok=False))
+    assert data["fix_quality"] == 0
+    assert "lat" not in data
+
+
+def test_ubx_bad_checksum_is_dropped():
+    parser = StreamParser()
+    frame = bytearray(ubx_pvt())
+    frame[-1] ^= 0xFF
+    assert parser.feed(bytes(frame)) == []
+    assert parser.stats()["errors"] >= 1
+
+
+def test_ubx_split_byte_by_byte_between_text():
+    parser = StreamParser()
+    raw = nmea(GGA) + ubx_pvt() + b"45.0,21.0,105.8\n"
+    results = []
+    for i in range(len(raw)):
+        results += parser.feed(raw[i:i + 1])
+    assert len(results) == 3
+    assert results[1]["lat"] == pytest.approx(21.0278)
+    assert results[2]["yaw"] == 45.0
+    assert parser.stats()["messages"] == {"nmea": 1, "ubx": 1, "csv": 1}
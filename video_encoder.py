@@ -0,0 +1,409 @@
+"""
+Stream H.264 cho camera qua encoder tiến trình ngoài (ffmpeg hoặc GStreamer).
+
+Frame thô BGR được ghi vào stdin của encoder, encoder xuất fragmented MP4 ra stdout nên
+trình duyệt phát trực tiếp bằng thẻ <video>. Mỗi camera chỉ có 1 encoder, output được chia
+cho mọi người xem (H264Broadcaster). Thứ tự thử encoder (H264_ENCODERS trong
+detect_stream): encoder phần cứng V4L2 của Pi nếu có thiết bị, sau đó x264 phần mềm -
+chạy được trên mọi máy Linux có ffmpeg hoặc gst-launch-1.0.
+"""
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+
+import cv2
+
+# Codec cần thiết bị V4L2 memory-to-memory (encoder phần cứng của Raspberry Pi)
+HW_CODECS = ("h264_v4l2m2m", "v4l2h264enc")
+
+
+def ffmpeg_command(width, height, fps, codec, bitrate, gop):
+    """ffmpeg: rawvideo BGR từ stdin -> H.264 fragmented MP4 ra stdout"""
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps),
+           # Camera không đều FPS: lấy timestamp theo thời điểm frame đến
+           "-use_wallclock_as_timestamps", "1", "-i", "-",
+           "-c:v", codec, "-b:v", str(bitrate), "-g", str(gop), "-pix_fmt", "yuv420p"]
+    if codec == "libx264":
+        cmd += ["-preset", "ultrafast", "-tune", "zerolatency"]
+    cmd += ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-"]
+    return cmd
+
+
+def gstreamer_command(width, height, fps, codec, bitrate, gop):
+    """GStreamer: cùng pipeline với ffmpeg (fdsrc -> encoder -> mp4mux phân mảnh -> fdsink)"""
+    if codec == "x264enc":
+        encoder = ["x264enc", "tune=zerolatency", "speed-preset=ultrafast",
+                   f"bitrate={int(bitrate) // 1000}", f"key-int-max={gop}"]
+    else:
+        encoder = [codec, f"extra-controls=controls,video_bitrate={int(bitrate)}"]
+    return (["gst-launch-1.0", "-q", "fdsrc", "fd=0", "!",
+             "rawvideoparse", f"width={width}", f"height={height}", "format=bgr", f"framerate={fps}/1", "!",
+             "videoconvert", "!", "video/x-raw,format=I420", "!"] + encoder +
+            ["!", "h264parse", "!", "mp4mux", "fragment-duration=500", "streamable=true", "!",
+             "fdsink", "fd=1"])
+
+
+COMMANDS = {"ffmpeg": ffmpeg_command, "gstreamer": gstreamer_command}
+
+
+def encoder_available(backend, codec, hw_device):
+    """Kiểm tra chương trình + codec có trên máy (codec phần cứng cần thiết bị hw_device)"""
+    if codec in HW_CODECS and not (hw_device and os.path.exists(hw_device)):
+        return False
+    try:
+        if backend == "ffmpeg":
+            if shutil.which("ffmpeg") is None:
+                return False
+            out = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True,
+                                 text=True, timeout=10)
+            return f" {codec} " in out.stdout
+        if backend == "gstreamer":
+            if shutil.which("gst-launch-1.0") is None or shutil.which("gst-inspect-1.0") is None:
+                return False
+            return subprocess.run(["gst-inspect-1.0", codec], capture_output=True, timeout=10).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return False
+
+
+class EncoderSelector:
+    """Chọn encoder H.264 đầu tiên dùng được theo thứ tự ưu tiên (kiểm tra 1 lần mỗi process)"""
+    def __init__(self, candidates, hw_device):
+        self.candidates = candidates
+        self.hw_device = hw_device
+        self.lock = threading.Lock()
+        self.checked = False
+        self.choice = None
+
+    def select(self):
+        with self.lock:
+            if not self.checked:
+                for backend, codec in self.candidates:
+                    if encoder_available(backend, codec, self.hw_device):
+                        self.choice = (backend, codec)
+                        print(f"[H264] Using {backend} / {codec}")
+                        break
+                else:
+                    print("[H264] No H.264 encoder available (install ffmpeg or gstreamer)")
+                self.checked = True
+            return self.choice
+
+
+def _read_exact(stream, size):
+    """Đọc đúng size byte (None nếu stream hết trước)"""
+    parts = []
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            return None
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+def read_box(stream):
+    """Đọc 1 box MP4 nguyên vẹn từ stream: (loại, bytes gồm cả header), None khi hết dữ liệu"""
+    header = _read_exact(stream, 8)
+    if header is None:
+        return None
+    size, kind = struct.unpack(">I4s", header)
+    if size == 1:
+        ext = _read_exact(stream, 8)
+        if ext is None:
+            return None
+        header += ext
+        size = struct.unpack(">Q", ext)[0]
+    elif size == 0:
+        # Box kéo dài tới hết stream
+        return kind.decode("latin-1"), header + stream.read()
+    body = _read_exact(stream, size - len(header))
+    if body is None:
+        return None
+    return kind.decode("latin-1"), header + body
+
+
+def iter_boxes(data, offset=0, end=None):
+    """Duyệt các box con trong data[offset:end]: (loại, vị trí nội dung, vị trí kết thúc)"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        body = offset + 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, body)[0]
+            body += 8
+        elif size == 0:
+            size = end - offset
+        if size < body - offset:
+            return
+        yield kind.decode("latin-1"), body, offset + size
+        offset += size
+
+
+def trex_sample_flags(moov):
+    """default_sample_flags của track đầu tiên trong moov/mvex/trex (None nếu không có)"""
+    for kind, body, end in iter_boxes(moov):
+        if kind != "moov":
+            continue
+        for kind, body, end in iter_boxes(moov, body, end):
+            if kind != "mvex":
+                continue
+            for kind, body, end in iter_boxes(moov, body, end):
+                if kind == "trex" and end - body >= 24:
+                    return struct.unpack_from(">I", moov, body + 20)[0]
+    return None
+
+
+NON_SYNC_SAMPLE = 0x10000  # Cờ sample_is_non_sync_sample trong sample flags (ISO/IEC 14496-12)
+
+
+def fragment_is_keyframe(moof, default_flags=None):
+    """
+    Fragment (moof) bắt đầu bằng keyframe? Lấy cờ của mẫu đầu tiên theo thứ tự ưu tiên
+    trun.first_sample_flags -> cờ mẫu trong trun -> tfhd.default_sample_flags -> trex.
+    Không đọc được cờ nào thì coi là keyframe.
+    """
+    flags = None
+    for kind, body, end in iter_boxes(moof):
+        if kind != "moof":
+            continue
+        for kind, body, end in iter_boxes(moof, body, end):
+            if kind != "traf":
+                continue
+            for kind, pos, box_end in iter_boxes(moof, body, end):
+                box_flags = struct.unpack_from(">I", moof, pos)[0] & 0xFFFFFF
+                if kind == "tfhd":
+                    pos += 8                    # version/flags + track_ID
+                    for bit, size in ((0x1, 8), (0x2, 4), (0x8, 4), (0x10, 4)):
+                        if box_flags & bit:
+                            pos += size
+                    if box_flags & 0x20 and pos + 4 <= box_end:
+                        default_flags = struct.unpack_from(">I", moof, pos)[0]
+                elif kind == "trun":
+                    pos += 8                    # version/flags + sample_count
+                    if box_flags & 0x1:
+                        pos += 4                # data_offset
+                    if box_flags & 0x4:
+                        flags = struct.unpack_from(">I", moof, pos)[0]
+                    elif box_flags & 0x400:
+                        pos += 4 * bool(box_flags & 0x100) + 4 * bool(box_flags & 0x200)
+                        flags = struct.unpack_from(">I", moof, pos)[0]
+            # Chỉ xét track đầu tiên (stream chỉ có video)
+            break
+    if flags is None:
+        flags = default_flags
+    return flags is None or not flags & NON_SYNC_SAMPLE
+
+
+class H264Broadcaster:
+    """
+    1 tiến trình encoder H.264 cho 1 camera, phát fragmented MP4 cho mọi người xem
+    (giống FrameBroadcaster với MJPEG):
+    - Thread nạp frame đọc frame thô mới nhất (bỏ frame khi encoder chậm) ghi vào stdin
+    - Thread đọc tách output thành init segment (ftyp + moov, giữ lại cho người xem sau) và
+      các fragment (moof + mdat) đánh dấu keyframe, lưu backlog fragment gần nhất
+    - Người xem mới nhận init segment rồi bắt đầu từ fragment keyframe kế tiếp; người xem
+      chậm bị đẩy khỏi backlog thì bỏ qua tới keyframe kế tiếp
+    - Encoder dừng khi không còn người xem sau idle_timeout giây
+    """
+    def __init__(self, frame_source, backend, codec, fps, bitrate, gop, max_width=None,
+                 backlog=16, idle_timeout=2.0, name="h264"):
+        self.frame_source = frame_source  # Hàm trả về generator frame thô (FrameBroadcaster.raw_frames)
+        self.backend = backend
+        self.codec = codec
+        self.fps = fps
+        self.bitrate = bitrate
+        self.gop = gop
+        self.max_width = max_width
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self.cond = threading.Condition()
+        self.running = False
+        self.generation = 0     # Tăng mỗi lần khởi động encoder (luồng MP4 mới)
+        self.init_segment = None
+        self.fragments = deque(maxlen=backlog)  # (seq, keyframe, bytes)
+        self.seq = 0
+        self.clients = 0
+        self.size = None
+        self.frames_in = 0
+        self.bytes_out = 0
+        self.bytes_sent = 0
+        self.keyframes = 0
+        self.resyncs = 0
+        self.last_error = None
+
+    def _resize(self, frame):
+        if self.max_width and frame.shape[1] > self.max_width:
+            scale = self.max_width / frame.shape[1]
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # yuv420p cần kích thước chẵn
+        h, w = frame.shape[:2]
+        if w % 2 or h % 2:
+            frame = frame[:h - h % 2, :w - w % 2]
+        return frame
+
+    def _ensure_running(self):
+        # Gọi khi đang giữ self.cond
+        if self.running:
+            return
+        self.running = True
+        self.generation += 1
+        self.init_segment = None
+        self.fragments.clear()
+        threading.Thread(target=self._feed, args=(self.generation,), name=f"{self.name}_feed",
+                         daemon=True).start()
+
+    def _stop(self, generation, error=None):
+        # Gọi khi đang giữ self.cond
+        if self.generation == generation and self.running:
+            self.running = False
+            if error:
+                self.last_error = error
+            self.cond.notify_all()
+
+    def _feed(self, generation):
+        frames = self.frame_source()
+        proc = None
+        idle_since = None
+        try:
+            for frame in frames:
+                frame = self._resize(frame)
+                if proc is None:
+                    self.size = frame.shape[:2]
+                    cmd = COMMANDS[self.backend](self.size[1], self.size[0], self.fps, self.codec,
+                                                 self.bitrate, self.gop)
+                    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, bufsize=0)
+                    threading.Thread(target=self._read, args=(proc, generation), name=f"{self.name}_read",
+                                     daemon=True).start()
+                    print(f"[H264] {self.name}: encoder started ({self.backend} / {self.codec}, "
+                          f"{self.size[1]}x{self.size[0]})")
+                elif frame.shape[:2] != self.size:
+                    frame = cv2.resize(frame, (self.size[1], self.size[0]), interpolation=cv2.INTER_AREA)
+                proc.stdin.write(frame.tobytes())
+                self.frames_in += 1
+                with self.cond:
+                    if self.generation != generation or not self.running:
+                        break
+                    if self.clients > 0:
+                        idle_since = None
+                    elif idle_since is None:
+                        idle_since = time.time()
+                    elif time.time() - idle_since > self.idle_timeout:
+                        self._stop(generation)
+                        print(f"[H264] {self.name}: encoder stopped (no viewers)")
+                        break
+        except (BrokenPipeError, ValueError, OSError) as e:
+            with self.cond:
+                self._stop(generation, f"Encoder input error: {e}")
+        finally:
+            frames.close()
+            if proc is not None:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+                try:
+                    proc.wait(timeout=2.0)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+
+    def _read(self, proc, generation):
+        """Tách output của encoder thành init segment + fragment và phát cho người xem"""
+        head = []
+        moof = None
+        default_flags = None
+        try:
+            while True:
+                box = read_box(proc.stdout)
+                if box is None:
+                    break
+                kind, data = box
+                self.bytes_out += len(data)
+                if kind in ("ftyp", "moov"):
+                    head.append(data)
+                    if kind == "moov":
+                        default_flags = trex_sample_flags(data)
+                        with self.cond:
+                            if self.generation == generation:
+                                self.init_segment = b"".join(head)
+                                self.cond.notify_all()
+                elif kind == "moof":
+                    moof = data
+                elif kind == "mdat" and moof is not None:
+                    keyframe = fragment_is_keyframe(moof, default_flags)
+                    with self.cond:
+                        if self.generation != generation:
+                            break
+                        self.seq += 1
+                        self.fragments.append((self.seq, keyframe, moof + data))
+                        self.keyframes += keyframe
+                        self.cond.notify_all()
+                    moof = None
+        finally:
+            with self.cond:
+                self._stop(generation, f"Encoder exited (code {proc.poll()})")
+
+    def chunks(self):
+        """Generator dữ liệu MP4 cho 1 người xem: init segment rồi các fragment từ keyframe kế tiếp"""
+        with self.cond:
+            self.clients += 1
+            self._ensure_running()
+            generation = self.generation
+        try:
+            with self.cond:
+                while not self.cond.wait_for(lambda: self.init_segment is not None or not self.running
+                                             or self.generation != generation, timeout=1.0):
+                    pass
+                if self.init_segment is None or self.generation != generation:
+                    return
+                init = self.init_segment
+                last = self.seq
+            yield init
+            waiting_key = True
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.seq > last or not self.running
+                                              or self.generation != generation, timeout=1.0):
+                        continue
+                    # Encoder khởi động lại: luồng MP4 mới không nối tiếp được luồng cũ
+                    if self.generation != generation or (self.seq == last and not self.running):
+                        return
+                    batch = [item for item in self.fragments if item[0] > last]
+                    if batch and batch[0][0] != last + 1 and not waiting_key:
+                        # Người xem chậm, fragment đã rời backlog -> chờ keyframe để giải mã lại được
+                        waiting_key = True
+                        self.resyncs += 1
+                    last = self.seq
+                for seq, keyframe, data in batch:
+                    if waiting_key and not keyframe:
+                        continue
+                    waiting_key = False
+                    yield data
+                    with self.cond:
+                        self.bytes_sent += len(data)
+        finally:
+            with self.cond:
+                self.clients -= 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                "running": self.running,
+                "encoder": f"{self.backend} / {self.codec}",
+                "size": [self.size[1], self.size[0]] if self.size else None,
+                "clients": self.clients,
+                "restarts": max(0, self.generation - 1),
+                "frames_in": self.frames_in,
+                "fragments": self.seq,
+                "keyframes": self.keyframes,
+                "resyncs": self.resyncs,
+                "bytes_out": self.bytes_out,
+                "bytes_sent": self.bytes_sent,
+                "last_error": self.last_error
+            }
@@ -0,0 +1,9 @@
+"""
+Entry point WSGI cho server bên ngoài, ví dụ:
+    waitress-serve --threads=48 --port=5000 --outbuf-high-watermark=1048576 wsgi:app
+Chỉ chạy 1 process (không dùng nhiều worker) vì các thread phần cứng
+(serial, LIDAR, emergency monitor) giữ cổng COM độc quyền.
+"""
+from app import app, start_background_threads
+
+start_background_threads()